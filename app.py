@@ -1,57 +1,63 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response
-from flask_sqlalchemy import SQLAlchemy
+from flask import Blueprint, Flask, Response, abort, current_app, render_template, request, redirect, url_for, session, jsonify, flash, make_response, send_file, stream_with_context
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, time, timedelta, date
 import calendar as pycalendar
+import click
 from collections import defaultdict
+import json
+import os
 import random
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from io import BytesIO
+from time import perf_counter
+
+from models import (db, User, Booking, BookingException, DayStatus, Job, RevenueDay, SlotHold, MAX_OCCURRENCES,
+                    booking_interval, occurrence_count, upgrade_schema)
+from database import configure_database, begin_write
+from conflicts import bookings_in, find_conflicts, describe_conflicts, series_conflicts
+from occupancy import day_statuses, rebuild_occupancy, venue_overview
+from availability import find_free_windows
+from search import bookings_page, filter_bookings
+from reports import MAX_DAYS, MAX_MONTHS, daily_report, monthly_report, rebuild_rollups
+import assets
+import changefeed
+import holds
+import httpcache
+import jobs
+import metrics
+import receipts
+from receipts import cached_receipt_pdf, receipt_key
+from exports import statement_title, stream_receipts_zip, stream_bookings_csv, stream_bookings_xlsx
+from importer import import_bookings, write_rejects
+from bulk import apply_plan, items_from_filters, items_from_keys, plan_bulk
+from httpcache import cached_view, ensure_data_version
+from changefeed import STATUS_COLORS, change_stream, event_status, hold_delta
+from recurrence import occurrence_at, occurrences, parse_recurrence, series_summary, skipped_starts
+from holds import active_holds_query, conflicting_holds, consume_hold, describe_holds, place_hold, release_hold
+from enquiries import enquiry_page, enquiry_spool, normalize_phone
+from venues import add_venue, all_venues, default_venue, ensure_venues, find_venue, venue_from_args
+from audit import audit_writer, audit_page, iter_audit, archive_audit, backfill_audit_kinds, ACTION_KINDS
 
 
 # ---------------- Config ----------------
 ADMIN_USERNAME = 'Shahul'   # change if you want a different admin username
 SECRET_KEY = 'replace-with-a-secure-random-key'
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = SECRET_KEY
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../instance/models.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
-
-# ---------- Models ----------
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    pw_hash = db.Column(db.String(255), nullable=False)
-
-class Booking(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(200), nullable=False)
-    phone = db.Column(db.Integer, nullable=False)
-    email = db.Column(db.String(120), nullable=False)
-    details = db.Column(db.Text)
-    from_date = db.Column(db.Date, nullable=False)
-    to_date = db.Column(db.Date, nullable=False)
-    from_time = db.Column(db.String(20), nullable=False)
-    to_time = db.Column(db.String(20), nullable=False)
-    total_amount = db.Column(db.Float, nullable=False, default=0)
-    advance = db.Column(db.Float, nullable=False, default=0)
-    balance = db.Column(db.Float, nullable=False, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-
-class AuditLog(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    action = db.Column(db.String(255))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.Column(db.String(80), nullable=True)
+bp = Blueprint('main', __name__, cli_group=None)
 
 # ---------- Helpers ----------
 def init_db():
-    db.create_all()
+    upgrade_schema()
+    ensure_venues()
+    need_occupancy = not DayStatus.query.first() and Booking.query.first()
+    need_rollups = not RevenueDay.query.first() and Booking.query.first()
+    # The rebuilds write on their own connections; end this read first so the
+    # session's later writes do not start from a stale snapshot.
+    db.session.commit()
+    if need_occupancy:
+        rebuild_occupancy()
+    if need_rollups:
+        rebuild_rollups()
+    backfill_audit_kinds()
+    ensure_data_version()
 
     # --- Create admin account if not exists ---
     if not User.query.filter_by(username=ADMIN_USERNAME).first():
@@ -70,30 +76,122 @@ def init_db():
 
 
 def generate_time_slots(interval_minutes=30):
-    slots = []
-    t = datetime.combine(date.today(), time(0, 0))
-    total = 24 * 60 // interval_minutes
-    for _ in range(total):
-        slots.append(t.strftime('%I:%M %p'))
-        t += timedelta(minutes=interval_minutes)
-    return slots
-
-def log_action(action, user=None):
-    a = AuditLog(action=action, user=user)
-    db.session.add(a)
+    """Form time labels ('12:00 AM', '12:30 AM', ...) in TIME_FORMAT."""
+    return [f"{(m // 60) % 12 or 12:02d}:{m % 60:02d} {'AM' if m < 12 * 60 else 'PM'}"
+            for m in range(0, 24 * 60, interval_minutes)]
+
+TIME_SLOTS = tuple(generate_time_slots(30))
+
+
+@bp.app_context_processor
+def template_helpers():
+    return {'all_venues': all_venues}
+
+def log_action(action, user=None, join=False):
+    """Record an audit entry.
+
+    With ``join=True`` the entry is added to the current session and commits
+    with the caller's transaction; otherwise it is queued for the background
+    group-commit writer.
+    """
+    if join:
+        audit_writer.add(action, user)
+    else:
+        audit_writer.enqueue(action, user)
+
+@bp.cli.command('rebuild-occupancy')
+def rebuild_occupancy_command():
+    """Recompute the per-day occupancy table from all bookings."""
+    upgrade_schema()
+    print(f"Rebuilt occupancy for {rebuild_occupancy()} days.")
+
+@bp.cli.command('rebuild-reports')
+def rebuild_reports_command():
+    """Recompute the daily and monthly revenue rollups from all bookings."""
+    upgrade_schema()
+    print(f"Rebuilt revenue rollups for {rebuild_rollups()} days.")
+
+@bp.cli.command('add-venue')
+@click.argument('name')
+@click.option('--address', default=None, help='Printed under the name on receipts.')
+@click.option('--slug', default=None, help='URL name (default: from the name).')
+@click.option('--phone', default=None, help='Contact phone printed on receipts.')
+@click.option('--email', default=None, help='Contact email printed on receipts.')
+def add_venue_command(name, address, slug, phone, email):
+    """Add a hall that can be booked."""
+    upgrade_schema()
+    try:
+        venue = add_venue(name, address, slug, phone, email)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
     db.session.commit()
-
-# Make sure DB is created once (Flask 3 compatibility)
-@app.before_request
-def setup_once():
-    if not getattr(app, "_db_initialized", False):
-        init_db()
-        app._db_initialized = True
+    print(f"Added venue {venue.id}: {venue.name} (?venue={venue.slug}).")
+
+@bp.cli.command('ingest-enquiries')
+def ingest_enquiries_command():
+    """Insert spooled public enquiries now instead of waiting for the ingester."""
+    upgrade_schema()
+    print(f"Ingested {enquiry_spool.drain()} enquiries.")
+
+@bp.cli.command('run-jobs')
+@click.option('--workers', type=int, default=None, help='Worker processes (default JOB_WORKERS).')
+def run_jobs_command(workers):
+    """Run queued background jobs (receipts, exports) until stopped."""
+    upgrade_schema()
+    db.engine.dispose()
+    jobs.run_pool(current_app._get_current_object(), workers or current_app.config['JOB_WORKERS'])
+
+@bp.cli.command('archive-audit')
+@click.option('--days', type=int, default=None, help='Keep this many days live (default AUDIT_RETENTION_DAYS).')
+def archive_audit_command(days):
+    """Move old audit rows into compressed monthly archive segments."""
+    upgrade_schema()
+    audit_writer.flush()
+    days = current_app.config['AUDIT_RETENTION_DAYS'] if days is None else days
+    moved = archive_audit(datetime.utcnow() - timedelta(days=days))
+    print(f"Archived {moved} audit entries older than {days} days.")
+
+@bp.cli.command('import-bookings')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Rows per insert transaction.')
+@click.option('--dry-run', is_flag=True, help='Validate only; insert nothing.')
+@click.option('--rejects', 'rejects_path', type=click.Path(dir_okay=False), help='Write rejected rows to this CSV.')
+def import_bookings_command(path, batch_size, dry_run, rejects_path):
+    """Import bookings from a CSV (or XLSX) file in the export's column layout."""
+    upgrade_schema()
+    try:
+        report = import_bookings(path, batch_size=batch_size, dry_run=dry_run)
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    verb = "Would import" if dry_run else "Imported"
+    print(f"{verb} {report.accepted if dry_run else report.inserted} bookings; {len(report.rejects)} rejected.")
+    for line_no, reason in report.rejects[:20]:
+        print(f"  line {line_no}: {reason}")
+    if len(report.rejects) > 20:
+        print(f"  ... and {len(report.rejects) - 20} more")
+    if rejects_path and report.rejects:
+        print(f"Rejects written to {write_rejects(rejects_path, report.rejects)}")
+    if not dry_run and report.inserted:
+        log_action(f"Bookings imported from {os.path.basename(path)}: {report.inserted} added, "
+                   f"{len(report.rejects)} rejected")
+
+@bp.cli.command('build-assets')
+@click.option('--force', is_flag=True, help='Re-encode every image even if unchanged.')
+@click.option('--clean', is_flag=True, help='Remove static/dist instead of building.')
+@click.option('--workers', type=int, default=None, help='Encoding processes (default: one per CPU).')
+def build_assets_command(force, clean, workers):
+    """Fingerprint static files and generate responsive image variants."""
+    if clean:
+        assets.clean_assets(current_app.static_folder)
+        print("Removed built assets.")
+        return
+    manifest = assets.build_assets(current_app.static_folder, force=force, workers=workers)
+    print(f"Built {len(manifest['files'])} files and {len(manifest['images'])} images.")
 
 # ---------- Routes ----------
 
 
-@app.route('/login7621', methods=['GET', 'POST'])
+@bp.route('/login7621', methods=['GET', 'POST'])
 def login():
     # Login page uses a special background and hides nav/logout
     if request.method == 'POST':
@@ -103,34 +201,70 @@ def login():
         if user and check_password_hash(user.pw_hash, password):
             session['user'] = username
             log_action(f'User {username} logged in', username)
-            return redirect(url_for('home'))
+            return redirect(url_for('main.home'))
         flash('Invalid credentials', 'danger')
     return render_template('login.html', title='Login')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     user = session.pop('user', None)
     if user:
         log_action(f'User {user} logged out', user)
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/home')
+@bp.route('/home')
 def home():
     if not session.get('user'):
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('home.html', hide_nav=True, user=session.get('user'),admin_username=ADMIN_USERNAME)
 
 
-@app.route('/booking/new', methods=['GET', 'POST'])
+def describe_series_clashes(b, hold_token=None):
+    """Flash text for a new or edited series whose occurrences clash with
+    bookings, holds or each other, or None when every occurrence is free."""
+    with db.session.no_autoflush:
+        b.sync_interval()
+        count = occurrence_count(b)
+        if not count:
+            return "The series ends before its first occurrence."
+        if count > MAX_OCCURRENCES:
+            return f"A series can have at most {MAX_OCCURRENCES} occurrences; choose an earlier end date."
+        skip = skipped_starts([b.id]).get(b.id, ()) if b.id else ()
+        intervals = list(occurrences(b, skip=skip))
+        if not intervals:
+            return None
+        held = conflicting_holds(intervals[0][0], intervals[-1][1], exclude_token=hold_token, venue_id=b.venue_id,
+                                 user=session.get('user'))
+        hits = series_conflicts(intervals, exclude_id=b.id, extra=[(h.start_at, h.end_at, h) for h in held],
+                                venue_id=b.venue_id)
+        if not hits:
+            return None
+        parts = []
+        for start in sorted(hits)[:3]:
+            ident = hits[start]
+            if isinstance(ident, SlotHold):
+                what = f"held by {ident.user}"
+            elif isinstance(ident, tuple):
+                what = "overlaps the previous occurrence"
+            else:
+                what = db.session.get(Booking, ident).name
+            parts.append(f"{start:%Y-%m-%d %I:%M %p} ({what})")
+        if len(hits) > 3:
+            parts.append(f"and {len(hits) - 3} more")
+        return f"{len(hits)} of {len(intervals)} occurrences clash: {', '.join(parts)}"
+
+
+@bp.route('/booking/new', methods=['GET', 'POST'])
 def booking_new():
     if not session.get('user'):
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
    
 
-    slots = generate_time_slots(30)
+    slots = TIME_SLOTS
     today_str = date.today().isoformat()
 
     if request.method == 'POST':
+        begin_write()
         name = request.form['name']
         phone = request.form.get('phone', '').strip() or None
         email = request.form.get('email', '').strip() or None
@@ -142,34 +276,37 @@ def booking_new():
         total_amount = request.form['total_amount']
         advance = request.form['advance']
         balance = request.form['balance']
+        venue = find_venue(request.form.get('venue_id')) or default_venue()
 
         
-                # ---- Overlap / Duplicate Booking Check ----
-        def time_to_minutes(t):
-            dt = datetime.strptime(t, '%I:%M %p')
-            return dt.hour * 60 + dt.minute
-
-        new_start = time_to_minutes(from_time)
-        new_end = time_to_minutes(to_time)
-
-        overlapping = False
-        existing = Booking.query.filter(Booking.to_date >= from_date, Booking.from_date <= to_date).all()
-
-        for existing_b in existing:
-            exist_start = time_to_minutes(existing_b.from_time)
-            exist_end = time_to_minutes(existing_b.to_time)
-            if (
-                (from_date <= existing_b.to_date and to_date >= existing_b.from_date)
-                and (new_start < exist_end and new_end > exist_start)
-            ):
-                overlapping = True
-                break
+        try:
+            rule = parse_recurrence(request.form)
+        except ValueError as e:
+            flash(f"⚠️ {e}", "danger")
+            return render_template('booking_form.html', time_slots=slots, today=today_str)
+
+        try:
+            start_at, end_at = booking_interval(from_date, from_time, to_date, to_time)
+        except ValueError as e:
+            flash(f"⚠️ {e}", "danger")
+            return render_template('booking_form.html', time_slots=slots, today=today_str)
+
+        # ---- Overlap / Duplicate Booking Check ----
+        # (a series is checked occurrence by occurrence below)
+        conflicts = [] if rule['recurrence'] else find_conflicts(start_at, end_at, venue_id=venue.id)
         if not phone:
             flash("⚠️ Phone number is required.", "danger")
             return render_template('booking_form.html', time_slots=slots, today=today_str)
 
-        if overlapping:
-            flash("⚠️ This booking overlaps with another booking!", "danger")
+        if conflicts:
+            flash(f"⚠️ This booking overlaps with another booking: {describe_conflicts(conflicts)}", "danger")
+            return render_template('booking_form.html', time_slots=slots, today=today_str)
+
+        hold_token = request.form.get('hold_token') or None
+        held = [] if rule['recurrence'] else conflicting_holds(start_at, end_at, exclude_token=hold_token,
+                                                              venue_id=venue.id, user=session.get('user'))
+        if held:
+            flash(f"⚠️ This slot is on hold: {describe_holds(held)}", "danger")
             return render_template('booking_form.html', time_slots=slots, today=today_str)
         
         email = request.form.get('email', '').strip()
@@ -180,6 +317,7 @@ def booking_new():
 
         # ✅ Save booking
         b = Booking(
+            venue_id=venue.id,
             name=name,
             phone=int(phone),
             email=email,
@@ -191,296 +329,567 @@ def booking_new():
             total_amount=total_amount,
             advance=advance,
             balance=balance,
+            **rule,
         )
+        if b.recurrence:
+            clashes = describe_series_clashes(b, hold_token)
+            if clashes:
+                flash(f"⚠️ {clashes}", "danger")
+                return render_template('booking_form.html', time_slots=slots, today=today_str)
         db.session.add(b)
+        consume_hold(hold_token, session.get('user'))
+        repeat = f" ({series_summary(b)})" if b.recurrence else ""
+        log_action(f"Booking created by {session.get('user')}: {name} {from_date} {from_time} {to_date} {to_time}{repeat} at {venue.name}", session.get('user'), join=True)
         db.session.commit()
-        log_action(f"Booking created by {session.get('user')}: {name} {from_date} {from_time} {to_date} {to_time}", session.get('user'))
         flash("✅ Booking created successfully!", "success")
-        return redirect(url_for('bookings', view=b.id))
+        return redirect(url_for('main.bookings', view=b.id))
 
     return render_template('booking_form.html', time_slots=slots, today=today_str)
 
-@app.route('/booking/<int:booking_id>/edit', methods=['GET', 'POST'])
+@bp.route('/booking/<int:booking_id>/edit', methods=['GET', 'POST'])
 def edit_booking(booking_id):
     if not session.get('user'):
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     b = Booking.query.get_or_404(booking_id)
-    slots = generate_time_slots(30)
+    slots = TIME_SLOTS
 
     if request.method == 'POST':
+        begin_write()
+        from_date = datetime.strptime(request.form['from_date'], '%Y-%m-%d').date()
+        to_date = datetime.strptime(request.form['to_date'], '%Y-%m-%d').date()
+        # Checked before touching ``b``: the next autoflush would sync its interval.
+        try:
+            start_at, end_at = booking_interval(from_date, request.form['from_time'], to_date, request.form['to_time'])
+        except ValueError as e:
+            flash(f"⚠️ {e}", "danger")
+            return render_template('booking_form.html', time_slots=slots, edit=True, booking=b, today=b.from_date.isoformat())
         b.name = request.form['name']
         b.phone = request.form['phone']
         b.email = request.form['email']
         b.details = request.form.get('details', '')
-        b.from_date = datetime.strptime(request.form['from_date'], '%Y-%m-%d').date()
-        b.to_date = datetime.strptime(request.form['to_date'], '%Y-%m-%d').date()
+        b.from_date = from_date
+        b.to_date = to_date
         b.from_time = request.form['from_time']
         b.to_time = request.form['to_time']
         b.total_amount = float(request.form['total_amount'])
         b.advance = float(request.form['advance'])
         b.balance = float(request.form['balance'])
+        b.venue_id = (find_venue(request.form.get('venue_id')) or b.venue or default_venue()).id
+        try:
+            for field, value in parse_recurrence(request.form).items():
+                setattr(b, field, value)
+        except ValueError as e:
+            flash(f"⚠️ {e}", "danger")
+            return render_template('booking_form.html', time_slots=slots, edit=True, booking=b, today=b.from_date.isoformat())
 
         # ---- Duplicate / Overlap Check ----
-        def time_to_minutes(t):
-            dt = datetime.strptime(t, '%I:%M %p')
-            return dt.hour * 60 + dt.minute
-
-        new_start = time_to_minutes(b.from_time)
-        new_end = time_to_minutes(b.to_time)
-
-        overlapping = False
-        others = Booking.query.filter(
-            Booking.id != b.id,
-            Booking.to_date >= b.from_date,
-            Booking.from_date <= b.to_date
-        ).all()
-
-        for o in others:
-            exist_start = time_to_minutes(o.from_time)
-            exist_end = time_to_minutes(o.to_time)
-            if (
-                (b.from_date <= o.to_date and b.to_date >= o.from_date)
-                and (new_start < exist_end and new_end > exist_start)
-            ):
-                overlapping = True
-                break
-
-        if overlapping:
-            flash("⚠️ This booking overlaps with another booking!", "danger")
+        conflicts = [] if b.recurrence else find_conflicts(start_at, end_at, exclude_id=b.id, venue_id=b.venue_id)
+
+        if conflicts:
+            flash(f"⚠️ This booking overlaps with another booking: {describe_conflicts(conflicts)}", "danger")
             return render_template('booking_form.html', time_slots=slots, edit=True, booking=b, today=b.from_date.isoformat())
 
+        hold_token = request.form.get('hold_token') or None
+        held = [] if b.recurrence else conflicting_holds(start_at, end_at, exclude_token=hold_token,
+                                                          venue_id=b.venue_id, user=session.get('user'))
+        if held:
+            flash(f"⚠️ This slot is on hold: {describe_holds(held)}", "danger")
+            return render_template('booking_form.html', time_slots=slots, edit=True, booking=b, today=b.from_date.isoformat())
+
+        clashes = describe_series_clashes(b, hold_token) if b.recurrence else None
+        if clashes:
+            flash(f"⚠️ {clashes}", "danger")
+            return render_template('booking_form.html', time_slots=slots, edit=True, booking=b, today=b.from_date.isoformat())
+
+        consume_hold(hold_token, session.get('user'))
+        log_action(f"Booking {b.id} updated by {session.get('user')}", session.get('user'), join=True)
         db.session.commit()
-        log_action(f"Booking {b.id} updated by {session.get('user')}", session.get('user'))
         flash("✅ Booking updated successfully!", "success")
-        return redirect(url_for('bookings'))
+        return redirect(url_for('main.bookings'))
 
     return render_template('booking_form.html', time_slots=slots, edit=True, booking=b, today=b.from_date.isoformat())
 
 
 
-@app.route('/booking/<int:booking_id>/delete')
+@bp.route('/booking/<int:booking_id>/delete')
 def delete_booking(booking_id):
     if not session.get('user'):
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
+    begin_write()
     b = Booking.query.get_or_404(booking_id)
     db.session.delete(b)
+    log_action(f"Booking {b.id} deleted by {session.get('user')}", session.get('user'), join=True)
     db.session.commit()
-    log_action(f"Booking {b.id} deleted by {session.get('user')}", session.get('user'))
     flash("Booking deleted successfully!", "success")
-    return redirect(url_for('bookings'))
-
+    return redirect(url_for('main.bookings'))
 
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 
+@bp.route('/booking/<int:booking_id>/occurrence/<key>/delete')
+def delete_occurrence(booking_id, key):
+    """Delete one occurrence of a series, leaving the rest."""
+    if not session.get('user'):
+        return redirect(url_for('main.login'))
+    begin_write()
+    b = Booking.query.get_or_404(booking_id)
+    occ = occurrence_at(b, key)
+    if occ is None:
+        abort(404)
+    db.session.add(BookingException(booking=b, occurrence_start=occ.start_at, occurrence_end=occ.end_at))
+    log_action(f"Booking {b.id} deleted by {session.get('user')} (occurrence {occ.start_at:%Y-%m-%d %I:%M %p})", session.get('user'), join=True)
+    db.session.commit()
+    flash("Occurrence deleted successfully!", "success")
+    return redirect(url_for('main.bookings'))
 
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from io import BytesIO
-from flask import make_response
-from datetime import datetime
+@bp.route('/booking/<int:booking_id>/occurrence/<key>/edit')
+def edit_occurrence(booking_id, key):
+    """Detach one occurrence of a series into a booking of its own and edit that."""
+    if not session.get('user'):
+        return redirect(url_for('main.login'))
+    begin_write()
+    b = Booking.query.get_or_404(booking_id)
+    occ = occurrence_at(b, key)
+    if occ is None:
+        abort(404)
+    single = Booking(venue_id=b.venue_id, name=b.name, phone=b.phone, email=b.email, details=b.details,
+                     from_date=occ.from_date, to_date=occ.to_date, from_time=b.from_time, to_time=b.to_time,
+                     total_amount=b.total_amount, advance=b.advance, balance=b.balance)
+    db.session.add(single)
+    db.session.flush()
+    db.session.add(BookingException(booking=b, occurrence_start=occ.start_at, occurrence_end=occ.end_at,
+                                    detached_id=single.id))
+    log_action(f"Booking {b.id} updated by {session.get('user')} (occurrence {occ.start_at:%Y-%m-%d %I:%M %p} "
+               f"detached as booking {single.id})", session.get('user'), join=True)
+    db.session.commit()
+    return redirect(url_for('main.edit_booking', booking_id=single.id))
 
 
-@app.route('/booking/<int:booking_id>/receipt')
+@bp.route('/booking/<int:booking_id>/receipt')
 def download_receipt(booking_id):
     b = Booking.query.get_or_404(booking_id)
+    cached = cached_receipt_pdf(b)
+    if cached is None:
+        today_str = datetime.today().strftime("%d-%m-%Y")
+        job_id = jobs.enqueue('receipt', key=f"receipt:{b.id}:{receipt_key(b, today_str)}",
+                              user=session.get('user'), booking_id=b.id)
+        path = receipts.cached_receipt(b, today_str)  # already there when it ran inline
+        if path is None:
+            return job_accepted(job_id, f"Preparing receipt {b.id:05d}")
+        cached = path, receipt_key(b, today_str)
+    path, etag = cached
+    response = send_file(path, mimetype='application/pdf', as_attachment=True,
+        download_name=f"KAV_INV-{b.id:05d}.pdf", etag=etag, conditional=True, max_age=0)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
-    # ---------------- INVOICE DETAILS ----------------
-    invoice_no = f"INV-{b.id:05d}"
+@bp.route('/bookings/export/receipts.zip')
+def export_receipts():
+    """Every receipt matching the dashboard filters (e.g. ?from=&to=) as a streamed ZIP.
+
+    ?statement=1 adds one merged statement.pdf; ?background=1 builds the
+    file in a background job instead (see queue_export).
+    """
+    if not session.get('user'):
+        return redirect(url_for('main.login'))
+    name = f"KAV_receipts_{request.args.get('from', 'all')}_{request.args.get('to', 'all')}.zip"
+    log_action(f"Receipts exported by {session.get('user')}: {request.query_string.decode()}", session.get('user'))
+    if request.args.get('background') == '1':
+        return queue_export('receipts.zip', name)
     today_str = datetime.today().strftime("%d-%m-%Y")
+    stream = stream_receipts_zip(filter_bookings(request.args),
+        os.path.join(current_app.root_path, 'static', 'fonts'), today_str,
+        workers=current_app.config.get('RECEIPT_EXPORT_WORKERS'), statement=request.args.get('statement') == '1',
+        statement_title=statement_title(request.args))
+    return Response(stream_with_context(stream), mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={name}'})
+
+@bp.route('/bookings/export.<fmt>')
+def export_bookings(fmt):
+    """The bookings matching the dashboard filters as a streamed CSV or XLSX
+    file, or with ?background=1 as a background job."""
+    if not session.get('user'):
+        return redirect(url_for('main.login'))
+    formats = {
+        'csv': (stream_bookings_csv, 'text/csv'),
+        'xlsx': (stream_bookings_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    }
+    if fmt not in formats:
+        return "Unsupported export format", 404
+    stream, mimetype = formats[fmt]
+    name = f"KAV_bookings_{request.args.get('from', 'all')}_{request.args.get('to', 'all')}.{fmt}"
+    log_action(f"Bookings exported ({fmt}) by {session.get('user')}: {request.query_string.decode()}", session.get('user'))
+    if request.args.get('background') == '1':
+        return queue_export(fmt, name)
+    return Response(stream_with_context(stream(filter_bookings(request.args))), mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={name}'})
+
+def queue_export(fmt, filename):
+    filters = {k: v for k, v in request.args.items() if k != 'background'}
+    job_id = jobs.enqueue('export', user=session.get('user'), fmt=fmt, filters=filters, filename=filename)
+    return job_accepted(job_id, f"Preparing {filename}")
+
+
+def job_accepted(job_id, title):
+    """202 for a queued job: its status as JSON to API clients, otherwise
+    a page that polls it and fetches the result when it is done."""
+    status_url = url_for('main.api_job', job_id=job_id)
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'id': job_id, 'status_url': status_url})
+    else:
+        response = make_response(render_template('job.html', title=title, status_url=status_url))
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    response.headers['Retry-After'] = '1'
+    return response
 
-    # ---------------- PDF SETUP ----------------
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
 
-    # ---------------- FONT SETUP ----------------
-    try:
-        pdfmetrics.registerFont(TTFont('Arimo', 'static/fonts/Arimo-Regular.ttf'))
-        pdfmetrics.registerFont(TTFont('Arimo-Bold', 'static/fonts/Arimo-Bold.ttf'))
-        FONT = "Arimo"
-        FONT_BOLD = "Arimo-Bold"
-    except:
-        FONT = "Helvetica"
-        FONT_BOLD = "Helvetica-Bold"
-
-    # ============================================================
-    # RIGHT SIDE HEADER (unchanged)
-    # ============================================================
-    p.setFont(FONT_BOLD, 14)
-    p.drawRightString(width - 40, height - 60, "Receipt / Invoice")
-
-    p.setFont(FONT, 11)
-    p.drawRightString(width - 40, height - 85, f"Invoice No: {invoice_no}")
-    p.drawRightString(width - 40, height - 105, f"Date: {today_str}")
-
-    # ============================================================
-    # LEFT SIDE HEADER (MOVED DOWN BELOW DATE)
-    # ============================================================
-    p.setFont(FONT_BOLD, 20)
-    p.drawString(40, height - 130, "K.A.V Auditorium")
-
-    p.setFont(FONT, 11)
-    p.drawString(40, height - 150, "Near Telephone Exchange, Mundur -I, Kerala 678592")
-    p.drawString(40, height - 168, "Phone: (+91) 82811 42279, 95679 41222 | Email: Shahul.kav@gmail.com")
-
-    # Divider line below both headers
-    p.setLineWidth(1)
-    p.line(40, height - 190, width - 40, height - 190)
-
-    # ============================================================
-    # BILL TO SECTION (EXTRA SPACING ADDED)
-    # ============================================================
-    p.setFont(FONT_BOLD, 12)
-    p.drawString(40, height - 220, "Bill To :")
-
-    p.setFont(FONT, 12)
-    p.drawString(40, height - 240, b.name)
-    p.drawString(40, height - 260, f"Phone: {b.phone}")
-    p.drawString(40, height - 280, f"Email: {b.email}")
-
-    # ============================================================
-    # TABLE HEADER
-    # ============================================================
-    table_top = height - 320
-
-    p.line(40, table_top, width - 40, table_top)
-
-    p.setFont(FONT_BOLD, 12)
-    p.drawString(45, table_top - 20, "DESCRIPTION")
-    p.drawString(230, table_top - 20, "FROM")
-    p.drawString(360, table_top - 20, "TO")
-    p.drawString(480, table_top - 20, "AMOUNT")
-
-    p.line(40, table_top - 25, width - 40, table_top - 25)
-
-    # ============================================================
-    # TABLE ROW
-    # ============================================================
-    y = table_top - 50
-    p.setFont(FONT, 12)
-
-    p.drawString(45, y, "Auditorium Booking (Event)")
-
-    # NO OVERLAP – proper spacing
-    p.drawString(230, y, f"{b.from_date} {b.from_time}")
-    p.drawString(360, y, f"{b.to_date} {b.to_time}")
-
-    p.drawRightString(545, y, f"{b.total_amount:,.2f}")
-
-    # ============================================================
-    # TOTALS
-    # ============================================================
-    totals_y = y - 70
-
-    p.setFont(FONT_BOLD, 12)
-    p.drawRightString(545, totals_y, f"Total Amount: {b.total_amount:,.2f}")
-
-    p.setFont(FONT, 12)
-    p.drawRightString(545, totals_y - 25, f"Advance Paid: {b.advance:,.2f}")
-    p.drawRightString(545, totals_y - 50, f"Balance Due: {b.balance:,.2f}")
-
-    # ============================================================
-    # FOOTER / SIGNATURE
-    # ============================================================
-    footer_y = totals_y - 120
-
-    p.setFont(FONT, 12)
-    p.drawString(40, footer_y, "Authorized Signature: ___________________________")
-    p.drawString(40, footer_y - 25, "Date: ___________________________")
-
-    p.setFont(FONT, 11)
-    p.drawString(40, footer_y - 70, "Thank you for choosing K.A.V Auditorium.")
-
-    # ---------------- SAVE PDF ----------------
-    p.showPage()
-    p.save()
-    buffer.seek(0)
-
-    response = make_response(buffer.getvalue())
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=KAV_{invoice_no}.pdf'
-    return response
+def visible_job(job_id):
+    job = db.session.get(Job, job_id)
+    user = session.get('user')
+    if job is None or (job.user and user != job.user and user != ADMIN_USERNAME):
+        abort(404)
+    return job
+
+
+def job_download_url(job):
+    if job.status != 'done':
+        return None
+    if job.result_path:
+        return url_for('main.job_result', job_id=job.id)
+    if job.kind == 'receipt':
+        return url_for('main.download_receipt', booking_id=json.loads(job.result)['booking_id'])
+    return None
+
+
+@bp.route('/api/jobs/<int:job_id>')
+def api_job(job_id):
+    """Status of a background job; ``download_url`` is set once its result is ready."""
+    job = visible_job(job_id)
+    return jsonify(dict(jobs.job_status(job), download_url=job_download_url(job)))
 
-@app.route('/bookings')
+
+@bp.route('/api/jobs/<int:job_id>/result')
+def job_result(job_id):
+    job = visible_job(job_id)
+    if job.status != 'done' or not job.result_path or not os.path.exists(job.result_path):
+        abort(404)
+    return send_file(job.result_path, as_attachment=True, download_name=os.path.basename(job.result_path))
+
+
+@bp.route('/bookings')
 def bookings():
     if not session.get('user'):
-        return redirect(url_for('login'))
-    # Optional filters: ?date=YYYY-MM-DD and ?view=<id>
-    filter_date = request.args.get('date')
+        return redirect(url_for('main.login'))
+    # Filters: ?date=, ?from=, ?to=, ?q=, ?balance_due=1, ?min_amount=, ?max_amount=;
+    # ?cursor= pages through results and ?view=<id> highlights a booking.
     view_id = request.args.get('view', type=int)
-    qs = Booking.query.order_by(Booking.from_date.desc(), Booking.from_time.asc())
-    if filter_date:
-        try:
-            dt = date.fromisoformat(filter_date)
-            qs = qs.filter(Booking.from_date <= dt, Booking.to_date >= dt)
-        except Exception:
-            pass
-    allb = qs.all()
-    return render_template('dashboard.html', bookings=allb, view_id=view_id, user=session.get('user'), admin_username=ADMIN_USERNAME)
+    page, next_cursor = bookings_page(request.args)
+    filters = {k: v for k, v in request.args.items() if k not in ('cursor', 'view') and v}
+    return render_template('dashboard.html', bookings=page, view_id=view_id, filters=filters,
+        next_cursor=next_cursor, stream_since=changefeed.broker.latest_id(),
+        user=session.get('user'), admin_username=ADMIN_USERNAME)
+
+
+@bp.route('/bookings/bulk', methods=['GET', 'POST'])
+def bulk_bookings():
+    """Shift, move or cancel many bookings at once.  GET lists what the
+    dashboard filters (kept in the query string) select; a POST previews the
+    change as a dry run, and with ``apply=1`` makes it in one transaction."""
+    if not session.get('user'):
+        return redirect(url_for('main.login'))
+    filters = {k: v for k, v in request.args.items() if v}
+    if request.method == 'GET':
+        items = items_from_filters(request.args)
+        return render_template('bulk.html', items=items, selected={it.key for it in items}, plan=None,
+                               form={}, filters=filters, venues=all_venues())
+
+    form = request.form
+    apply = form.get('apply') == '1'
+    if apply:
+        begin_write()
+    items = items_from_keys(form.getlist('shown'))
+    selected = set(form.getlist('ids'))
+    try:
+        start_on = date.fromisoformat(form['start_on']) if form.get('start_on') else None
+    except ValueError:
+        start_on = None
+    page = dict(items=items, selected=selected, form=form, filters=filters, venues=all_venues())
+    try:
+        plan = plan_bulk(form.get('action'), [it for it in items if it.key in selected],
+                         days=form.get('days', type=int), start_on=start_on, venue=find_venue(form.get('venue_id')))
+    except ValueError as e:
+        db.session.rollback()
+        flash(f"⚠️ {e}", "danger")
+        return render_template('bulk.html', plan=None, **page)
+    if not apply or plan.clashes:
+        db.session.rollback()
+        if apply:
+            flash(f"⚠️ Nothing was changed: {len(plan.clashes)} of {len(plan.changes)} bookings clash.", "danger")
+        return render_template('bulk.html', plan=plan, **page)
+
+    user = session.get('user')
+    kind = 'cancel' if plan.action == 'cancel' else 'reschedule'
+    created = apply_plan(plan)
+    detached = f"; occurrences detached as bookings {', '.join(map(str, created))}" if created else ""
+    log_action(f"Bulk {kind} by {user}: {plan.describe()}: {', '.join(c.item.label() for c in plan.changes)}{detached}",
+               user, join=True)
+    db.session.commit()
+    flash(f"✅ {plan.describe().capitalize()}.", "success")
+    return redirect(url_for('main.bookings', **filters))
 
 
-@app.route("/calendar")
+@bp.route("/calendar")
 def calendar():
-    bookings = Booking.query.all()
-    bookings_map = {}
-    events = []
+    # Events are fetched per visible range from /api/events and kept
+    # current by the /api/stream change feed.  ?venue= picks the hall.
+    return render_template("calendar.html", stream_since=changefeed.broker.latest_id(),
+                           venue=venue_from_args(request.args), venues=all_venues())
 
-    # Light palette for day view
-    light_colors = ["#add8e6", "#ffb6c1", "#ffe5b4"]  # blue, pink, peach
 
-    for i, b in enumerate(bookings):
-        date_str = b.from_date.strftime("%Y-%m-%d")
+# ---------------- EVENT FEEDS ----------------
 
-        # Determine booking status
-        if date_str not in bookings_map:
-            bookings_map[date_str] = "free"
+def parse_feed_range():
+    """Read FullCalendar's ?start=&end= ISO params as naive datetimes."""
+    try:
+        start = datetime.fromisoformat(request.args['start']).replace(tzinfo=None)
+        end = datetime.fromisoformat(request.args['end']).replace(tzinfo=None)
+    except (KeyError, ValueError):
+        return None
+    if end <= start:
+        return None
+    return start, end
 
-        if b.from_time and b.to_time:
-            duration = datetime.strptime(b.to_time, "%I:%M %p") - datetime.strptime(b.from_time, "%I:%M %p")
-            if duration.seconds >= 8 * 3600:
-                bookings_map[date_str] = "full"
-            else:
-                bookings_map[date_str] = "partial"
 
-        # Build event times
-        start = f"{b.from_date}T{datetime.strptime(b.from_time, '%I:%M %p').strftime('%H:%M:%S')}"
-        end = f"{b.to_date}T{datetime.strptime(b.to_time, '%I:%M %p').strftime('%H:%M:%S')}"
+def window_bookings(start, end, venue_id):
+    """One venue's bookings and series occurrences intersecting [start, end),
+    served from the interval index."""
+    return bookings_in(start, end, venue_id=venue_id)
 
-        # Default color based on status (for month/year)
-        if bookings_map[date_str] == "full":
-            color = "#ef4444"  # red
-        elif bookings_map[date_str] == "partial":
-            color = "#a855f7"  # purple
-        else:
-            color = "#22c55e"  # green
 
-        # Alternate light colors for day view
-        light_color = light_colors[i % len(light_colors)]
+@bp.route('/api/events')
+def api_events():
+    """Staff calendar feed: one venue's bookings inside the visible range."""
+    if not session.get('user'):
+        return jsonify({'error': 'login required'}), 401
+    window = parse_feed_range()
+    if window is None:
+        return jsonify({'error': 'start and end are required ISO dates'}), 400
+    venue = venue_from_args(request.args)
+
+    # Light palette for day view
+    light_colors = ["#add8e6", "#ffb6c1", "#ffe5b4"]  # blue, pink, peach
 
+    events = []
+    for i, b in enumerate(window_bookings(*window, venue.id)):
+        status = event_status(b.start_at, b.end_at)
         events.append({
-            "id": b.id,
+            "id": f"{b.id}@{b.key}" if b.is_occurrence else b.id,
             "title": b.name or "Booking",
-            "start": start,
-            "end": end,
-            "color": color,
-            "lightColor": light_color,
+            "start": b.start_at.isoformat(),
+            "end": b.end_at.isoformat(),
+            "color": STATUS_COLORS[status],
+            "lightColor": light_colors[i % len(light_colors)],
+            "status": status,
             "from_time": b.from_time,
             "to_time": b.to_time,
             "details": b.details,
+            "venue_id": b.venue_id,
+        })
+    events.extend(hold_delta(h) for h in active_holds_query(*window, venue_id=venue.id).order_by(SlotHold.start_at))
+    return jsonify(events)
+
+
+@bp.route('/api/holds', methods=['POST'])
+def api_place_hold():
+    """Hold the booking form's range while it is being filled in.
+
+    Form fields: from_date, from_time, to_date, to_time, venue_id, optional
+    token and booking_id (when editing, so the booking doesn't clash with itself).
+    """
+    if not session.get('user'):
+        return jsonify({'error': 'login required'}), 401
+    try:
+        start, end = booking_interval(date.fromisoformat(request.form['from_date']), request.form['from_time'],
+                                      date.fromisoformat(request.form['to_date']), request.form['to_time'])
+    except KeyError:
+        return jsonify({'error': 'from_date, from_time, to_date and to_time are required'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    venue = find_venue(request.form.get('venue_id')) or default_venue()
+    hold, reason = place_hold(start, end, session['user'], venue.id, token=request.form.get('token') or None,
+                              exclude_booking_id=request.form.get('booking_id', type=int))
+    if hold is None:
+        return jsonify({'error': f"This slot {reason}"}), 409
+    return jsonify({'token': hold.token, 'id': hold.id, 'start': hold.start_at.isoformat(),
+                    'end': hold.end_at.isoformat(), 'expires_at': hold.expires_at.isoformat() + 'Z',
+                    'ttl': current_app.config['SLOT_HOLD_TTL']})
+
+
+@bp.route('/api/holds/<token>/release', methods=['POST'])
+def api_release_hold(token):
+    """Drop a hold (sent with navigator.sendBeacon when the form is left)."""
+    if not session.get('user'):
+        return jsonify({'error': 'login required'}), 401
+    release_hold(token, session['user'])
+    return '', 204
+
+
+@bp.route('/api/stream')
+def api_stream():
+    """Booking changes as Server-Sent Events for the open calendar and dashboard.
+
+    Resumes after the ``Last-Event-ID`` header (sent on reconnect) or
+    ?after= (the change id the page was rendered at).
+    """
+    if not session.get('user'):
+        return jsonify({'error': 'login required'}), 401
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+    if after is None:
+        after = changefeed.broker.latest_id()
+    return Response(stream_with_context(change_stream(after)), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/api/public/events')
+def api_public_events():
+    """Public availability feed: one background event per booked day of a
+    venue (?venue=), no customer data."""
+    window = parse_feed_range()
+    if window is None:
+        return jsonify({'error': 'start and end are required ISO dates'}), 400
+
+    start, end = window
+    venue = venue_from_args(request.args)
+    events = []
+    for day, status in day_statuses(start.date(), (end - timedelta(microseconds=1)).date(), venue.id).items():
+        events.append({
+            "start": day,
+            "color": "#ef4444" if status == "full" else "#d4af37",  # full day (red) / partial (gold)
         })
+    return jsonify(events)
+
+
+@bp.route('/api/day-status')
+def api_day_status():
+    """{date: "full" | "partial"} for a venue's booked days in the visible range."""
+    window = parse_feed_range()
+    if window is None:
+        return jsonify({'error': 'start and end are required ISO dates'}), 400
+    start, end = window
+    venue = venue_from_args(request.args)
+    return jsonify(day_statuses(start.date(), (end - timedelta(microseconds=1)).date(), venue.id))
+
+
+
+MAX_OVERVIEW_DAYS = 62
+
+
+def overview_range():
+    """?from= / ?to= (default: the current month) as dates, or None if malformed."""
+    today = date.today()
+    try:
+        first = date.fromisoformat(request.args['from']) if request.args.get('from') else today.replace(day=1)
+        last = date.fromisoformat(request.args['to']) if request.args.get('to') else \
+            (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    except ValueError:
+        return None
+    if last < first or (last - first).days >= MAX_OVERVIEW_DAYS:
+        return None
+    return first, last
+
+
+@bp.route('/venues', methods=['GET', 'POST'])
+def venues_overview():
+    """Every venue's occupancy side by side for a range of days (default:
+    this month), read from the per-venue day index.  The admin can add venues here."""
+    if not session.get('user'):
+        return redirect(url_for('main.login'))
+    if request.method == 'POST':
+        if session.get('user') != ADMIN_USERNAME:
+            flash("Only the admin can add venues.", "danger")
+            return redirect(url_for('main.venues_overview'))
+        try:
+            venue = add_venue(request.form.get('name', ''), request.form.get('address'),
+                              phone=request.form.get('phone'), email=request.form.get('email'))
+        except ValueError as e:
+            db.session.rollback()
+            flash(f"⚠️ {e}", "danger")
+        else:
+            log_action(f"Venue added by {session.get('user')}: {venue.name}", session.get('user'), join=True)
+            db.session.commit()
+            flash(f"✅ Venue {venue.name} added.", "success")
+        return redirect(url_for('main.venues_overview'))
+
+    span = overview_range()
+    if span is None:
+        flash(f"⚠️ Choose a range of at most {MAX_OVERVIEW_DAYS} days.", "danger")
+        return redirect(url_for('main.venues_overview'))
+    first, last = span
+    days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+    return render_template('venues.html', venues=all_venues(), days=days, first=first, last=last,
+                           prev_from=(first - timedelta(days=1)).replace(day=1).isoformat(),
+                           next_from=(last + timedelta(days=1)).isoformat(),
+                           overview=venue_overview(first, last), user=session.get('user'),
+                           admin_username=ADMIN_USERNAME)
+
+
+@bp.route('/api/venues/overview')
+def api_venues_overview():
+    """{venues: [...], days: {venue slug: {date: {status, booked_minutes, bookings}}}}
+    for ?from= to ?to= (at most MAX_OVERVIEW_DAYS days; default this month)."""
+    if not session.get('user'):
+        return jsonify({'error': 'login required'}), 401
+    span = overview_range()
+    if span is None:
+        return jsonify({'error': f'from/to must be YYYY-MM-DD, in order, at most {MAX_OVERVIEW_DAYS} days apart'}), 400
+    overview = venue_overview(*span)
+    venues = all_venues()
+    return jsonify({
+        'from': span[0].isoformat(), 'to': span[1].isoformat(),
+        'venues': [{'id': v.id, 'slug': v.slug, 'name': v.name} for v in venues],
+        'days': {v.slug: {d: {'status': status, 'booked_minutes': minutes, 'bookings': n}
+                          for d, (status, minutes, n) in overview.get(v.id, {}).items()} for v in venues},
+    })
+
 
-    return render_template("calendar.html", bookings_map=bookings_map, events=events)
+MAX_AVAILABILITY_DAYS = 731
+MAX_AVAILABILITY_LIMIT = 100
 
 
+@bp.route('/api/availability')
+def api_availability():
+    """Free windows of at least ?hours= between ?from= and ?to= (inclusive
+    dates) in a venue (?venue=, default the first).
 
-@app.route('/booking/<int:booking_id>')
+    ?mode=earliest (default) returns the first ?limit= (1-100, default 5)
+    windows, ?mode=all every window; ?same_day=1 keeps windows from crossing midnight.
+    """
+    try:
+        first = date.fromisoformat(request.args['from'])
+        last = date.fromisoformat(request.args.get('to', request.args['from']))
+        hours = float(request.args.get('hours', 1))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'from (YYYY-MM-DD) is required; to and hours are optional'}), 400
+    if last < first or (last - first).days >= MAX_AVAILABILITY_DAYS or not 0 < hours <= 24 * MAX_AVAILABILITY_DAYS:
+        return jsonify({'error': 'invalid range'}), 400
+
+    mode = request.args.get('mode', 'earliest')
+    limit = None if mode == 'all' else request.args.get('limit', 5, type=int)
+    if limit is not None and not 1 <= limit <= MAX_AVAILABILITY_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_AVAILABILITY_LIMIT} (or use mode=all)'}), 400
+    venue = venue_from_args(request.args)
+    windows = find_free_windows(first, last, hours, limit=limit, split_days=request.args.get('same_day') == '1',
+                                venue_id=venue.id)
+    return jsonify({'from': first.isoformat(), 'to': last.isoformat(), 'hours': hours, 'venue': venue.slug,
+                    'windows': windows})
+
+
+@bp.route('/booking/<int:booking_id>')
+@cached_view
 def booking_api(booking_id):
     """Return JSON for a booking (used by modal on dashboard)."""
     b = Booking.query.get_or_404(booking_id)
@@ -492,25 +901,104 @@ def booking_api(booking_id):
         'to_date': b.to_date.isoformat(),
         'from_time': b.from_time,
         'to_time': b.to_time,
-        'created_at': b.created_at.isoformat()
+        'created_at': b.created_at.isoformat(),
+        'repeat': series_summary(b) if b.recurrence else None,
+        'venue': b.venue_name,
     })
 
-@app.route('/audit')
+def parse_report_range(default_first, default_last, fmt):
+    """?from= / ?to= as dates (``fmt`` 'month' takes YYYY-MM), or None if malformed."""
+    def parse(key, default):
+        value = request.args.get(key)
+        if not value:
+            return default
+        return date.fromisoformat(value + '-01' if fmt == 'month' else value)
+    try:
+        first, last = parse('from', default_first), parse('to', default_last)
+    except ValueError:
+        return None
+    return (first, last) if first <= last else None
+
+
+@bp.route('/reports')
+def reports():
+    """Monthly revenue for ?year= and the daily breakdown of ?month= (YYYY-MM)."""
+    if not session.get('user'):
+        return redirect(url_for('main.login'))
+    if session.get('user') != ADMIN_USERNAME:
+        flash("You don't have permission to view reports.", 'danger')
+        return redirect(url_for('main.bookings'))
+    today = date.today()
+    try:
+        year = int(request.args.get('year', today.year))
+        month = date.fromisoformat(request.args.get('month', f'{year}-{today.month:02d}') + '-01')
+        months, year_totals = monthly_report(date(year, 1, 1), date(year, 12, 1))
+    except ValueError:
+        return redirect(url_for('main.reports'))
+    days, month_totals = daily_report(month, (month + timedelta(days=32)).replace(day=1) - timedelta(days=1))
+    return render_template('reports.html', year=year, month=month, months=months, year_totals=year_totals,
+        days=days, month_totals=month_totals, user=session.get('user'), admin_username=ADMIN_USERNAME)
+
+
+@bp.route('/api/reports/<period>')
+def api_reports(period):
+    """Rollup totals per ``monthly`` (?from=&to= as YYYY-MM, default this year)
+    or ``daily`` (?from=&to= as YYYY-MM-DD, default this month) period."""
+    if session.get('user') != ADMIN_USERNAME:
+        return jsonify({'error': 'admin login required'}), 401
+    today = date.today()
+    if period == 'monthly':
+        window = parse_report_range(date(today.year, 1, 1), date(today.year, 12, 1), 'month')
+        if window is None or (window[1].year - window[0].year) * 12 + window[1].month - window[0].month >= MAX_MONTHS:
+            return jsonify({'error': f'from/to must be YYYY-MM, in order, at most {MAX_MONTHS} months apart'}), 400
+        periods, totals = monthly_report(*window)
+    elif period == 'daily':
+        window = parse_report_range(today.replace(day=1), today, 'day')
+        if window is None or (window[1] - window[0]).days >= MAX_DAYS:
+            return jsonify({'error': f'from/to must be YYYY-MM-DD, in order, at most {MAX_DAYS} days apart'}), 400
+        periods, totals = daily_report(*window)
+    else:
+        return jsonify({'error': 'period must be monthly or daily'}), 404
+    return jsonify({'period': period, 'from': periods[0]['period'], 'to': periods[-1]['period'],
+                    'periods': periods, 'totals': totals})
+
+
+@bp.route('/audit')
 def audit():
     if not session.get('user'):
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     if session.get('user') != ADMIN_USERNAME:
         flash("You don't have permission to view audit logs.", 'danger')
-        return redirect(url_for('bookings'))
-    logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).limit(500).all()
-    return render_template('audit_logs.html', logs=logs, hide_audit_nav=True, user=session.get('user'),
-        admin_username=ADMIN_USERNAME)
+        return redirect(url_for('main.bookings'))
+    audit_writer.flush()  # show entries still waiting for the next group commit
+    # Filters: ?user=, ?kind=, ?from=, ?to=; ?cursor= pages back in time.
+    logs, next_cursor = audit_page(request.args)
+    filters = {k: v for k, v in request.args.items() if k != 'cursor' and v}
+    users = [u.username for u in User.query.order_by(User.username)]
+    return render_template('audit_logs.html', logs=logs, next_cursor=next_cursor, filters=filters,
+        kinds=[k for k, _ in ACTION_KINDS] + ['other'], users=users, hide_audit_nav=True,
+        user=session.get('user'), admin_username=ADMIN_USERNAME)
+
+@bp.route('/audit/search')
+def audit_search():
+    """Stream matching entries from the archive and the live table as JSON lines."""
+    if session.get('user') != ADMIN_USERNAME:
+        return jsonify({'error': 'admin only'}), 403
+    audit_writer.flush()
+    args = request.args.to_dict()
+
+    def generate():
+        for rec in iter_audit(args):
+            yield json.dumps(rec) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+        headers={'Content-Disposition': 'inline; filename=audit.jsonl'})
 
-@app.route('/admin/profile', methods=['GET', 'POST'])
+@bp.route('/admin/profile', methods=['GET', 'POST'])
 def admin_profile():
     if not session.get('user') == ADMIN_USERNAME:
         flash("Access denied.", "danger")
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
 
     users = User.query.all()
 
@@ -547,19 +1035,22 @@ def admin_profile():
             else:
                 flash("⚠️ Cannot delete admin or invalid user.", "danger")
 
-        return redirect(url_for('admin_profile'))
+        return redirect(url_for('main.admin_profile'))
 
     return render_template('admin_profile.html', users=users)
 
 
 # Simple API: bookings for a date
-@app.route('/api/bookings/date/<datestr>')
+@bp.route('/api/bookings/date/<datestr>')
+@cached_view
 def api_bookings_by_date(datestr):
     try:
         dt = date.fromisoformat(datestr)
     except Exception:
         return jsonify([])
-    items = Booking.query.filter(Booking.from_date <= dt, Booking.to_date >= dt).all()
+    day_start = datetime.combine(dt, time.min)
+    venue = find_venue(request.args.get('venue'))  # all venues unless ?venue= is given
+    items = bookings_in(day_start, day_start + timedelta(days=1), venue_id=venue.id if venue else None)
     out = []
     for b in items:
         out.append({'id': b.id, 'name': b.name, 'from_time': b.from_time, 'to_time': b.to_time})
@@ -568,55 +1059,98 @@ def api_bookings_by_date(datestr):
 
 # ---------------- PUBLIC PAGES ----------------
 
-@app.route('/')
+@bp.route('/')
+@cached_view
 def public_home():
     """Public homepage (main landing page)."""
     return render_template('public_home.html')
 
-@app.route('/about')
+@bp.route('/about')
+@cached_view
 def about():
     """Public info page about the auditorium."""
     return render_template('about.html')
 
-@app.route('/enquiry', methods=['GET', 'POST'])
+@bp.route('/enquiry', methods=['GET', 'POST'])
 def enquiry():
     """Public enquiry form."""
     if request.method == 'POST':
-        name = request.form['name']
+        name = request.form['name'].strip()
         phone = request.form['phone']
         message = request.form.get('message', '')
-        preferred_date = request.form.get('preferred_date', '')
+        try:
+            preferred_date = date.fromisoformat(request.form.get('preferred_date', ''))
+        except ValueError:
+            preferred_date = None
+        if not name or not normalize_phone(phone):
+            flash("⚠️ Please give your name and phone number.", "danger")
+            return render_template('enquiry.html')
+        # Spooled to disk, not the database; the ingester stores it shortly.
+        enquiry_spool.submit(name, phone, message, preferred_date)
         flash("✅ Thank you! We'll contact you soon.", "success")
-        return redirect(url_for('enquiry'))
+        return redirect(url_for('main.enquiry'))
     return render_template('enquiry.html')
 
-@app.route("/public_calendar")
-def public_calendar():
-    bookings = Booking.query.all()
-    events = []
-
-    for b in bookings:
-        duration = datetime.strptime(b.to_time, "%I:%M %p") - datetime.strptime(b.from_time, "%I:%M %p")
-        hours = duration.seconds / 3600
-
-        # Determine color by hours booked
-        if hours >= 8:
-            color = "#ef4444"  # full day (red)
-        elif hours > 0:
-            color = "#d4af37"  # partial (gold)
-        else:
-            color = "#22c55e"  # free (green)
-
-        events.append({
-            "start": str(b.from_date),
-            "end": str(b.to_date),
-            "color": color
-        })
-
-    return render_template("public_calendar.html", events=events)
 
+@bp.route('/enquiries')
+def enquiries():
+    """Staff list of public enquiries, one row per phone and date."""
+    if not session.get('user'):
+        return redirect(url_for('main.login'))
+    enquiry_spool.drain()  # include this worker's latest submissions
+    # Filters: ?phone=, ?all=1 (list repeats too); ?cursor= pages back in time.
+    rows, next_cursor = enquiry_page(request.args)
+    filters = {k: v for k, v in request.args.items() if k != 'cursor' and v}
+    return render_template('enquiries.html', enquiries=rows, next_cursor=next_cursor, filters=filters,
+        user=session.get('user'), admin_username=ADMIN_USERNAME)
+
+@bp.route("/public_calendar")
+@cached_view
+def public_calendar():
+    # Availability is fetched per visible month from /api/public/events.
+    return render_template("public_calendar.html", venue=venue_from_args(request.args), venues=all_venues())
+
+
+# ---------- Application factory ----------
+def create_app(config=None):
+    """Build and initialise the app.
+
+    Schema upgrades and account seeding run here, once per process at boot,
+    instead of on the first request a worker serves.  Set ``INIT_DB_ON_BOOT``
+    to 0 to skip them (e.g. when a release step has already migrated).
+    """
+    started = perf_counter()
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///../instance/models.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['AUDIT_RETENTION_DAYS'] = int(os.environ.get('AUDIT_RETENTION_DAYS', 90))
+    app.config['INIT_DB_ON_BOOT'] = os.environ.get('INIT_DB_ON_BOOT', '1') != '0'
+    app.config.update(config or {})
+
+    configure_database(app)
+    audit_writer.init_app(app)
+    enquiry_spool.init_app(app)
+    changefeed.broker.init_app(app)
+    holds.init_app(app)
+    jobs.init_app(app)
+    receipts.init_app(app)
+    metrics.init_app(app)
+    httpcache.init_app(app)
+    assets.init_app(app)
+    app.register_blueprint(bp)
+
+    if app.config['INIT_DB_ON_BOOT']:
+        with app.app_context():
+            init_db()
+            # Don't hand connections opened at boot to forked workers
+            # (gunicorn --preload); each worker opens its own.
+            db.engine.dispose()
+    metrics.record_boot(app, perf_counter() - started)
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
-
-
@@ -0,0 +1,292 @@
+"""Static asset pipeline: responsive image variants and fingerprinted files.
+
+``flask build-assets`` writes everything under ``static/`` into
+``static/dist/`` with a content hash in the file name, and for every raster
+image also writes resized WebP (and AVIF, when Pillow supports it) variants
+plus resized copies in the original format.  ``static/dist/manifest.json``
+maps logical paths (``img/hall.jpg``) to the generated files; CSS ``url()``
+references are rewritten to them.  Unchanged sources are not re-encoded on
+the next build.
+
+Templates resolve assets through ``asset_url(path)`` and ``picture(path,
+alt, sizes)`` (a ``<picture>`` with ``srcset`` per format).  Until a build
+exists both fall back to the plain ``static`` URL, so development needs no
+build step.  Files under ``static/dist/`` are served with a one-year
+``immutable`` cache lifetime; byte-range requests (the hero video) are
+answered with 206 partial content by the static file handler.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from flask import request, url_for
+from markupsafe import Markup, escape
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+WIDTHS = (160, 320, 480, 800, 1200, 1600, 2400)
+CSS_IMAGE_WIDTH = 1600
+RASTER = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.webp': 'webp'}
+EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'webp': '.webp', 'avif': '.avif'}
+MIME = {'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp', 'avif': 'image/avif'}
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_manifest = {'files': {}, 'images': {}}
+
+
+# ---------- Build ----------
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def _hashed_name(path, data, suffix=''):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}{suffix}.{_digest(data)}{ext}"
+
+
+def _write(dist_dir, rel, data):
+    dest = os.path.join(dist_dir, rel)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with open(dest, 'wb') as fh:
+        fh.write(data)
+
+
+def _encoders():
+    from PIL import features
+
+    formats = ['webp']
+    if features.check('avif'):
+        formats.insert(0, 'avif')
+    return formats
+
+
+def _encode(img, fmt):
+    buf = BytesIO()
+    if fmt == 'jpeg':
+        img.convert('RGB').save(buf, 'JPEG', quality=82, optimize=True, progressive=True)
+    elif fmt == 'png':
+        img.save(buf, 'PNG', optimize=True)
+    elif fmt == 'webp':
+        img.save(buf, 'WEBP', quality=80, method=4)
+    elif fmt == 'avif':
+        img.save(buf, 'AVIF', quality=60, speed=6)
+    return buf.getvalue()
+
+
+def _build_image(rel, data, dist_dir, formats):
+    from PIL import Image, ImageOps
+
+    img = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+    width, height = img.size
+    widths = sorted({w for w in WIDTHS if w < width} | {min(width, WIDTHS[-1])})
+    fallback = RASTER[os.path.splitext(rel)[1].lower()]
+    variants = {}
+    for fmt in formats + ([fallback] if fallback not in formats else []):
+        for w in widths:
+            resized = img if w == width else img.resize((w, round(height * w / width)), Image.LANCZOS)
+            encoded = _encode(resized, fmt)
+            name = _hashed_name(os.path.splitext(rel)[0] + EXTENSIONS[fmt], encoded, f'.{w}')
+            _write(dist_dir, name, encoded)
+            variants.setdefault(fmt, []).append([w, name])
+    return {'width': width, 'height': height, 'fallback': fallback, 'variants': variants}
+
+
+def _rewrite_css(css, css_rel, manifest):
+    base = os.path.dirname(css_rel)
+
+    def repl(match):
+        quote, target = match.group(1), match.group(2)
+        if re.match(r'^(?:[a-z]+:|/|#)', target):
+            return match.group(0)
+        logical = os.path.normpath(os.path.join(base, target)).replace(os.sep, '/')
+        built = _pick(manifest, logical, CSS_IMAGE_WIDTH) or manifest['files'].get(logical)
+        if not built:
+            return match.group(0)
+        return f"url({quote}{os.path.relpath(built, base).replace(os.sep, '/')}{quote})"
+
+    return re.sub(r'''url\((['"]?)([^'")]+)\1\)''', repl, css)
+
+
+def build_assets(static_dir, force=False, workers=None, log=print):
+    """Build ``static/dist`` and its manifest; returns the manifest.
+
+    Images that need (re-)encoding are processed by a pool of ``workers``
+    processes (default: one per CPU).
+    """
+    dist_dir = os.path.join(static_dir, DIST)
+    manifest_path = os.path.join(dist_dir, MANIFEST)
+    previous = {}
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as fh:
+            previous = json.load(fh)
+    manifest = {'files': {}, 'images': {}, 'sources': {}}
+    formats = _encoders()
+    log(f"Building assets ({', '.join(formats)}) into {dist_dir}")
+
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist_dir)
+        for name in sorted(files):
+            sources.append(os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/'))
+
+    keep = set()
+    css = []
+    pending = []
+    for rel in sources:
+        with open(os.path.join(static_dir, rel), 'rb') as fh:
+            data = fh.read()
+        source_hash = _digest(data)
+        manifest['sources'][rel] = source_hash
+        if rel.endswith('.css'):
+            css.append((rel, data))
+            continue
+        reuse = previous.get('sources', {}).get(rel) == source_hash
+        hashed = previous['files'].get(rel) if reuse else None
+        if not hashed or not os.path.exists(os.path.join(dist_dir, hashed)):
+            hashed = _hashed_name(rel, data)
+            _write(dist_dir, hashed, data)
+        manifest['files'][rel] = hashed
+        keep.add(hashed)
+
+        if os.path.splitext(rel)[1].lower() in RASTER:
+            entry = previous.get('images', {}).get(rel) if reuse else None
+            if entry and set(entry['variants']) >= set(formats) and all(
+                    os.path.exists(os.path.join(dist_dir, name)) for v in entry['variants'].values() for _, name in v):
+                manifest['images'][rel] = entry
+            else:
+                pending.append((rel, data))
+
+    if pending:
+        with ProcessPoolExecutor(workers or os.cpu_count() or 2,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            jobs = [(rel, pool.submit(_build_image, rel, data, dist_dir, formats)) for rel, data in pending]
+            for rel, job in jobs:
+                entry = job.result()
+                manifest['images'][rel] = entry
+                log(f"  {rel}: {entry['width']}x{entry['height']} -> "
+                    f"{sum(len(v) for v in entry['variants'].values())} variants")
+    log(f"  {len(manifest['images']) - len(pending)} images unchanged")
+    for entry in manifest['images'].values():
+        keep.update(name for v in entry['variants'].values() for _, name in v)
+
+    for rel, data in css:
+        rewritten = _rewrite_css(data.decode('utf-8'), rel, manifest).encode('utf-8')
+        hashed = _hashed_name(rel, rewritten)
+        _write(dist_dir, hashed, rewritten)
+        manifest['files'][rel] = hashed
+        keep.add(hashed)
+
+    # Drop outputs of earlier builds that nothing references any more.
+    for root, _, files in os.walk(dist_dir):
+        for name in files:
+            rel = os.path.relpath(os.path.join(root, name), dist_dir).replace(os.sep, '/')
+            if rel != MANIFEST and rel not in keep:
+                os.remove(os.path.join(root, name))
+
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(tmp, manifest_path)
+    return manifest
+
+
+def clean_assets(static_dir):
+    shutil.rmtree(os.path.join(static_dir, DIST), ignore_errors=True)
+
+
+# ---------- Resolving ----------
+def load_manifest(static_dir):
+    global _manifest
+    path = os.path.join(static_dir, DIST, MANIFEST)
+    try:
+        with open(path) as fh:
+            _manifest = json.load(fh)
+    except (OSError, ValueError):
+        _manifest = {'files': {}, 'images': {}}
+    return _manifest
+
+
+def _pick(manifest, path, width=None, fmt=None):
+    """Dist-relative name of the best variant of ``path`` for ``width``."""
+    image = manifest['images'].get(path)
+    if not image:
+        return None
+    variants = image['variants']
+    fmt = fmt or ('webp' if 'webp' in variants else image['fallback'])
+    options = variants.get(fmt)
+    if not options:
+        return None
+    if width is None:
+        return options[-1][1]
+    for w, name in options:
+        if w >= width:
+            return name
+    return options[-1][1]
+
+
+def _dist_url(name):
+    return url_for('static', filename=f'{DIST}/{name}')
+
+
+def asset_url(path, width=None, fmt=None):
+    """URL of ``path`` (relative to static/): a built variant when ``width`` or
+    ``fmt`` is given, else the fingerprinted copy, else the plain file."""
+    if width or fmt:
+        name = _pick(_manifest, path, width, fmt)
+        if name:
+            return _dist_url(name)
+    name = _manifest['files'].get(path)
+    return _dist_url(name) if name else url_for('static', filename=path)
+
+
+def srcset(path, fmt):
+    image = _manifest['images'].get(path)
+    if not image or fmt not in image['variants']:
+        return ''
+    return ', '.join(f"{_dist_url(name)} {w}w" for w, name in image['variants'][fmt])
+
+
+def picture(path, alt='', sizes='100vw', loading='lazy', **attrs):
+    """``<picture>`` markup with AVIF/WebP sources and an original-format fallback."""
+    attrs = ''.join(f' {k.rstrip("_").replace("_", "-")}="{escape(v)}"' for k, v in attrs.items())
+    image = _manifest['images'].get(path)
+    if not image:
+        return Markup(f'<img src="{escape(asset_url(path))}" alt="{escape(alt)}" loading="{loading}"{attrs}>')
+    sources = ''.join(
+        f'<source type="{MIME[fmt]}" srcset="{escape(srcset(path, fmt))}" sizes="{escape(sizes)}">'
+        for fmt in ('avif', 'webp') if fmt in image['variants'] and fmt != image['fallback'])
+    fallback = image['fallback']
+    return Markup(
+        f'<picture>{sources}<img src="{escape(asset_url(path, width=800, fmt=fallback))}" '
+        f'srcset="{escape(srcset(path, fallback))}" sizes="{escape(sizes)}" '
+        f'width="{image["width"]}" height="{image["height"]}" alt="{escape(alt)}" '
+        f'loading="{loading}" decoding="async"{attrs}></picture>')
+
+
+# ---------- App wiring ----------
+def init_app(app):
+    load_manifest(app.static_folder)
+    app.jinja_env.globals.update(asset_url=asset_url, picture=picture)
+
+    @app.after_request
+    def _static_headers(response):
+        if request.endpoint != 'static':
+            return response
+        # Static files honour Range requests; say so up front so media
+        # players seek with partial requests instead of re-downloading.
+        if response.status_code == 200:
+            response.accept_ranges = 'bytes'
+        filename = (request.view_args or {}).get('filename', '')
+        if filename.startswith(f'{DIST}/') and response.status_code in (200, 206, 304):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
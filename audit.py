@@ -0,0 +1,251 @@
+"""Audit log writer, retention and browsing.
+
+Entries either join the caller's business transaction (booking writes add the
+row to the open session and it commits with the booking) or are queued
+in-process and written by a background thread in group commits: one
+transaction per ``AUDIT_BATCH_SIZE`` entries or every ``AUDIT_FLUSH_INTERVAL``
+seconds, whichever comes first.  Anything still queued is flushed at shutdown.
+
+Rows older than ``AUDIT_RETENTION_DAYS`` are moved by ``archive_audit`` into
+append-only, gzip-compressed JSONL segments, one per month, so the live table
+stays small; ``iter_audit`` streams matches from both.
+"""
+import atexit
+import gzip
+import json
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from database import begin_write
+from metrics import AUDIT_ENTRIES, AUDIT_FLUSH_SECONDS, pid
+from models import db, AuditLog
+from search import encode_cursor, decode_cursor
+
+# First matching pattern wins; anything else is "other".
+ACTION_KINDS = [
+    ('login', re.compile(r'^User .* logged in$')),
+    ('logout', re.compile(r'^User .* logged out$')),
+    ('booking_create', re.compile(r'^Booking created\b')),
+    ('booking_update', re.compile(r'^Booking \d+ updated\b')),
+    ('booking_delete', re.compile(r'^Booking \d+ deleted\b')),
+    ('booking_bulk_update', re.compile(r'^Bulk reschedule\b')),
+    ('booking_bulk_delete', re.compile(r'^Bulk cancel\b')),
+]
+
+
+def classify_action(action):
+    for kind, pattern in ACTION_KINDS:
+        if pattern.search(action or ''):
+            return kind
+    return 'other'
+
+
+class AuditWriter:
+    def __init__(self):
+        self.app = None
+        self._queue = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.batch_size = 50
+        self.flush_interval = 0.5
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.setdefault('AUDIT_BATCH_SIZE', 50)
+        self.flush_interval = app.config.setdefault('AUDIT_FLUSH_INTERVAL', 0.5)
+        atexit.register(self.close)
+
+    # ---------- writing ----------
+    def add(self, action, user=None):
+        """Add an entry to the current session; it commits with the caller."""
+        db.session.add(AuditLog(action=action, user=user, kind=classify_action(action), timestamp=datetime.utcnow()))
+
+    def enqueue(self, action, user=None):
+        """Queue an entry for the next group commit."""
+        entry = {'action': action, 'user': user, 'kind': classify_action(action), 'timestamp': datetime.utcnow()}
+        with self._cond:
+            self._queue.append(entry)
+            self._ensure_thread()
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Write everything queued so far in one transaction."""
+        with self._cond:
+            batch, self._queue = self._queue, []
+        if not batch:
+            return 0
+        try:
+            with self.app.app_context(), AUDIT_FLUSH_SECONDS.time(pid=pid()):
+                with db.engine.begin() as conn:
+                    conn.execute(AuditLog.__table__.insert(), batch)
+        except Exception:
+            self.app.logger.exception("Audit flush failed; %d entries re-queued", len(batch))
+            with self._cond:
+                self._queue[:0] = batch
+            return 0
+        AUDIT_ENTRIES.inc(len(batch), pid=pid())
+        return len(batch)
+
+    def close(self):
+        """Stop the background writer and flush what is left."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self.app is not None:
+            self.flush()
+
+    # ---------- background thread ----------
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._queue) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+
+audit_writer = AuditWriter()
+
+
+def backfill_audit_kinds():
+    """Classify rows written before the ``kind`` column existed."""
+    rows = db.session.query(AuditLog.id, AuditLog.action).filter(AuditLog.kind.is_(None)).all()
+    if rows:
+        db.session.execute(AuditLog.__table__.update().where(AuditLog.id == db.bindparam('rid')).values(
+            kind=db.bindparam('k')), [{'rid': r.id, 'k': classify_action(r.action)} for r in rows])
+        db.session.commit()
+
+
+# ---------- Browsing ----------
+def filter_audit(qs, args):
+    """Apply ?user=, ?kind=, ?from= / ?to= (dates, inclusive) to an AuditLog query."""
+    if args.get('user'):
+        qs = qs.filter(AuditLog.user == args['user'])
+    if args.get('kind'):
+        qs = qs.filter(AuditLog.kind == args['kind'])
+    start, end = audit_range(args)
+    if start:
+        qs = qs.filter(AuditLog.timestamp >= start)
+    if end:
+        qs = qs.filter(AuditLog.timestamp < end)
+    return qs
+
+
+def audit_range(args):
+    def parse(key):
+        try:
+            return datetime.fromisoformat(args[key]) if args.get(key) else None
+        except ValueError:
+            return None
+    start, end = parse('from'), parse('to')
+    return start, (end + timedelta(days=1) if end else None)
+
+
+def audit_page(args, page_size=100):
+    """Newest-first page of live audit rows and the cursor for the next one."""
+    qs = filter_audit(AuditLog.query, args)
+    after = decode_cursor(args['cursor']) if args.get('cursor') else None
+    if after:
+        ts, ident = after
+        qs = qs.filter(or_(AuditLog.timestamp < ts, and_(AuditLog.timestamp == ts, AuditLog.id < ident)))
+    rows = qs.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(page_size + 1).all()
+    next_cursor = encode_cursor(rows[page_size - 1].timestamp, rows[page_size - 1].id) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+
+# ---------- Retention ----------
+def archive_dir():
+    return current_app.config.get('AUDIT_ARCHIVE_DIR') or os.path.join(current_app.instance_path, 'audit_archive')
+
+
+def _record(row):
+    return {'id': row.id, 'timestamp': row.timestamp.isoformat(), 'user': row.user,
+            'kind': row.kind, 'action': row.action}
+
+
+def archive_audit(cutoff, batch_size=5000):
+    """Move audit rows older than ``cutoff`` into monthly segments.
+
+    Each batch is appended to ``audit-YYYY-MM.jsonl.gz`` as a new gzip member
+    and fsync'd before the rows are deleted, so a crash can at worst leave a
+    row in both places (readers skip repeated ids), never lose one.
+    """
+    path = archive_dir()
+    os.makedirs(path, exist_ok=True)
+    moved = 0
+    while True:
+        begin_write()
+        rows = AuditLog.query.filter(AuditLog.timestamp < cutoff) \
+            .order_by(AuditLog.timestamp, AuditLog.id).limit(batch_size).all()
+        if not rows:
+            return moved
+        for month, group in groupby(rows, key=lambda r: r.timestamp.strftime('%Y-%m')):
+            payload = ''.join(json.dumps(_record(r)) + '\n' for r in group).encode()
+            with open(os.path.join(path, f'audit-{month}.jsonl.gz'), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as gz:
+                    gz.write(payload)
+                raw.flush()
+                os.fsync(raw.fileno())
+        AuditLog.query.filter(AuditLog.id.in_([r.id for r in rows])).delete(synchronize_session=False)
+        db.session.commit()
+        moved += len(rows)
+
+
+def _segments(start=None, end=None):
+    """Archived segment paths whose month intersects [start, end), oldest first."""
+    path = archive_dir()
+    if not os.path.isdir(path):
+        return []
+    lo = start.strftime('%Y-%m') if start else None
+    hi = (end - timedelta(microseconds=1)).strftime('%Y-%m') if end else None
+    names = sorted(n for n in os.listdir(path) if re.fullmatch(r'audit-\d{4}-\d{2}\.jsonl\.gz', n))
+    return [os.path.join(path, n) for n in names
+            if (lo is None or n[6:13] >= lo) and (hi is None or n[6:13] <= hi)]
+
+
+def iter_audit(args):
+    """Stream matching entries (dicts), oldest first: archived segments, then
+    the live table.  Supports the browse filters plus ?q= (case-insensitive
+    substring of the action)."""
+    user, kind = args.get('user'), args.get('kind')
+    start, end = audit_range(args)
+    needle = (args.get('q') or '').lower()
+
+    for seg in _segments(start, end):
+        seen = set()
+        with gzip.open(seg, 'rt') as fh:
+            for line in fh:
+                rec = json.loads(line)
+                if rec['id'] in seen:
+                    continue
+                seen.add(rec['id'])
+                ts = datetime.fromisoformat(rec['timestamp'])
+                if (user and rec['user'] != user) or (kind and rec['kind'] != kind) \
+                        or (start and ts < start) or (end and ts >= end) \
+                        or (needle and needle not in (rec['action'] or '').lower()):
+                    continue
+                yield rec
+
+    qs = filter_audit(AuditLog.query, args)
+    if needle:
+        qs = qs.filter(AuditLog.action.ilike(f'%{needle}%'))
+    for row in qs.order_by(AuditLog.timestamp, AuditLog.id).yield_per(500):
+        yield _record(row)
@@ -0,0 +1,5 @@
+"""Benchmarks, load tests and the synthetic data generator.
+
+Run modules from the repository root, e.g. ``python -m benchmarks.datagen``
+and ``python -m benchmarks.workload``; see each module's docstring.
+"""
@@ -0,0 +1,80 @@
+"""Benchmark: booking-creation throughput with per-entry audit commits vs.
+audit rows joining the booking transaction, and login-style audit entries
+committed one by one vs. queued for group commit.
+
+    python benchmarks/bench_audit.py [--n 500]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time as timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_conflicts import synthetic_rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--n', type=int, default=500)
+    args = ap.parse_args()
+
+    tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    tmp.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{tmp.name}'
+
+    from app import app
+    from audit import audit_writer
+    from models import db, Booking, AuditLog, upgrade_schema
+
+    def new_booking(row):
+        row = {k: v for k, v in row.items() if k not in ('start_at', 'end_at', 'created_at')}
+        return Booking(**row)
+
+    with app.app_context():
+        upgrade_schema()
+        rows = list(synthetic_rows(args.n * 2))
+
+        # Before: booking commit, then a second commit for its audit row.
+        t0 = timer.perf_counter()
+        for row in rows[:args.n]:
+            db.session.add(new_booking(row))
+            db.session.commit()
+            db.session.add(AuditLog(action=f"Booking created: {row['name']}", user='bench'))
+            db.session.commit()
+        before = timer.perf_counter() - t0
+
+        # After: the audit row joins the booking transaction.
+        t0 = timer.perf_counter()
+        for row in rows[args.n:]:
+            db.session.add(new_booking(row))
+            audit_writer.add(f"Booking created: {row['name']}", 'bench')
+            db.session.commit()
+        after = timer.perf_counter() - t0
+
+        # Session-only entries (login/logout): one commit each vs. group commit.
+        t0 = timer.perf_counter()
+        for i in range(args.n):
+            db.session.add(AuditLog(action=f'User bench{i} logged in', user='bench'))
+            db.session.commit()
+        single = timer.perf_counter() - t0
+
+        t0 = timer.perf_counter()
+        for i in range(args.n):
+            audit_writer.enqueue(f'User bench{i} logged in', 'bench')
+        audit_writer.close()
+        grouped = timer.perf_counter() - t0
+
+        assert AuditLog.query.count() == 4 * args.n
+
+    os.unlink(tmp.name)
+    print(f"bookings+audit, 2 commits each : {args.n / before:8.1f} bookings/s")
+    print(f"bookings+audit, joined commit  : {args.n / after:8.1f} bookings/s")
+    print(f"audit entries, commit each     : {args.n / single:8.1f} entries/s")
+    print(f"audit entries, group commit    : {args.n / grouped:8.1f} entries/s (incl. final flush)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark: one-year slot-bitmap availability search.
+
+    python benchmarks/bench_availability.py [--rows 20000] [--hours 4]
+
+Fills a throwaway SQLite database with back-to-back bookings and times
+``find_free_windows`` over a 365-day range, plus the bitmap sweep alone.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time as timer
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_conflicts import synthetic_rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=20_000)
+    ap.add_argument('--hours', type=float, default=4)
+    ap.add_argument('--repeat', type=int, default=20)
+    args = ap.parse_args()
+
+    tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    tmp.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{tmp.name}'
+
+    from app import app
+    from models import db, Booking, upgrade_schema
+    from availability import build_slot_map, find_free_windows, SLOT_MINUTES
+
+    with app.app_context():
+        upgrade_schema()
+        rows = list(synthetic_rows(args.rows))
+        db.session.execute(Booking.__table__.insert(), rows)
+        db.session.commit()
+
+        first = rows[len(rows) // 2]['from_date']
+        last = first + timedelta(days=364)
+
+        t0 = timer.perf_counter()
+        for _ in range(args.repeat):
+            windows = find_free_windows(first, last, args.hours, split_days=True)
+        total = (timer.perf_counter() - t0) / args.repeat
+
+        slots = build_slot_map(first, last)
+        need = max(1, -(-int(args.hours * 60) // SLOT_MINUTES))
+        t0 = timer.perf_counter()
+        for _ in range(args.repeat):
+            runs = list(slots.free_runs(need, split_days=True))
+        sweep = (timer.perf_counter() - t0) / args.repeat
+        if len(runs) != len(windows):
+            raise SystemExit(f"bitmap sweep found {len(runs)} windows, find_free_windows {len(windows)}")
+
+    os.unlink(tmp.name)
+    print(f"rows={args.rows} range={first}..{last} hours={args.hours} windows={len(windows)}")
+    print(f"find_free_windows (query + bitmap + sweep): {total * 1000:8.3f} ms")
+    print(f"bitmap sweep only                         : {sweep * 1000:8.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
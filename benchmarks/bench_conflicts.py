@@ -0,0 +1,114 @@
+"""Benchmark: indexed interval conflict query vs. the old linear overlap scan.
+
+    python benchmarks/bench_conflicts.py [--rows 100000] [--probes 500] [--venues 1]
+
+Builds a throwaway SQLite database, fills it with back-to-back bookings and
+times both strategies on the same random probe ranges.  With ``--venues N``
+the rows are spread over N halls, each with its own timeline, and the
+venue-scoped check is timed as well.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time as timer
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_overlap(Booking, from_date, from_time, to_date, to_time):
+    """The pre-index check from booking_new, kept verbatim for comparison."""
+    def time_to_minutes(t):
+        dt = datetime.strptime(t, '%I:%M %p')
+        return dt.hour * 60 + dt.minute
+
+    new_start = time_to_minutes(from_time)
+    new_end = time_to_minutes(to_time)
+    existing = Booking.query.filter(Booking.to_date >= from_date, Booking.from_date <= to_date).all()
+    for existing_b in existing:
+        exist_start = time_to_minutes(existing_b.from_time)
+        exist_end = time_to_minutes(existing_b.to_time)
+        if (from_date <= existing_b.to_date and to_date >= existing_b.from_date) and \
+                (new_start < exist_end and new_end > exist_start):
+            return True
+    return False
+
+
+def synthetic_rows(n, seed=7, venues=1):
+    rnd = random.Random(seed)
+    clocks = [datetime(2000, 1, 1, 8, 0)] * venues
+    for i in range(n):
+        v = i % venues
+        t = clocks[v] + timedelta(minutes=30 * rnd.randint(1, 20))
+        end = t + timedelta(minutes=30 * rnd.randint(1, 16))
+        yield {
+            'name': f'Bench {i}', 'phone': 9000000000 + i, 'email': 'bench@example.com', 'details': '',
+            'from_date': t.date(), 'to_date': end.date(),
+            'from_time': t.strftime('%I:%M %p'), 'to_time': end.strftime('%I:%M %p'),
+            'total_amount': 0, 'advance': 0, 'balance': 0, 'created_at': datetime.utcnow(),
+            'start_at': t, 'end_at': end, 'venue_id': v + 1,
+        }
+        clocks[v] = end
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, default=100_000)
+    ap.add_argument('--probes', type=int, default=500)
+    ap.add_argument('--venues', type=int, default=1)
+    args = ap.parse_args()
+
+    tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    tmp.close()
+    os.environ['DATABASE_URL'] = f'sqlite:///{tmp.name}'
+
+    from app import app
+    from models import db, Booking, Venue, upgrade_schema
+    from conflicts import find_conflicts
+
+    with app.app_context():
+        upgrade_schema()
+        for v in range(2, args.venues + 1):
+            db.session.add(Venue(name=f'Bench hall {v}', slug=f'bench-hall-{v}'))
+        db.session.commit()
+        rows = list(synthetic_rows(args.rows, venues=args.venues))
+        db.session.execute(Booking.__table__.insert(), rows)
+        db.session.commit()
+
+        rnd = random.Random(11)
+        probes = []
+        for _ in range(args.probes):
+            r = rnd.choice(rows)
+            start = r['start_at'] + timedelta(minutes=30 * rnd.randint(-4, 4))
+            end = start + timedelta(minutes=30 * rnd.randint(1, 8))
+            probes.append((start, end, r['venue_id']))
+
+        t0 = timer.perf_counter()
+        for start, end, _ in probes:
+            legacy_overlap(Booking, start.date(), start.strftime('%I:%M %p'), end.date(), end.strftime('%I:%M %p'))
+        legacy = timer.perf_counter() - t0
+        db.session.expunge_all()
+
+        t0 = timer.perf_counter()
+        hits = 0
+        for start, end, _ in probes:
+            hits += bool(find_conflicts(start, end))
+        indexed = timer.perf_counter() - t0
+
+        t0 = timer.perf_counter()
+        venue_hits = 0
+        for start, end, venue_id in probes:
+            venue_hits += bool(find_conflicts(start, end, venue_id=venue_id))
+        scoped = timer.perf_counter() - t0
+
+    os.unlink(tmp.name)
+    print(f"rows={args.rows} probes={args.probes} venues={args.venues} conflicting={hits} in venue={venue_hits}")
+    print(f"legacy scan : {legacy / args.probes * 1000:8.3f} ms/check")
+    print(f"indexed     : {indexed / args.probes * 1000:8.3f} ms/check")
+    print(f"per venue   : {scoped / args.probes * 1000:8.3f} ms/check")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark: worker cold start and first-request latency.
+
+    python benchmarks/bench_startup.py [--db /tmp/bench.db] [--runs 5]
+
+Each run starts a fresh interpreter, which imports ``app`` (building it with
+``create_app``, as a gunicorn worker does), then times its first public page,
+its first staff login, its first dashboard and its first receipt render --
+the one request that loads ReportLab (rendered inline, with ``JOBS_EAGER``).
+Without ``--db`` a throwaway database is used.  Prints per-run numbers and medians as JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time as timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+from app import app
+from models import db, Booking
+import receipts
+booted = time.perf_counter()
+result = {'import_and_boot_ms': (booted - started) * 1000,
+          'reportlab_loaded_at_boot': any(m.startswith('reportlab') for m in sys.modules)}
+client = app.test_client()
+
+def timed(name, method, path, **kw):
+    t0 = time.perf_counter()
+    resp = client.open(path, method=method, **kw)
+    result[name] = (time.perf_counter() - t0) * 1000
+    result[name[:-3] + '_status'] = resp.status_code
+    resp.close()
+
+timed('first_public_page_ms', 'GET', '/')
+timed('first_login_ms', 'POST', '/login7621', data={'username': 'Shahul', 'password': 'admin123'})
+timed('first_dashboard_ms', 'GET', '/bookings')
+with app.app_context():
+    booking_id = db.session.query(Booking.id).order_by(Booking.id).limit(1).scalar()
+if booking_id:
+    receipts.invalidate(booking_id)
+    timed('first_receipt_ms', 'GET', f'/booking/{booking_id}/receipt')
+    timed('second_receipt_ms', 'GET', f'/booking/{booking_id}/receipt')
+print(json.dumps(result))
+'''
+
+
+def run_once(env):
+    started = timer.perf_counter()
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True, text=True)
+    if out.returncode:
+        raise SystemExit(out.stderr)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result['process_total_ms'] = (timer.perf_counter() - started) * 1000
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--db', help='SQLite file to boot against (default: a new temporary one).')
+    ap.add_argument('--runs', type=int, default=5)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.abspath(args.db or os.path.join(tmp, 'startup.db'))
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}',
+                   JOBS_EAGER='1')  # render the receipt in the request, so it is what gets timed
+        # The first boot of a new database creates the schema; don't count it.
+        run_once(env)
+        runs = [run_once(env) for _ in range(args.runs)]
+
+    timings = sorted({k for r in runs for k, v in r.items() if k.endswith('_ms')})
+    report = {
+        'runs': args.runs,
+        'reportlab_loaded_at_boot': any(r['reportlab_loaded_at_boot'] for r in runs),
+        'median_ms': {k: round(statistics.median(r[k] for r in runs if k in r), 1) for k in timings},
+        'per_run': [{k: round(v, 1) if isinstance(v, float) else v for k, v in r.items()} for r in runs],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Synthetic data generator for benchmarks.
+
+    python -m benchmarks.datagen --db /tmp/bench.db --bookings 100000 [--users 20]
+        [--audit-per-booking 4] [--seed 1]
+
+Fills ``Booking``, ``User`` and ``AuditLog`` with realistic-looking rows:
+non-overlapping events on a half-hour grid (mostly daytime functions, some
+all-day and overnight ones, a few spanning several days), Indian names and
+phone numbers, amounts with partial advances, and an audit trail of logins
+and booking writes whose messages classify like the real ones.  The newest
+booking ends about six months from today and history runs backwards from
+there, so the current calendar months are populated at any scale.
+
+The same seed always produces the same rows.  Rows are written with Core
+bulk inserts in batches; the span and FTS triggers keep the indexes in sync
+and ``day_status`` is rebuilt once at the end.
+"""
+import argparse
+import os
+import random
+import sys
+import time as timer
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_NAMES = ['Arun', 'Divya', 'Suresh', 'Lakshmi', 'Rahul', 'Anjali', 'Vijay', 'Meera', 'Karthik', 'Priya',
+               'Shahul', 'Fathima', 'Joseph', 'Mary', 'Ganesh', 'Deepa', 'Anand', 'Revathi', 'Naveen', 'Sneha']
+LAST_NAMES = ['Nair', 'Menon', 'Pillai', 'Kumar', 'Iyer', 'Thomas', 'Varghese', 'Hameed', 'Krishnan', 'Das']
+EVENTS = ['Wedding reception', 'Engagement', 'Birthday party', 'Annual day', 'Seminar', 'Music concert',
+          'Dance recital', 'Corporate meet', 'Baptism', 'Conference', 'Prize distribution', 'Drama']
+STAFF_PASSWORD = 'bench123'
+
+# (weight, min half-hours, max half-hours)
+DURATIONS = [(60, 4, 10), (25, 12, 24), (10, 24, 48), (5, 48, 144)]
+
+
+def _duration(rnd):
+    pick = rnd.uniform(0, sum(w for w, _, _ in DURATIONS))
+    for weight, lo, hi in DURATIONS:
+        if pick < weight:
+            return timedelta(minutes=30 * rnd.randint(lo, hi))
+        pick -= weight
+    return timedelta(hours=4)
+
+
+def booking_rows(n, seed=1, anchor=None):
+    """Yield ``n`` booking dicts, newest first, that never overlap."""
+    rnd = random.Random(seed)
+    anchor = anchor or datetime.combine(datetime.today().date() + timedelta(days=180), datetime.min.time())
+    cursor = anchor
+    for i in range(n):
+        # Idle gap before the previous (later) booking: hours to a couple of days.
+        cursor -= timedelta(minutes=30 * rnd.choice((1, 2, 4, 8, 16, 24, 48, 96)))
+        duration = _duration(rnd)
+        end = cursor
+        start = end - duration
+        if duration < timedelta(hours=12):
+            # Snap short events into daytime: start between 6 AM and 6 PM.
+            start = start.replace(hour=rnd.randint(6, 18), minute=rnd.choice((0, 30)))
+            if start + duration > end:
+                start -= timedelta(days=1)
+            end = start + duration
+        total = rnd.choice((5000, 15000, 25000, 50000, 75000, 100000, 150000, 300000))
+        advance = round(total * rnd.choice((0, 0.1, 0.25, 0.5, 1.0)))
+        name = f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}"
+        yield {
+            'name': name,
+            'phone': rnd.randint(6000000000, 9999999999),
+            'email': f"{name.lower().replace(' ', '.')}{i % 97}@example.com" if rnd.random() < 0.7
+                     else 'not_provided@noemail.com',
+            'details': rnd.choice(EVENTS) if rnd.random() < 0.8 else '',
+            'from_date': start.date(), 'to_date': end.date(),
+            'from_time': start.strftime('%I:%M %p'), 'to_time': end.strftime('%I:%M %p'),
+            'total_amount': float(total), 'advance': float(advance), 'balance': float(total - advance),
+            'created_at': start - timedelta(days=rnd.randint(1, 120), minutes=rnd.randint(0, 1439)),
+            'start_at': start, 'end_at': end,
+        }
+        cursor = start
+
+
+def audit_rows(bookings, users, per_booking, seed=1):
+    """Yield audit dicts for the given booking dicts: a login, the create, some
+    updates and the occasional delete, each attributed to a random user."""
+    from audit import classify_action
+
+    rnd = random.Random(seed + 1)
+    for i, b in enumerate(bookings):
+        user = rnd.choice(users)
+        ts = b['created_at']
+        actions = [f'User {user} logged in',
+                   f"Booking created by {user}: {b['name']} {b['from_date']} {b['from_time']} "
+                   f"{b['to_date']} {b['to_time']}"]
+        for _ in range(max(0, per_booking - 2)):
+            actions.append(rnd.choice((f'Booking {i + 1} updated by {user}', f'User {user} logged out',
+                                       f'Receipt downloaded by {user}', f'Booking {i + 1} deleted by {user}')))
+        for action in actions[:per_booking]:
+            ts += timedelta(minutes=rnd.randint(1, 90))
+            yield {'action': action, 'user': user, 'kind': classify_action(action), 'timestamp': ts}
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(bookings, users=20, audit_per_booking=4, seed=1, batch_size=10_000, log=print):
+    """Populate the app's database (call inside an app context)."""
+    from werkzeug.security import generate_password_hash
+
+    from app import ADMIN_USERNAME, init_db
+    from models import db, AuditLog, Booking, User, write_transaction
+    from occupancy import rebuild_occupancy
+
+    init_db()
+    started = timer.perf_counter()
+    # Hashing is deliberately slow; every synthetic staff account shares one.
+    pw_hash = generate_password_hash(STAFF_PASSWORD)
+    names = [f'bench_staff{i}' for i in range(1, users + 1)]
+    existing = {u for (u,) in db.session.query(User.username)}
+    new_users = [{'username': u, 'pw_hash': pw_hash} for u in names if u not in existing]
+    if new_users:
+        db.session.execute(User.__table__.insert(), new_users)
+        db.session.commit()
+
+    written = 0
+    audits = 0
+    for batch in _batches(booking_rows(bookings, seed), batch_size):
+        with write_transaction(db.engine) as conn:
+            conn.execute(Booking.__table__.insert(), batch)
+            if audit_per_booking:
+                entries = list(audit_rows(batch, names + [ADMIN_USERNAME], audit_per_booking, seed + written))
+                conn.execute(AuditLog.__table__.insert(), entries)
+                audits += len(entries)
+        written += len(batch)
+        log(f"  {written:>9,} bookings  {audits:>10,} audit rows  {timer.perf_counter() - started:7.1f}s")
+    days = rebuild_occupancy()
+    log(f"Generated {written:,} bookings, {audits:,} audit rows, {len(new_users)} users; "
+        f"{days:,} occupied days in {timer.perf_counter() - started:.1f}s")
+    return written
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--db', required=True, help='SQLite file to create or extend.')
+    ap.add_argument('--bookings', type=int, default=10_000, help='Bookings to generate (1k .. 1M).')
+    ap.add_argument('--users', type=int, default=20)
+    ap.add_argument('--audit-per-booking', type=int, default=4)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--batch-size', type=int, default=10_000)
+    args = ap.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.db)}'
+    from app import app
+
+    with app.app_context():
+        generate(args.bookings, args.users, args.audit_per_booking, args.seed, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
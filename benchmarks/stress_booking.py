@@ -0,0 +1,136 @@
+"""Multi-process double-booking stress test.
+
+    python benchmarks/stress_booking.py [--procs 8] [--per-proc 60] [--slots 24] [--timeout 600]
+
+Each process runs its own copy of the app (own engine and pool) against one
+shared SQLite file and hammers ``/booking/new`` with random short bookings
+crammed into a few hours, so most attempts collide.  Afterwards the database
+is checked for any pair of overlapping bookings; the run fails if one exists
+or if any request errored (e.g. "database is locked"), and also when a
+process dies or the run takes longer than ``--timeout`` seconds.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import random
+import sqlite3
+import sys
+import tempfile
+import time as timer
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAY = datetime(2031, 3, 1)
+
+
+def _load_app(db_path):
+    sys.path.insert(0, ROOT)
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    from app import app, init_db
+    return app, init_db
+
+
+def setup(db_path):
+    app, init_db = _load_app(db_path)
+    with app.app_context():
+        init_db()
+
+
+def worker(db_path, seed, attempts, slots, results):
+    app, _ = _load_app(db_path)
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user'] = 'stress'
+    rnd = random.Random(seed)
+    created = rejected = errors = 0
+    for i in range(attempts):
+        start = DAY + timedelta(minutes=30 * rnd.randrange(slots))
+        end = start + timedelta(minutes=30 * rnd.randint(1, 3))
+        form = {
+            'name': f'p{seed}-{i}', 'phone': '9000000000', 'email': '', 'details': '',
+            'from_date': start.date().isoformat(), 'to_date': end.date().isoformat(),
+            'from_time': start.strftime('%I:%M %p'), 'to_time': end.strftime('%I:%M %p'),
+            'total_amount': '100', 'advance': '0', 'balance': '100',
+        }
+        r = client.post('/booking/new', data=form)
+        if r.status_code == 302:
+            created += 1
+        elif r.status_code == 200 and b'overlaps' in r.data:
+            rejected += 1
+        else:
+            errors += 1
+    results.put((created, rejected, errors))
+
+
+def _cleanup(db_path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.unlink(db_path + suffix)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--procs', type=int, default=8)
+    ap.add_argument('--per-proc', type=int, default=60)
+    ap.add_argument('--slots', type=int, default=24, help='half-hour start slots to contend for')
+    ap.add_argument('--timeout', type=float, default=600, help='seconds before the run is failed')
+    args = ap.parse_args()
+
+    tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    tmp.close()
+    ctx = mp.get_context('spawn')
+    p = ctx.Process(target=setup, args=(tmp.name,))
+    p.start()
+    p.join(args.timeout)
+    if p.exitcode != 0:
+        p.terminate()
+        _cleanup(tmp.name)
+        sys.exit(f"setup failed (exit code {p.exitcode})")
+
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(tmp.name, seed, args.per_proc, args.slots, results))
+             for seed in range(args.procs)]
+    t0 = timer.perf_counter()
+    deadline = timer.monotonic() + args.timeout
+    for p in procs:
+        p.start()
+    totals = []
+    # Poll, so a worker that died without reporting ends the wait early.
+    while len(totals) < len(procs) and timer.monotonic() < deadline:
+        try:
+            totals.append(results.get(timeout=1))
+        except queue.Empty:
+            if not any(p.is_alive() for p in procs) and results.empty():
+                break
+    for p in procs:
+        p.join(max(0.0, deadline - timer.monotonic()))
+        if p.is_alive():
+            p.terminate()
+            p.join()
+    elapsed = timer.perf_counter() - t0
+    failed = [p.exitcode for p in procs if p.exitcode != 0]
+    if failed or len(totals) != len(procs):
+        _cleanup(tmp.name)
+        sys.exit(f"{len(failed)} of {len(procs)} workers failed or timed out (exit codes {failed}); "
+                 f"{len(totals)} reported results")
+
+    created, rejected, errors = (sum(t[i] for t in totals) for i in range(3))
+    con = sqlite3.connect(tmp.name)
+    rows = con.execute("SELECT count(*) FROM booking").fetchone()[0]
+    overlaps = con.execute(
+        "SELECT count(*) FROM booking a JOIN booking b ON a.id < b.id "
+        "AND a.start_at < b.end_at AND b.start_at < a.end_at").fetchone()[0]
+    con.close()
+    _cleanup(tmp.name)
+
+    attempts = args.procs * args.per_proc
+    print(f"procs={args.procs} attempts={attempts} in {elapsed:.1f}s ({attempts / elapsed:.0f} req/s)")
+    print(f"created={created} rejected_as_overlap={rejected} errors={errors} rows={rows}")
+    print(f"double bookings: {overlaps}")
+    if overlaps or errors or rows != created:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""Scripted HTTP workload with latency percentiles, reported as JSON.
+
+    python -m benchmarks.workload --db /tmp/bench.db [--requests 2000] [--concurrency 4]
+        [--gunicorn 4 | --url http://127.0.0.1:8000] [--out run.json] [--compare baseline.json]
+
+Every virtual user logs in and then runs a weighted mix of the app's hot
+paths: the bookings dashboard, the staff calendar and its event feed, the
+public calendar and its availability feed, ``/booking/new`` posts that
+collide with an existing booking (and occasionally succeed in a free future
+slot), receipt downloads and ``/api/bookings/date/<d>``.  Targets:
+
+* default: in-process Flask test clients, one per thread;
+* ``--gunicorn N``: a local gunicorn with N workers started on ``--db``;
+* ``--url``: an already running server using the same database file.
+
+The report holds p50/p95/p99/mean latency and throughput per operation and
+overall, plus the row counts and settings of the run; ``--compare`` prints
+the change against an earlier report.  Booking creations write to the
+database, so benchmark a copy (see ``benchmarks.datagen``).
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time as timer
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_PASSWORD = 'admin123'
+
+# (name, weight)
+MIX = [
+    ('bookings', 20),
+    ('calendar', 5),
+    ('calendar_events', 15),
+    ('public_calendar', 5),
+    ('public_events', 15),
+    ('booking_conflict', 10),
+    ('booking_create', 2),
+    ('receipt', 8),
+    ('bookings_by_date', 20),
+]
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples, seconds):
+    lat = sorted(ms for ms, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'p50_ms': round(percentile(lat, 50), 3) if lat else None,
+        'p95_ms': round(percentile(lat, 95), 3) if lat else None,
+        'p99_ms': round(percentile(lat, 99), 3) if lat else None,
+        'mean_ms': round(sum(lat) / len(lat), 3) if lat else None,
+        'throughput_rps': round(len(samples) / seconds, 2) if seconds else None,
+    }
+
+
+# ---------- Transports ----------
+class TestClientTarget:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None):
+        resp = self.client.open(path, method=method, data=form)
+        resp.close()
+        return resp.status_code
+
+
+class HttpTarget:
+    """One cookie-keeping client over http.client (a connection per request,
+    since gunicorn's sync workers close after every response)."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.cookie = None
+
+    def request(self, method, path, form=None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            cookie = resp.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            return resp.status
+        finally:
+            conn.close()
+
+
+# ---------- Workload ----------
+class Workload:
+    def __init__(self, sample, seed):
+        self.sample = sample
+        self.seed = seed
+        self._free_slots = itertools.count()
+        self._lock = threading.Lock()
+
+    def free_slot(self):
+        with self._lock:
+            n = next(self._free_slots)
+        start = datetime(2200, 1, 1, 8, 0) + timedelta(days=n)
+        return start, start + timedelta(hours=4)
+
+    @staticmethod
+    def _form(name, start, end):
+        return {'name': name, 'phone': '9000000000', 'email': '', 'details': 'benchmark',
+                'from_date': start.date().isoformat(), 'to_date': end.date().isoformat(),
+                'from_time': start.strftime('%I:%M %p'), 'to_time': end.strftime('%I:%M %p'),
+                'total_amount': '1000', 'advance': '0', 'balance': '1000'}
+
+    def step(self, name, target, rnd):
+        """Run one operation; returns (status, ok)."""
+        b = rnd.choice(self.sample)
+        month = b['start_at'].replace(day=1, hour=0, minute=0)
+        feed = urlencode({'start': (month - timedelta(days=7)).isoformat(),
+                          'end': (month + timedelta(days=42)).isoformat()})
+        if name == 'bookings':
+            status = target.request('GET', '/bookings')
+        elif name == 'calendar':
+            status = target.request('GET', '/calendar')
+        elif name == 'calendar_events':
+            status = target.request('GET', f'/api/events?{feed}')
+        elif name == 'public_calendar':
+            status = target.request('GET', '/public_calendar')
+        elif name == 'public_events':
+            status = target.request('GET', f'/api/public/events?{feed}')
+        elif name == 'booking_conflict':
+            # Same slot as an existing booking: must be refused with the form (200).
+            status = target.request('POST', '/booking/new', self._form('Bench clash', b['start_at'], b['end_at']))
+            return status, status == 200
+        elif name == 'booking_create':
+            status = target.request('POST', '/booking/new', self._form('Bench new', *self.free_slot()))
+            return status, status == 302
+        elif name == 'receipt':
+            status = target.request('GET', f"/booking/{b['id']}/receipt")
+        elif name == 'bookings_by_date':
+            status = target.request('GET', f"/api/bookings/date/{b['start_at'].date().isoformat()}")
+        else:
+            raise ValueError(name)
+        return status, status < 400
+
+    def run_user(self, target, n, results, index):
+        rnd = random.Random(self.seed * 1000 + index)
+        names = [m for m, _ in MIX]
+        weights = [w for _, w in MIX]
+
+        t0 = timer.perf_counter()
+        status = target.request('POST', '/login7621', {'username': 'Shahul', 'password': ADMIN_PASSWORD})
+        results['login'].append(((timer.perf_counter() - t0) * 1000, status == 302))
+
+        for _ in range(n):
+            name = rnd.choices(names, weights)[0]
+            t0 = timer.perf_counter()
+            try:
+                _, ok = self.step(name, target, rnd)
+            except (OSError, http.client.HTTPException):
+                ok = False
+            results[name].append(((timer.perf_counter() - t0) * 1000, ok))
+
+
+def load_sample(app, size, seed):
+    """Random existing bookings to aim requests at, plus table sizes."""
+    from sqlalchemy import func
+
+    from models import db, AuditLog, Booking, User
+
+    with app.app_context():
+        counts = {'bookings': Booking.query.count(), 'users': User.query.count(),
+                  'audit_log': AuditLog.query.count()}
+        rnd = random.Random(seed)
+        max_id = db.session.query(func.max(Booking.id)).scalar() or 0
+        ids = {rnd.randint(1, max_id) for _ in range(size * 2)} if max_id else set()
+        rows = db.session.query(Booking.id, Booking.start_at, Booking.end_at) \
+            .filter(Booking.id.in_(ids), Booking.start_at.isnot(None)).limit(size).all()
+    return [{'id': r.id, 'start_at': r.start_at, 'end_at': r.end_at} for r in rows], counts
+
+
+def start_gunicorn(db_path, workers, port):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.abspath(db_path)}')
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+                             '--log-level', 'warning', '--preload', 'app:app'], cwd=ROOT, env=env)
+    deadline = timer.time() + 30
+    while timer.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise SystemExit("gunicorn exited during startup")
+            timer.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("gunicorn did not start listening within 30s")
+
+
+def compare(report, baseline):
+    print(f"{'operation':<18} {'p50 ms':>18} {'p95 ms':>18} {'rps':>18}")
+    for name, cur in report['operations'].items():
+        old = baseline.get('operations', {}).get(name)
+        if not old:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'throughput_rps'):
+            a, b = old.get(key), cur.get(key)
+            change = f"{(b - a) / a * 100:+.0f}%" if a and b is not None else 'n/a'
+            cells.append(f"{b!s:>10} {change:>7}")
+        print(f"{name:<18} " + ' '.join(cells))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--db', required=True, help='SQLite file to benchmark against (will receive new bookings).')
+    ap.add_argument('--requests', type=int, default=2000, help='Total operations (excluding logins).')
+    ap.add_argument('--concurrency', type=int, default=4, help='Virtual users (threads).')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--sample', type=int, default=500, help='Existing bookings to aim requests at.')
+    target = ap.add_mutually_exclusive_group()
+    target.add_argument('--gunicorn', type=int, metavar='WORKERS', help='Start a local gunicorn with this many workers.')
+    target.add_argument('--url', help='Base URL of an already running server on the same database.')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--out', help='Write the JSON report here (default: stdout).')
+    ap.add_argument('--compare', help='Earlier JSON report to compare against.')
+    args = ap.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.db)}'
+    from app import app, init_db
+
+    with app.app_context():
+        init_db()
+    sample, counts = load_sample(app, args.sample, args.seed)
+    if not sample:
+        raise SystemExit("No bookings in the database; run benchmarks.datagen first.")
+
+    server = None
+    if args.gunicorn:
+        server = start_gunicorn(args.db, args.gunicorn, args.port)
+        make_target = lambda: HttpTarget(f'http://127.0.0.1:{args.port}')
+        target_desc = f'gunicorn x{args.gunicorn}'
+    elif args.url:
+        make_target = lambda: HttpTarget(args.url)
+        target_desc = args.url
+    else:
+        make_target = lambda: TestClientTarget(app)
+        target_desc = 'test-client'
+
+    workload = Workload(sample, args.seed)
+    results = {name: [] for name in ['login'] + [m for m, _ in MIX]}
+    per_user = [args.requests // args.concurrency + (i < args.requests % args.concurrency)
+                for i in range(args.concurrency)]
+    # Lists are only appended to, which is atomic under the GIL.
+    threads = [threading.Thread(target=workload.run_user, args=(make_target(), n, results, i))
+               for i, n in enumerate(per_user)]
+    started = timer.perf_counter()
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        elapsed = timer.perf_counter() - started
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    everything = [s for name, samples in results.items() if name != 'login' for s in samples]
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'git_rev': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                      capture_output=True, text=True).stdout.strip() or None,
+            'target': target_desc,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'seed': args.seed,
+            'rows': counts,
+        },
+        'overall': dict(summarize(everything, elapsed), seconds=round(elapsed, 3)),
+        'operations': {name: summarize(samples, elapsed) for name, samples in results.items() if samples},
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as fh:
+            fh.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(report, json.load(fh))
+
+
+if __name__ == '__main__':
+    main()
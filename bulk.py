@@ -0,0 +1,283 @@
+"""Bulk reschedule and cancel.
+
+Staff pick a set of bookings -- everything matching the dashboard filters,
+narrowed down with checkboxes -- and shift them by N days, move them so the
+earliest starts on a given date (optionally into another venue), or cancel
+them.
+
+A selected one-off booking or whole series moves as one row; a series'
+gaps (deleted or detached occurrences) move with it, while the bookings
+detached from it stay put unless they are selected too.  A selected
+occurrence of a series is detached into a booking of its own at the new
+time, as editing it alone would; cancelling it deletes just that occurrence.
+
+``plan_bulk`` only reads, and is the dry-run preview: every new interval is
+checked against the bookings and live holds of its venue, leaving out those
+that are moving away, and against the rest of the batch, in one
+``sweep_conflicts`` pass per venue.  ``apply_plan`` writes a clash-free plan;
+the caller plans again under the write lock and commits the whole batch in
+one transaction with one audit entry, or nothing when anything clashes.
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from conflicts import existing_intervals, sweep_conflicts
+from holds import conflicting_holds
+from models import db, Booking, BookingException, SlotHold
+from recurrence import RULE_FIELDS, expand, occurrence_at, occurrences, skipped_starts
+from search import filter_bookings
+
+MAX_BULK_ITEMS = 500
+ACTIONS = ('shift', 'move', 'cancel')
+FILTER_KEYS = ('date', 'from', 'to', 'venue', 'q', 'balance_due', 'min_amount', 'max_amount')
+
+
+class BulkItem:
+    """One selected booking (a whole series for a recurring one), or one
+    ``occurrence`` of a series."""
+
+    def __init__(self, booking, occurrence=None):
+        self.booking = booking
+        self.occurrence = occurrence
+
+    @property
+    def whole(self):
+        return self.occurrence is None
+
+    @property
+    def key(self):
+        """The dashboard's row id: '12', or '12@<occurrence key>'."""
+        return str(self.booking.id) if self.whole else f"{self.booking.id}@{self.occurrence.key}"
+
+    @property
+    def start_at(self):
+        return (self.occurrence or self.booking).start_at
+
+    @property
+    def end_at(self):
+        return (self.occurrence or self.booking).end_at
+
+    def label(self):
+        if self.whole:
+            return f"#{self.booking.id}"
+        return f"#{self.booking.id} ({self.start_at:%Y-%m-%d %I:%M %p})"
+
+
+# ---------- Selecting ----------
+def _window(args):
+    """The ?date= or ?from= / ?to= range of the filters as datetimes (either
+    side may be None), for narrowing series to their occurrences."""
+    try:
+        if args.get('date'):
+            first = last = date.fromisoformat(args['date'])
+        else:
+            first = date.fromisoformat(args['from']) if args.get('from') else None
+            last = date.fromisoformat(args['to']) if args.get('to') else None
+    except ValueError:
+        return None, None
+    return (datetime.combine(first, datetime.min.time()) if first else None,
+            datetime.combine(last + timedelta(days=1), datetime.min.time()) if last else None)
+
+
+def items_from_filters(args):
+    """Everything matching the dashboard filters ``args``, a series as its
+    occurrences in the filters' date range (whole when there is none).
+    Without any filter nothing is selected."""
+    if not any(args.get(k) for k in FILTER_KEYS):
+        return []
+    start, end = _window(args)
+    items = []
+    for b in filter_bookings(args).order_by(Booking.start_at, Booking.id).limit(MAX_BULK_ITEMS + 1):
+        if b.recurrence and (start or end):
+            items.extend(BulkItem(b, occ) for occ in expand([b], start or b.start_at, end or b.series_end_at))
+        else:
+            items.append(BulkItem(b))
+    items.sort(key=lambda it: (it.start_at, it.booking.id))
+    return items
+
+
+def items_from_keys(keys):
+    """Items for dashboard row ids ('12', or '12@<occurrence key>').  An
+    occurrence of a series that is itself selected is dropped; unknown or
+    already deleted ids are skipped."""
+    wanted = defaultdict(set)
+    for key in keys:
+        ident, _, occ = key.strip().partition('@')
+        if ident.isdigit():
+            wanted[int(ident)].add(occ or None)
+    bookings = {b.id: b for b in Booking.query.filter(Booking.id.in_(list(wanted)))} if wanted else {}
+    items = []
+    for ident, occs in wanted.items():
+        b = bookings.get(ident)
+        if b is None:
+            continue
+        if None in occs or not b.recurrence:
+            items.append(BulkItem(b))
+            continue
+        for occ in filter(None, (occurrence_at(b, k) for k in occs)):
+            items.append(BulkItem(b, occ))
+    items.sort(key=lambda it: (it.start_at, it.booking.id))
+    return items
+
+
+# ---------- Planning ----------
+class BulkChange:
+    """What happens to one item: its new first interval (``start_at``,
+    ``end_at``) and venue, and ``clash`` -- why it cannot move, or None."""
+
+    def __init__(self, item, start_at=None, end_at=None, venue_id=None):
+        self.item = item
+        self.start_at = start_at
+        self.end_at = end_at
+        self.venue_id = venue_id
+        self.clash = None
+
+
+class BulkPlan:
+    def __init__(self, action, delta=None, venue=None):
+        self.action = action
+        self.delta = delta
+        self.venue = venue
+        self.changes = []
+
+    def by_key(self):
+        return {c.item.key: c for c in self.changes}
+
+    @property
+    def clashes(self):
+        return [c for c in self.changes if c.clash]
+
+    def describe(self):
+        """What the plan does, for the audit log and flash messages."""
+        n = len(self.changes)
+        what = f"{n} booking{'s' if n != 1 else ''}"
+        if self.action == 'cancel':
+            return f"{what} cancelled"
+        days = self.delta.days
+        shift = f"moved {days:+d} day{'s' if abs(days) != 1 else ''}" if days else "moved"
+        return f"{what} {shift}" + (f" to {self.venue.name}" if self.venue else "")
+
+
+def _moved_rule(b, delta):
+    rule = SimpleNamespace(**{f: getattr(b, f) for f in RULE_FIELDS})
+    rule.start_at += delta
+    rule.end_at += delta
+    if rule.recur_until:
+        rule.recur_until += delta
+    return rule
+
+
+def _new_intervals(item, delta):
+    """Every interval ``item`` occupies once moved by ``delta``."""
+    b = item.booking
+    if not item.whole or not b.recurrence:
+        return [(item.start_at + delta, item.end_at + delta)]
+    skip = {s + delta for s in skipped_starts([b.id]).get(b.id, ())}
+    return list(occurrences(_moved_rule(b, delta), skip=skip))
+
+
+def _describe_hit(hit, changes):
+    kind, ident = hit
+    if kind == 'row':
+        return f"overlaps {changes[ident[0]].item.label()} of this batch"
+    if isinstance(ident, SlotHold):
+        return f"is held by {ident.user}"
+    other = db.session.get(Booking, ident)
+    return f"overlaps #{ident} {other.name}" if other else f"overlaps #{ident}"
+
+
+def plan_bulk(action, items, days=None, start_on=None, venue=None):
+    """Plan ``action`` ('shift' by ``days``, 'move' so the earliest item
+    starts on ``start_on``, or 'cancel') for ``items``, moving them into
+    ``venue`` when given.  Reads only; raises ValueError for a bad request."""
+    if action not in ACTIONS:
+        raise ValueError("Choose shift, move or cancel.")
+    if not items:
+        raise ValueError("No bookings selected.")
+    if len(items) > MAX_BULK_ITEMS:
+        raise ValueError(f"At most {MAX_BULK_ITEMS} bookings can be changed at once; narrow the filters.")
+    if action == 'cancel':
+        plan = BulkPlan(action)
+        plan.changes = [BulkChange(it) for it in items]
+        return plan
+
+    if action == 'shift':
+        if not days:
+            raise ValueError("Shift by a non-zero number of days.")
+        delta = timedelta(days=days)
+    else:
+        if start_on is None:
+            raise ValueError("Choose the date the first booking should move to.")
+        delta = timedelta(days=(start_on - min(it.start_at.date() for it in items)).days)
+    if not delta and (venue is None or all(it.booking.venue_id == venue.id for it in items)):
+        raise ValueError("That leaves every booking where it is.")
+
+    plan = BulkPlan(action, delta, venue)
+    candidates = defaultdict(list)  # venue id -> [(start, end, (change index, start))]
+    for i, item in enumerate(items):
+        venue_id = venue.id if venue else item.booking.venue_id
+        plan.changes.append(BulkChange(item, item.start_at + delta, item.end_at + delta, venue_id))
+        candidates[venue_id].extend((s, e, (i, s)) for s, e in _new_intervals(item, delta))
+
+    # What is moving away no longer counts against the new times.
+    moving = {it.booking.id for it in items if it.whole}
+    leaving = {(it.booking.id, it.start_at) for it in items if not it.whole}
+    with db.session.no_autoflush:
+        for venue_id, batch in candidates.items():
+            lo = min(s for s, _, _ in batch)
+            hi = max(e for _, e, _ in batch)
+            existing = [iv for iv in existing_intervals(lo, hi, moving, venue_id) if (iv[2], iv[0]) not in leaving]
+            held = [(h.start_at, h.end_at, h) for h in conflicting_holds(lo, hi, venue_id=venue_id)]
+            for (i, _), hit in sorted(sweep_conflicts(batch, existing + held).items(), key=lambda kv: kv[0][1]):
+                if plan.changes[i].clash is None and not (hit[0] == 'row' and hit[1][0] == i):
+                    plan.changes[i].clash = _describe_hit(hit, plan.changes)
+    return plan
+
+
+# ---------- Applying ----------
+def _shift_exceptions(b, delta):
+    # One row at a time, furthest first, so no two rows of the series ever
+    # hold the same occurrence_start (it is unique per series).
+    table = BookingException.__table__
+    rows = db.session.execute(table.select().where(table.c.booking_id == b.id)).all()
+    for row in sorted(rows, key=lambda r: r.occurrence_start, reverse=delta > timedelta(0)):
+        db.session.execute(table.update().where(table.c.id == row.id).values(
+            occurrence_start=row.occurrence_start + delta, occurrence_end=row.occurrence_end + delta))
+    db.session.expire(b, ['exceptions'])
+
+
+def apply_plan(plan):
+    """Write ``plan`` into the current transaction (the caller commits).
+    Returns the ids of the bookings created for detached occurrences."""
+    if plan.clashes:
+        raise ValueError("The plan has clashes.")
+    created = []
+    for change in plan.changes:
+        item, b = change.item, change.item.booking
+        if plan.action == 'cancel':
+            if item.whole:
+                db.session.delete(b)
+            else:
+                db.session.add(BookingException(booking=b, occurrence_start=item.start_at,
+                                                occurrence_end=item.end_at))
+        elif item.whole:
+            if b.recurrence and plan.delta:
+                _shift_exceptions(b, plan.delta)
+            b.from_date += plan.delta
+            b.to_date += plan.delta
+            if b.recur_until:
+                b.recur_until += plan.delta
+            b.venue_id = change.venue_id
+        else:
+            occ = item.occurrence
+            single = Booking(venue_id=change.venue_id, name=b.name, phone=b.phone, email=b.email, details=b.details,
+                             from_date=occ.from_date + plan.delta, to_date=occ.to_date + plan.delta,
+                             from_time=b.from_time, to_time=b.to_time,
+                             total_amount=b.total_amount, advance=b.advance, balance=b.balance)
+            db.session.add(single)
+            db.session.flush()
+            db.session.add(BookingException(booking=b, occurrence_start=item.start_at, occurrence_end=item.end_at,
+                                            detached_id=single.id))
+            created.append(single.id)
+    return created
@@ -0,0 +1,346 @@
+"""Booking change feed, streamed to open staff pages as Server-Sent Events.
+
+Every booking insert, update and delete made through the session writes a
+compact JSON delta to ``booking_change`` in the same transaction, so the
+feed holds exactly the committed writes of every worker, in commit order;
+the row id is the SSE event id.  Slot holds (holds.py) are recorded the same
+way as ``hold`` events; their expiry is left to the page.  Bulk Core writes
+(imports) and changes to recurring series, which would otherwise need every
+occurrence sent, record a ``reset`` instead, telling pages to refetch.
+
+Each process runs one broker thread.  While a stream is open it reads new
+rows -- straight after a commit in this process, otherwise every
+``CHANGEFEED_POLL_INTERVAL`` seconds to catch other workers' writes -- and
+wakes the ``/api/stream`` generators, which share what it read.  A
+reconnecting ``EventSource`` sends ``Last-Event-ID`` and is replayed what it
+missed from the table; if that part has been pruned (only the newest
+``CHANGEFEED_KEEP`` rows are kept) it gets a ``reset`` event instead.
+
+Streams close after ``CHANGEFEED_STREAM_SECONDS`` and the browser reconnects
+and resumes, so no worker thread is held for a whole working day.  Every
+open stream still holds one worker thread, so gunicorn runs threaded workers
+(see the Procfile) and a process serves at most ``CHANGEFEED_MAX_STREAMS``
+streams at once; keep that below gunicorn's ``--threads`` so ordinary
+requests always find a free thread.  A page over the limit is told to retry
+in ``CHANGEFEED_BUSY_RETRY`` seconds (likely reaching another worker) and
+goes without live updates until then.  With the Procfile's 32 threads and the
+default limit of 24, each worker keeps 8 threads for everything else.
+
+Config:
+
+    CHANGEFEED_POLL_INTERVAL   seconds between reads for other workers' writes (default 1)
+    CHANGEFEED_KEEP            change rows kept for resuming (default 5000)
+    CHANGEFEED_HEARTBEAT       seconds between keep-alive comments (default 15)
+    CHANGEFEED_STREAM_SECONDS  lifetime of one stream before the client reconnects (default 300)
+    CHANGEFEED_MAX_STREAMS     open streams per process (default 24)
+    CHANGEFEED_BUSY_RETRY      seconds a page over that limit waits before retrying (default 30)
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from itertools import chain
+from datetime import datetime
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from metrics import CHANGEFEED_STREAMS, pid
+from models import db, Booking, BookingChange, BookingException, SlotHold
+
+FULL_DAY_HOURS = 8
+STATUS_COLORS = {'full': '#ef4444', 'partial': '#a855f7'}  # red / purple
+HOLD_COLOR = '#94a3b8'  # slate
+HOLD_OPS = ('hold', 'release')
+BUFFER_SIZE = 1000
+READ_LIMIT = 500
+RETRY_MS = 3000
+
+
+def event_status(start, end):
+    return 'full' if (end - start).total_seconds() / 3600 >= FULL_DAY_HOURS else 'partial'
+
+
+def booking_delta(b):
+    """What the calendar and dashboard need to show ``b``: a calendar event
+    plus the dashboard columns."""
+    status = event_status(b.start_at, b.end_at)
+    return {
+        'id': b.id,
+        'title': b.name or 'Booking',
+        'start': b.start_at.isoformat(),
+        'end': b.end_at.isoformat(),
+        'color': STATUS_COLORS[status],
+        'status': status,
+        'name': b.name,
+        'details': b.details,
+        'from_date': b.from_date.isoformat(),
+        'to_date': b.to_date.isoformat(),
+        'from_time': b.from_time,
+        'to_time': b.to_time,
+        'created_at': b.created_at.isoformat() if b.created_at else None,
+        'venue_id': b.venue_id,
+    }
+
+
+def hold_delta(h):
+    """A slot hold as a calendar event (ids are prefixed to keep them apart
+    from bookings)."""
+    return {
+        'id': f'hold-{h.id}',
+        'title': f'Held by {h.user}',
+        'start': h.start_at.isoformat(),
+        'end': h.end_at.isoformat(),
+        'color': HOLD_COLOR,
+        'status': 'hold',
+        'from_time': f'{h.start_at:%I:%M %p}',
+        'to_time': f'{h.end_at:%I:%M %p}',
+        'details': 'Tentative hold while a booking is being entered',
+        'expires_at': h.expires_at.isoformat() + 'Z',
+        'venue_id': h.venue_id,
+    }
+
+
+# ---------- Recording ----------
+def _change_row(op, ident=None, **payload):
+    """``payload`` is the object's delta: ``booking=`` or ``hold=``."""
+    data = dict({'op': op, 'id': ident}, **payload)
+    return {'booking_id': ident if op in ('upsert', 'delete') else None, 'op': op,
+            'data': json.dumps(data, separators=(',', ':')), 'created_at': datetime.utcnow()}
+
+
+def record_changes(conn, rows):
+    """Insert change rows on ``conn`` (inside the writer's transaction) and
+    prune the ones too old to resume from."""
+    table = BookingChange.__table__
+    conn.execute(table.insert(), rows)
+    newest = conn.execute(select(func.max(table.c.id))).scalar()
+    conn.execute(table.delete().where(table.c.id <= newest - broker.keep))
+
+
+def record_reset(conn):
+    """Tell open pages to refetch everything (after bulk Core writes)."""
+    record_changes(conn, [_change_row('reset')])
+
+
+def _is_series(obj):
+    """Whether a booking is, or was before this flush, a recurring series."""
+    history = inspect(obj).attrs.recurrence.history
+    return any(history.added) or any(history.unchanged) or any(history.deleted)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_booking_changes(session, flush_context, instances):
+    pending = session.info.setdefault('changefeed_pending',
+                                      {'upsert': [], 'delete': [], 'hold': [], 'release': [], 'reset': []})
+    changed = [o for o in session.dirty if session.is_modified(o)]
+    for kind, ups, downs in ((Booking, 'upsert', 'delete'), (SlotHold, 'hold', 'release')):
+        pending[ups].extend(o for o in session.new if isinstance(o, kind))
+        pending[ups].extend(o for o in changed if isinstance(o, kind))
+        pending[downs].extend(o for o in session.deleted if isinstance(o, kind))
+    series = [o for o in pending['upsert'] + pending['delete'] if _is_series(o)]
+    if series or any(isinstance(o, BookingException) for o in chain(session.new, session.deleted, changed)):
+        pending['upsert'] = [o for o in pending['upsert'] if o not in series]
+        pending['delete'] = [o for o in pending['delete'] if o not in series]
+        pending['reset'] = [True]
+    pending['delete'] = [o.id for o in pending['delete']]
+    pending['release'] = [o.id for o in pending['release']]
+    if not any(pending.values()):
+        session.info.pop('changefeed_pending')
+
+
+@event.listens_for(Session, 'after_flush')
+def _write_booking_changes(session, flush_context):
+    pending = session.info.pop('changefeed_pending', None)
+    if not pending:
+        return
+    rows = [_change_row('upsert', b.id, booking=booking_delta(b)) for b in pending['upsert']]
+    rows += [_change_row('delete', booking_id) for booking_id in pending['delete']]
+    rows += [_change_row('hold', h.id, hold=hold_delta(h)) for h in pending['hold']]
+    rows += [_change_row('release', hold_id) for hold_id in pending['release']]
+    rows += [_change_row('reset') for _ in pending['reset']]
+    record_changes(session.connection(), rows)
+    session.info['changefeed_written'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_broker(session):
+    if session.info.pop('changefeed_written', False):
+        broker.notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('changefeed_pending', None)
+    session.info.pop('changefeed_written', None)
+
+
+# ---------- Broker ----------
+class ChangeBroker:
+    def __init__(self):
+        self.app = None
+        self.poll_interval = 1.0
+        self.keep = 5000
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=BUFFER_SIZE)  # (id, op, data), contiguous ids
+        self._newest = None
+        self._waiting = 0
+        self._wake = False
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_interval = app.config.setdefault('CHANGEFEED_POLL_INTERVAL', 1.0)
+        self.keep = app.config.setdefault('CHANGEFEED_KEEP', 5000)
+        app.config.setdefault('CHANGEFEED_HEARTBEAT', 15)
+        app.config.setdefault('CHANGEFEED_STREAM_SECONDS', 300)
+        app.config.setdefault('CHANGEFEED_MAX_STREAMS', int(os.environ.get('CHANGEFEED_MAX_STREAMS', 24)))
+        app.config.setdefault('CHANGEFEED_BUSY_RETRY', 30)
+
+    # ---------- reading ----------
+    def latest_id(self):
+        with self.app.app_context(), db.engine.connect() as conn:
+            return conn.execute(select(func.max(BookingChange.id))).scalar() or 0
+
+    def read_after(self, after, limit=READ_LIMIT):
+        """Changes with id > ``after`` from the table, or None if some of them
+        have been pruned."""
+        table = BookingChange.__table__
+        with self.app.app_context(), db.engine.connect() as conn:
+            rows = conn.execute(select(table.c.id, table.c.op, table.c.data).where(table.c.id > after)
+                                .order_by(table.c.id).limit(limit)).all()
+        if rows and rows[0][0] != after + 1 and after:
+            return None
+        return [tuple(r) for r in rows]
+
+    def notify(self):
+        """A change was committed in this process; read it now."""
+        with self._cond:
+            self._wake = True
+            self._cond.notify_all()
+
+    def wait(self, after, timeout):
+        """Changes after ``after``, waiting up to ``timeout`` seconds for one.
+
+        Returns a list (empty on timeout), or None when the client has to
+        reset because what it missed is gone.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting += 1
+            if self._waiting == 1:
+                self._wake = True  # may have idled; catch up before the next interval
+            self._ensure_thread()
+            self._cond.notify_all()
+            try:
+                while True:
+                    if self._newest is not None and self._newest > after:
+                        if self._events and self._events[0][0] <= after + 1:
+                            return [e for e in self._events if e[0] > after]
+                        break  # older than the buffer: read from the table below
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return []
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+        return self.read_after(after)
+
+    # ---------- background thread ----------
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='changefeed', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._waiting:
+                    self._cond.wait()
+                if not self._wake:
+                    self._cond.wait(self.poll_interval)
+                self._wake = False
+            try:
+                self._poll()
+            except Exception:
+                self.app.logger.exception("Change feed poll failed")
+                time.sleep(self.poll_interval)
+
+    def _poll(self):
+        if self._newest is None:
+            newest, rows = self.latest_id(), []
+        else:
+            rows = self.read_after(self._newest, limit=BUFFER_SIZE)
+            if rows is None:  # fell behind the pruning; restart the buffer
+                newest, rows = self.latest_id(), []
+            else:
+                newest = rows[-1][0] if rows else self._newest
+        with self._cond:
+            if rows and self._events and rows[0][0] != self._events[-1][0] + 1:
+                self._events.clear()
+            self._events.extend(rows)
+            self._newest = newest
+            self._cond.notify_all()
+
+
+broker = ChangeBroker()
+
+_open_streams = 0
+_open_lock = threading.Lock()
+
+
+def _open_stream(limit):
+    """Take a stream slot; False when ``limit`` streams are already open."""
+    global _open_streams
+    with _open_lock:
+        if _open_streams >= limit:
+            return False
+        _open_streams += 1
+        CHANGEFEED_STREAMS.set(_open_streams, pid=pid())
+        return True
+
+
+def _close_stream():
+    global _open_streams
+    with _open_lock:
+        _open_streams -= 1
+        CHANGEFEED_STREAMS.set(_open_streams, pid=pid())
+
+
+def sse(data, event=None, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def change_stream(after):
+    """SSE body: ``booking`` and ``hold`` events after ``after``, ``reset``
+    when the client must refetch, and keep-alive comments while nothing
+    happens."""
+    config = broker.app.config
+    heartbeat = config['CHANGEFEED_HEARTBEAT']
+    deadline = time.monotonic() + config['CHANGEFEED_STREAM_SECONDS']
+    if not _open_stream(config['CHANGEFEED_MAX_STREAMS']):
+        # Free the thread at once; the browser comes back after the delay.
+        yield f"retry: {config['CHANGEFEED_BUSY_RETRY'] * 1000}\n\n"
+        return
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            changes = broker.wait(after, min(heartbeat, remaining))
+            if changes is None:
+                after = broker.latest_id()
+                yield sse('{"op":"reset"}', 'reset', after)
+            elif not changes:
+                yield ': keep-alive\n\n'
+            for change_id, op, data in changes or ():
+                after = change_id
+                yield sse(data, op if op == 'reset' else 'hold' if op in HOLD_OPS else 'booking', change_id)
+    finally:
+        _close_stream()
@@ -0,0 +1,149 @@
+"""Booking conflict detection.
+
+Every booking carries a normalized ``[start_at, end_at)`` interval (see
+``models.booking_interval``).  On SQLite the ``booking_span`` R*Tree answers
+"does this range intersect anything?" in one indexed query; elsewhere the
+``ix_booking_venue_end_start`` composite index is used.  Either way nothing
+is re-parsed in Python.
+
+Bookings only clash within a venue: every lookup takes the ``venue_id`` to
+check, and only the tree's part for that venue is searched.  ``venue_id=None``
+looks across all venues (reports, cross-venue listings).
+
+A recurring booking is indexed by its whole series, so the query finds the
+series row and ``recurrence.expand`` narrows it to the occurrences that
+really intersect the range.
+"""
+from bisect import bisect_left
+
+from sqlalchemy import or_, select
+
+from models import db, Booking, booking_interval, epoch_minutes, uses_span_index
+from recurrence import RULE_FIELDS, expand, expand_intervals
+
+booking_span = db.table('booking_span', db.column('id'), db.column('start_min'), db.column('end_min'),
+                        db.column('venue_lo'), db.column('venue_hi'))
+
+
+def span_ids(start, end, venue_id=None):
+    """Subquery of booking ids whose span intersects ``[start, end)`` (in one venue)."""
+    q = select(booking_span.c.id).where(
+        booking_span.c.start_min < epoch_minutes(end),
+        booking_span.c.end_min > epoch_minutes(start),
+    )
+    if venue_id is not None:
+        q = q.where(booking_span.c.venue_lo <= venue_id, booking_span.c.venue_hi >= venue_id)
+    return q
+
+
+def conflict_query(start, end, exclude_id=None, venue_id=None):
+    """Query for bookings whose interval -- or, for a recurring booking, whose
+    series -- intersects ``[start, end)``."""
+    q = Booking.query
+    if uses_span_index():
+        # The tree already narrows to the venue; an extra venue_id filter
+        # would tempt SQLite into the B-tree index instead of the rowid lookup.
+        q = q.filter(Booking.id.in_(span_ids(start, end, venue_id)))
+    elif venue_id is not None:
+        q = q.filter(Booking.venue_id == venue_id)
+    q = q.filter(or_(Booking.end_at > start, Booking.series_end_at > start), Booking.start_at < end)
+    if exclude_id is not None:
+        q = q.filter(Booking.id != exclude_id)
+    return q
+
+
+def bookings_in(start, end, exclude_id=None, venue_id=None):
+    """Bookings and series occurrences intersecting ``[start, end)``, earliest first."""
+    return expand(conflict_query(start, end, exclude_id, venue_id).order_by(Booking.start_at, Booking.id).all(),
+                  start, end)
+
+
+def find_conflicts(start, end, exclude_id=None, venue_id=None):
+    """Return every booking (or occurrence) overlapping ``[start, end)``, earliest first."""
+    with db.session.no_autoflush:
+        return bookings_in(start, end, exclude_id, venue_id)
+
+
+def has_conflict(start, end, exclude_id=None, venue_id=None):
+    return bool(find_conflicts(start, end, exclude_id, venue_id))
+
+
+def conflicts_for(from_date, from_time, to_date, to_time, exclude_id=None, venue_id=None):
+    """Convenience wrapper taking the raw form fields."""
+    start, end = booking_interval(from_date, from_time, to_date, to_time)
+    return find_conflicts(start, end, exclude_id, venue_id)
+
+
+def describe_conflicts(conflicts, limit=3):
+    """Short human-readable summary for flash messages."""
+    parts = [f"{c.name} ({c.from_date} {c.from_time} – {c.to_date} {c.to_time})" for c in conflicts[:limit]]
+    if len(conflicts) > limit:
+        parts.append(f"and {len(conflicts) - limit} more")
+    return ", ".join(parts)
+
+
+def existing_intervals(start, end, exclude_ids=(), venue_id=None):
+    """(start_at, end_at, id) of bookings and occurrences intersecting
+    [start, end), from one indexed query."""
+    q = conflict_query(start, end, venue_id=venue_id).with_entities(*(getattr(Booking, f) for f in RULE_FIELDS))
+    if exclude_ids:
+        q = q.filter(Booking.id.notin_(list(exclude_ids)))
+    return expand_intervals(q.all(), start, end)
+
+
+def series_conflicts(intervals, exclude_id=None, extra=(), venue_id=None):
+    """Check every occurrence of a new or edited series in one pass.
+
+    ``intervals`` is the series' ``(start, end)`` list, earliest first.  The
+    bookings in its overall range are fetched once and swept against all of
+    them together with ``extra`` ``(start, end, ident)`` intervals (holds).
+    Returns ``{occurrence start: ident}``, where ident is a booking id, an
+    ``extra`` ident, or ``('row', start)`` for an occurrence overlapping an
+    earlier one of the same series.
+    """
+    if not intervals:
+        return {}
+    with db.session.no_autoflush:
+        existing = existing_intervals(intervals[0][0], max(e for _, e in intervals),
+                                      [exclude_id] if exclude_id is not None else (), venue_id)
+    hits = sweep_conflicts([(s, e, s) for s, e in intervals], existing + list(extra))
+    return {key: ident if kind == 'booking' else ('row', ident) for key, (kind, ident) in hits.items()}
+
+
+def sweep_conflicts(candidates, existing):
+    """Check a batch of new intervals against existing ones and each other.
+
+    ``candidates`` is a list of ``(start, end, key)``; ``existing`` an iterable
+    of ``(start, end, booking_id)``.  Returns ``{key: ('booking', id)}`` for
+    candidates hitting an existing booking and ``{key: ('row', other_key)}``
+    for candidates overlapping an earlier-starting accepted candidate.
+
+    Sort-based, O((n + m) log m): existing intervals are sorted by start with
+    a running maximum end, so "does anything starting before my end finish
+    after my start?" is one bisect; the accepted candidates are then swept in
+    start order keeping the furthest end seen.
+    """
+    existing = sorted(existing, key=lambda e: (e[0], e[1]))
+    starts = [e[0] for e in existing]
+    prefix = []
+    best = None
+    for s, e, ident in existing:
+        if best is None or e > best[0]:
+            best = (e, ident)
+        prefix.append(best)
+
+    rejected = {}
+    for s, e, key in candidates:
+        k = bisect_left(starts, e)
+        if k and prefix[k - 1][0] > s:
+            rejected[key] = ('booking', prefix[k - 1][1])
+
+    remaining = [(s, e, i, key) for i, (s, e, key) in enumerate(candidates) if key not in rejected]
+    remaining.sort(key=lambda c: (c[0], c[2]))
+    max_end = owner = None
+    for s, e, _, key in remaining:
+        if max_end is not None and s < max_end:
+            rejected[key] = ('row', owner)
+            continue
+        max_end, owner = e, key
+    return rejected
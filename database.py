@@ -0,0 +1,87 @@
+"""Database engine setup.
+
+For SQLite (the production setup under gunicorn) every connection is put in
+WAL mode with ``synchronous=NORMAL`` and a busy timeout, the file-backed pool
+is sized from config, and transactions are begun explicitly so that booking
+writes can use ``BEGIN IMMEDIATE``: the write lock is taken before the
+conflict check runs, so check-and-insert is atomic across workers.
+
+Config (environment variables of the same name override the defaults):
+
+    SQLITE_JOURNAL_MODE   WAL
+    SQLITE_SYNCHRONOUS    NORMAL
+    SQLITE_BUSY_TIMEOUT   busy timeout in seconds (default 15)
+    DB_POOL_SIZE          5
+    DB_MAX_OVERFLOW       10
+    DB_POOL_TIMEOUT       30
+"""
+import os
+
+from sqlalchemy import event
+
+from models import db, IMMEDIATE
+
+DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT': 15,
+    'DB_POOL_SIZE': 5,
+    'DB_MAX_OVERFLOW': 10,
+    'DB_POOL_TIMEOUT': 30,
+}
+
+def configure_database(app):
+    """Apply engine options and initialise ``db`` for ``app``."""
+    for key, default in DEFAULTS.items():
+        value = os.environ.get(key, app.config.get(key, default))
+        app.config[key] = type(default)(value)
+
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    is_sqlite = uri.startswith('sqlite')
+    if is_sqlite:
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        connect_args = options.setdefault('connect_args', {})
+        connect_args.setdefault('timeout', app.config['SQLITE_BUSY_TIMEOUT'])
+        connect_args.setdefault('check_same_thread', False)
+        if ':memory:' not in uri and uri not in ('sqlite://', 'sqlite:///'):
+            options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+            options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+            options.setdefault('pool_timeout', app.config['DB_POOL_TIMEOUT'])
+
+    db.init_app(app)
+
+    if is_sqlite:
+        with app.app_context():
+            engine = db.engine
+        journal = app.config['SQLITE_JOURNAL_MODE']
+        synchronous = app.config['SQLITE_SYNCHRONOUS']
+        busy_ms = int(app.config['SQLITE_BUSY_TIMEOUT'] * 1000)
+
+        @event.listens_for(engine, 'connect')
+        def _sqlite_connect(dbapi_conn, record):
+            # Let SQLAlchemy emit BEGIN itself (see _sqlite_begin); pysqlite's
+            # implicit transactions cannot do BEGIN IMMEDIATE.
+            dbapi_conn.isolation_level = None
+            cur = dbapi_conn.cursor()
+            cur.execute(f'PRAGMA journal_mode={journal}')
+            cur.execute(f'PRAGMA synchronous={synchronous}')
+            cur.execute(f'PRAGMA busy_timeout={busy_ms}')
+            cur.close()
+
+        @event.listens_for(engine, 'begin')
+        def _sqlite_begin(conn):
+            conn.exec_driver_sql('BEGIN IMMEDIATE' if conn.get_execution_options().get(IMMEDIATE) else 'BEGIN')
+
+
+def begin_write():
+    """Start the session's transaction with the database write lock held.
+
+    Call at the top of a request's write path, before loading anything that
+    will be checked and changed: an open read transaction is discarded (loaded
+    objects are expired and reload under the new transaction), then the next
+    transaction begins IMMEDIATE on SQLite so no other worker can commit an
+    overlapping booking between our conflict check and our commit.
+    """
+    if db.session().in_transaction():
+        db.session.rollback()
+    db.session.connection(execution_options={IMMEDIATE: True})
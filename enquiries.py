@@ -0,0 +1,317 @@
+"""Public enquiry intake.
+
+The public form has to stay fast through traffic spikes, so submitting never
+touches the database.  Each worker appends the enquiry as one JSON line to
+its own spool segment (``active-<pid>.jsonl`` in ``ENQUIRY_SPOOL_DIR``) and
+answers once the line is on disk.  One background thread does the fsyncs:
+lines written while an fsync runs are all covered by the next one, so a
+burst of submissions shares a few fsyncs instead of paying for one each.
+
+Every ``ENQUIRY_INGEST_INTERVAL`` seconds the worker closes its segment as
+``ready-<pid>-<n>.jsonl`` and an ingester thread claims ready segments (any
+worker's) by renaming them, bulk-inserts their lines into ``enquiry`` in one
+transaction and deletes them.  Lines carry a uid and uids already stored are
+skipped, so a segment ingested twice after a crash does no harm; segments
+left behind by a worker that died are picked up by the others.
+
+Repeats of a phone number for the same date (the preferred date, or the day
+sent when none was given) are folded into the first enquiry -- see
+``models.Enquiry`` -- and the staff list shows one row per lead.
+
+Config:
+
+    ENQUIRY_SPOOL_DIR         spool directory (default <instance>/enquiry_spool)
+    ENQUIRY_FSYNC_DELAY       extra seconds to gather a batch before each fsync (default 0)
+    ENQUIRY_INGEST_INTERVAL   seconds between ingests (default 5)
+"""
+import atexit
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import date, datetime
+
+from sqlalchemy import and_, bindparam, case, or_, select
+
+from metrics import ENQUIRY_FSYNC_BATCH, ENQUIRY_INGESTED, ENQUIRY_SPOOLED, pid
+from models import db, Enquiry, write_transaction
+from search import decode_cursor, encode_cursor
+
+PAGE_SIZE = 50
+SYNC_TIMEOUT = 10
+
+# Segments a dead worker can leave behind: its open one, or one it was ingesting.
+_ORPHAN = re.compile(r'^(active|ingest)-(\d+)(?:\.jsonl|-(ready-[\d-]+\.jsonl))$')
+
+
+def normalize_phone(phone):
+    return re.sub(r'\D', '', phone or '')
+
+
+def _alive(process_id):
+    try:
+        os.kill(process_id, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_segment(path):
+    with open(path, encoding='utf-8') as fh:
+        for line in fh:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # torn last line of a crashed worker; it was never acknowledged
+
+
+class EnquirySpool:
+    def __init__(self):
+        self.app = None
+        self.path = None
+        self.fsync_delay = 0
+        self.ingest_interval = 5.0
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()  # held across an fsync or a rotation
+        self._file = None
+        self._written = 0  # lines appended by this process
+        self._synced = 0  # of which known to be on disk
+        self._threads = []
+        self._stopping = False
+
+    def init_app(self, app):
+        self.app = app
+        self.path = app.config.setdefault('ENQUIRY_SPOOL_DIR', os.path.join(app.instance_path, 'enquiry_spool'))
+        self.fsync_delay = app.config.setdefault('ENQUIRY_FSYNC_DELAY', 0)
+        self.ingest_interval = app.config.setdefault('ENQUIRY_INGEST_INTERVAL', 5.0)
+        atexit.register(self.close)
+
+    # ---------- submitting ----------
+    def submit(self, name, phone, message='', preferred_date=None):
+        """Append an enquiry to the spool; returns its uid once it is durable."""
+        record = {'uid': uuid.uuid4().hex, 'name': name, 'phone': normalize_phone(phone), 'message': message,
+                  'preferred_date': preferred_date.isoformat() if preferred_date else None,
+                  'submitted_at': datetime.utcnow().isoformat()}
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._cond:
+            if self._file is None:
+                os.makedirs(self.path, exist_ok=True)
+                self._file = open(os.path.join(self.path, f'active-{os.getpid()}.jsonl'), 'a', encoding='utf-8')
+            self._file.write(line)
+            self._written += 1
+            mine = self._written
+            self._ensure_threads()
+            self._cond.notify_all()
+            if not self._cond.wait_for(lambda: self._synced >= mine, timeout=SYNC_TIMEOUT):
+                raise OSError("enquiry spool is not being synced")
+        ENQUIRY_SPOOLED.inc(pid=pid())
+        return record['uid']
+
+    def _sync(self):
+        """fsync everything written so far (caller holds ``_io_lock``)."""
+        with self._cond:
+            if self._file is None or self._synced >= self._written:
+                return
+            self._file.flush()
+            target, fh = self._written, self._file
+        os.fsync(fh.fileno())  # appends carry on meanwhile; the next fsync covers them
+        with self._cond:
+            ENQUIRY_FSYNC_BATCH.observe(target - self._synced, pid=pid())
+            self._synced = target
+            self._cond.notify_all()
+
+    def rotate(self):
+        """Close this worker's segment as ready for ingesting; False if it was empty."""
+        with self._io_lock, self._cond:
+            fh = self._file
+            if fh is None:
+                return False
+            fh.flush()
+            os.fsync(fh.fileno())
+            self._synced = self._written
+            self._cond.notify_all()
+            if not os.fstat(fh.fileno()).st_size:
+                return False
+            fh.close()
+            self._file = None
+            os.replace(fh.name, os.path.join(self.path, f'ready-{os.getpid()}-{time.time_ns()}.jsonl'))
+        return True
+
+    # ---------- ingesting ----------
+    def ingest(self):
+        """Insert every ready segment (and any a dead worker left); returns the rows added."""
+        if not os.path.isdir(self.path):
+            return 0
+        self._adopt_orphans()
+        added = 0
+        for name in sorted(os.listdir(self.path)):
+            if not name.startswith('ready-'):
+                continue
+            path = os.path.join(self.path, name)
+            claimed = os.path.join(self.path, f'ingest-{os.getpid()}-{name}')
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue  # another worker got it first
+            try:
+                with self.app.app_context():
+                    added += store_enquiries(list(_read_segment(claimed)))
+            except Exception:
+                os.rename(claimed, path)
+                raise
+            os.remove(claimed)
+        if added:
+            ENQUIRY_INGESTED.inc(added, pid=pid())
+        return added
+
+    def drain(self):
+        """Rotate this worker's segment and ingest everything ready."""
+        self.rotate()
+        return self.ingest()
+
+    def _adopt_orphans(self):
+        for name in os.listdir(self.path):
+            m = _ORPHAN.match(name)
+            if not m or _alive(int(m.group(2))):
+                continue
+            target = m.group(3) or f'ready-{m.group(2)}-{time.time_ns()}.jsonl'
+            try:
+                os.rename(os.path.join(self.path, name), os.path.join(self.path, target))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """Stop the background threads, leaving nothing unsynced or unrotated."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        if self._file is not None:
+            self.rotate()
+
+    # ---------- background threads ----------
+    def _ensure_threads(self):
+        if not self._threads or not all(t.is_alive() for t in self._threads):
+            self._stopping = False
+            self._threads = [threading.Thread(target=target, name=name, daemon=True)
+                             for target, name in ((self._run_sync, 'enquiry-sync'),
+                                                  (self._run_ingest, 'enquiry-ingest'))]
+            for thread in self._threads:
+                thread.start()
+
+    def _run_sync(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopping or self._synced < self._written)
+                stopping = self._stopping
+            if self.fsync_delay and not stopping:
+                time.sleep(self.fsync_delay)
+            try:
+                with self._io_lock:
+                    self._sync()
+            except Exception:
+                self.app.logger.exception("Enquiry spool fsync failed")
+                time.sleep(0.1)
+            if stopping:
+                return
+
+    def _run_ingest(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stopping, timeout=self.ingest_interval)
+                stopping = self._stopping
+            try:
+                self.drain()
+            except Exception:
+                self.app.logger.exception("Enquiry ingest failed")
+            if stopping:
+                return
+
+
+enquiry_spool = EnquirySpool()
+
+
+def store_enquiries(records):
+    """Bulk-insert spooled records in one transaction, skipping uids already
+    stored and folding repeats of a (phone, date) into the first enquiry."""
+    if not records:
+        return 0
+    table = Enquiry.__table__
+    now = datetime.utcnow()
+    with write_transaction(db.engine) as conn:
+        seen = set(conn.execute(select(table.c.uid).where(table.c.uid.in_([r['uid'] for r in records]))).scalars())
+        rows = []
+        for r in sorted(records, key=lambda r: r['submitted_at']):
+            if r['uid'] in seen:
+                continue
+            seen.add(r['uid'])
+            submitted = datetime.fromisoformat(r['submitted_at'])
+            preferred = date.fromisoformat(r['preferred_date']) if r.get('preferred_date') else None
+            rows.append({'uid': r['uid'], 'name': r['name'], 'phone': r['phone'], 'message': r.get('message'),
+                         'preferred_date': preferred, 'dedup_date': preferred or submitted.date(),
+                         'submitted_at': submitted, 'ingested_at': now, 'duplicate_of': None,
+                         'repeats': 0, 'last_submitted_at': submitted})
+        if not rows:
+            return 0
+
+        key = lambda r: (r['phone'], r['dedup_date'])  # noqa: E731
+        originals = {}
+        for ident, phone, day in conn.execute(
+                select(table.c.id, table.c.phone, table.c.dedup_date)
+                .where(table.c.duplicate_of.is_(None), table.c.phone.in_({r['phone'] for r in rows}),
+                       table.c.dedup_date.in_({r['dedup_date'] for r in rows}))
+                .order_by(table.c.id)):
+            originals.setdefault((phone, day), ident)
+        firsts, repeats = {}, []
+        for r in rows:
+            if key(r) in originals or key(r) in firsts:
+                repeats.append(r)
+            else:
+                firsts[key(r)] = r
+
+        if firsts:
+            conn.execute(table.insert(), list(firsts.values()))
+            by_uid = {r['uid']: k for k, r in firsts.items()}
+            for ident, uid in conn.execute(select(table.c.id, table.c.uid).where(table.c.uid.in_(list(by_uid)))):
+                originals[by_uid[uid]] = ident
+        if repeats:
+            for r in repeats:
+                r['duplicate_of'] = originals[key(r)]
+            conn.execute(table.insert(), repeats)
+            counts = {}
+            for r in repeats:
+                n, last = counts.get(r['duplicate_of'], (0, r['submitted_at']))
+                counts[r['duplicate_of']] = (n + 1, max(last, r['submitted_at']))
+            conn.execute(
+                table.update().where(table.c.id == bindparam('oid')).values(
+                    repeats=table.c.repeats + bindparam('n'),
+                    last_submitted_at=case((table.c.last_submitted_at < bindparam('last'), bindparam('last')),
+                                           else_=table.c.last_submitted_at)),
+                [{'oid': oid, 'n': n, 'last': last} for oid, (n, last) in counts.items()])
+    return len(rows)
+
+
+def enquiry_page(args, page_size=PAGE_SIZE):
+    """Newest-first page of enquiries and the cursor for the next one.
+
+    Repeats are folded into their first enquiry unless ?all=1; ?phone=
+    narrows to one number.
+    """
+    qs = Enquiry.query
+    if not args.get('all'):
+        qs = qs.filter(Enquiry.duplicate_of.is_(None))
+    phone = normalize_phone(args.get('phone'))
+    if phone:
+        qs = qs.filter(Enquiry.phone == phone)
+    after = decode_cursor(args['cursor']) if args.get('cursor') else None
+    if after:
+        ts, ident = after
+        qs = qs.filter(or_(Enquiry.submitted_at < ts, and_(Enquiry.submitted_at == ts, Enquiry.id < ident)))
+    rows = qs.order_by(Enquiry.submitted_at.desc(), Enquiry.id.desc()).limit(page_size + 1).all()
+    next_cursor = encode_cursor(rows[page_size - 1].submitted_at, rows[page_size - 1].id) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
@@ -0,0 +1,257 @@
+"""Bulk exports streamed straight to the client.
+
+Booking listings (CSV or XLSX) are generated row by row from a cursor read
+with ``yield_per``, so neither the ORM identity map nor the response body ever
+holds the whole table.  The XLSX writer emits a minimal SpreadsheetML package
+through the same unseekable ZIP sink, with inline strings so no shared-string
+table has to be built up front.
+
+The receipts archive is produced by a generator: bookings are read in
+batches, rendered by a process pool with a bounded number of receipts in
+flight, and each file is appended to a ZIP written to an unseekable sink that
+is drained after every entry.  Worker memory therefore stays flat however
+many invoices are exported.
+
+Any of these can also be built by a background job into a file the user
+downloads when it is ready (``export_job``), which keeps long exports off
+the web workers altogether.
+"""
+import csv
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from types import SimpleNamespace
+from xml.sax.saxutils import escape
+
+from flask import current_app
+
+import receipts
+from jobs import PermanentJobError, task
+from models import Booking, Venue
+from search import filter_bookings
+from venues import find_venue
+
+BOOKING_COLUMNS = ('id', 'name', 'phone', 'email', 'details', 'from_date', 'from_time', 'to_date', 'to_time',
+                   'total_amount', 'advance', 'balance', 'created_at', 'venue')
+
+RECEIPT_FIELDS = ('id', 'name', 'phone', 'email', 'from_date', 'from_time', 'to_date', 'to_time',
+                  'total_amount', 'advance', 'balance', 'venue_name', 'venue_address', 'venue_contact')
+
+
+class _StreamSink:
+    """Write-only file object for ZipFile; ``drain`` hands back what was written."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def snapshot(b):
+    """Picklable copy of the fields a receipt prints."""
+    return SimpleNamespace(**{f: getattr(b, f) for f in RECEIPT_FIELDS})
+
+
+def _pool_init(fonts_dir):
+    receipts.register_fonts(fonts_dir)
+
+
+def _pool_render(snap, today_str):
+    return receipts.render_receipt(snap, today_str)
+
+
+def stream_receipts_zip(query, fonts_dir, today_str, workers=None, statement=False, batch_size=200,
+                        statement_title="Statement"):
+    """Yield the bytes of a ZIP holding one receipt PDF per booking in ``query``.
+
+    With ``statement`` a single ``statement.pdf`` (summary listing plus every
+    receipt) is appended; it is spooled to a temporary file, not memory.
+    """
+    workers = workers or os.cpu_count() or 2
+    window = workers * 4
+    sink = _StreamSink()
+    ordered = query.order_by(Booking.start_at, Booking.id)
+
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_pool_init, initargs=(fonts_dir,)) as pool, \
+            zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        pending = deque()
+
+        def emit():
+            name, job = pending.popleft()
+            if isinstance(job, str):
+                zf.write(job, name)
+            else:
+                zf.writestr(name, job.result())
+            return sink.drain()
+
+        for b in ordered.yield_per(batch_size):
+            name = f"KAV_{receipts.invoice_number(b)}.pdf"
+            cached = receipts.cached_receipt(b, today_str)
+            pending.append((name, cached or pool.submit(_pool_render, snapshot(b), today_str)))
+            if len(pending) >= window:
+                yield emit()
+        while pending:
+            yield emit()
+
+        if statement:
+            with tempfile.TemporaryFile() as tmp:
+                receipts.render_statement(tmp, (snapshot(b) for b in ordered.yield_per(batch_size)),
+                                          (snapshot(b) for b in ordered.yield_per(batch_size)), today_str,
+                                          statement_title)
+                tmp.seek(0)
+                with zf.open('statement.pdf', 'w') as dest:
+                    while True:
+                        chunk = tmp.read(64 * 1024)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        yield sink.drain()
+    yield sink.drain()
+
+
+# ---------- Booking listings ----------
+def iter_booking_rows(query, batch_size=1000):
+    """Yield plain column tuples for ``query`` in (start_at, id) order."""
+    columns = [getattr(Booking, c) for c in BOOKING_COLUMNS if c != 'venue'] + [Venue.slug]
+    ordered = query.outerjoin(Booking.venue).with_entities(*columns).order_by(Booking.start_at, Booking.id)
+    yield from ordered.yield_per(batch_size)
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    return str(value)
+
+
+def stream_bookings_csv(query, batch_size=1000):
+    """Yield a CSV document (header first) in chunks of ``batch_size`` rows."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(BOOKING_COLUMNS)
+    for i, row in enumerate(iter_booking_rows(query, batch_size), 1):
+        writer.writerow([_text(v) for v in row])
+        if i % batch_size == 0:
+            yield buf.getvalue().encode()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode()
+
+
+_XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Bookings" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>',
+}
+
+# Characters XML 1.0 does not allow, even escaped.
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value!r}</v></c>'
+    text = escape(_XML_INVALID.sub('', _text(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(v) for v in values) + '</row>'
+
+
+def stream_bookings_xlsx(query, batch_size=1000):
+    """Yield an XLSX workbook with one "Bookings" sheet, header row first."""
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in _XLSX_PARTS.items():
+            zf.writestr(name, xml)
+        yield sink.drain()
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_xlsx_row(BOOKING_COLUMNS).encode())
+            chunk = []
+            for row in iter_booking_rows(query, batch_size):
+                chunk.append(_xlsx_row(row))
+                if len(chunk) >= batch_size:
+                    sheet.write(''.join(chunk).encode())
+                    chunk = []
+                    yield sink.drain()
+            sheet.write(''.join(chunk).encode() + b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+def statement_title(filters):
+    """Heading of a statement: the venue it was filtered to, or all of them."""
+    venue = find_venue(filters.get('venue'))
+    return f"{venue.name} — Statement" if venue else "All venues — Statement"
+
+
+# ---------- Background exports ----------
+@task('export', max_attempts=2)
+def export_job(job, fmt, filters, filename):
+    """Write an export to a job result file instead of streaming it to the
+    request that asked for it (``?background=1`` on the export routes)."""
+    query = filter_bookings(filters)
+    if fmt == 'receipts.zip':
+        app = current_app
+        stream = stream_receipts_zip(query, os.path.join(app.root_path, 'static', 'fonts'),
+                                     datetime.today().strftime("%d-%m-%Y"),
+                                     workers=app.config.get('RECEIPT_EXPORT_WORKERS'),
+                                     statement=filters.get('statement') == '1',
+                                     statement_title=statement_title(filters))
+    elif fmt == 'csv':
+        stream = stream_bookings_csv(query)
+    elif fmt == 'xlsx':
+        stream = stream_bookings_xlsx(query)
+    else:
+        raise PermanentJobError(f"Unsupported export format {fmt!r}")
+    path = job.path_for(filename)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as fh:
+        for chunk in stream:
+            fh.write(chunk)
+    os.replace(tmp, path)
+    return {'file': filename, 'bytes': os.path.getsize(path)}
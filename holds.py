@@ -0,0 +1,105 @@
+"""Tentative slot holds.
+
+When staff start filling in the booking form, the page asks for a hold on
+the chosen range.  A hold lives in the ``slot_hold`` table for
+``SLOT_HOLD_TTL`` seconds (renewed while the form is being edited) and is
+part of every booking conflict check, so a colleague is told about the
+clash straight away instead of at submit.  Submitting the form consumes the
+hold in the same transaction that inserts the booking.  Holds, like
+bookings, only clash within their venue.
+
+Expiry is lazy: every lookup filters on ``expires_at``, and expired rows
+are deleted the next time a hold is placed, under the write lock that
+placing takes anyway.
+"""
+import secrets
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete
+
+from conflicts import describe_conflicts, find_conflicts
+from database import begin_write
+from models import db, SlotHold
+
+
+def init_app(app):
+    app.config.setdefault('SLOT_HOLD_TTL', 600)
+
+
+def active_holds_query(start, end, exclude_token=None, now=None, venue_id=None, user=None):
+    """Unexpired holds intersecting ``[start, end)`` (in one venue), except
+    ``user``'s own hold ``exclude_token`` -- a token alone excludes nothing,
+    so nobody can book through someone else's hold by sending its token."""
+    q = SlotHold.query
+    if venue_id is not None:
+        q = q.filter(SlotHold.venue_id == venue_id)
+    q = q.filter(SlotHold.expires_at > (now or datetime.utcnow()), SlotHold.end_at > start, SlotHold.start_at < end)
+    if exclude_token and user:
+        q = q.filter((SlotHold.token != exclude_token) | (SlotHold.user != user))
+    return q
+
+
+def conflicting_holds(start, end, exclude_token=None, venue_id=None, user=None):
+    """Live holds overlapping ``[start, end)`` other than ``user``'s own
+    ``exclude_token``, earliest first."""
+    with db.session.no_autoflush:
+        return active_holds_query(start, end, exclude_token, venue_id=venue_id, user=user) \
+            .order_by(SlotHold.start_at, SlotHold.id).all()
+
+
+def describe_holds(holds, limit=3):
+    """Short human-readable summary for flash messages."""
+    now = datetime.utcnow()
+    parts = [f"held by {h.user} for {max(1, round((h.expires_at - now).total_seconds() / 60))} more min "
+             f"({h.start_at:%Y-%m-%d %I:%M %p} – {h.end_at:%Y-%m-%d %I:%M %p})" for h in holds[:limit]]
+    if len(holds) > limit:
+        parts.append(f"and {len(holds) - limit} more")
+    return ", ".join(parts)
+
+
+def purge_expired(now=None):
+    db.session.execute(delete(SlotHold).where(SlotHold.expires_at <= (now or datetime.utcnow())))
+
+
+def place_hold(start, end, user, venue_id, token=None, exclude_booking_id=None):
+    """Hold ``[start, end)`` in a venue for ``user``, or move and renew their hold ``token``.
+
+    Returns ``(hold, None)``, or ``(None, reason)`` when the range clashes
+    with a booking (other than ``exclude_booking_id``) or someone else's hold.
+    """
+    begin_write()
+    now = datetime.utcnow()
+    purge_expired(now)
+    bookings = find_conflicts(start, end, exclude_id=exclude_booking_id, venue_id=venue_id)
+    if bookings:
+        db.session.rollback()
+        return None, f"overlaps {describe_conflicts(bookings)}"
+    others = conflicting_holds(start, end, exclude_token=token, venue_id=venue_id, user=user)
+    if others:
+        db.session.rollback()
+        return None, f"is {describe_holds(others)}"
+
+    hold = SlotHold.query.filter_by(token=token, user=user).first() if token else None
+    if hold is None:
+        hold = SlotHold(token=secrets.token_urlsafe(16), user=user, created_at=now)
+        db.session.add(hold)
+    hold.venue_id, hold.start_at, hold.end_at = venue_id, start, end
+    hold.expires_at = now + timedelta(seconds=current_app.config['SLOT_HOLD_TTL'])
+    db.session.commit()
+    return hold, None
+
+
+def consume_hold(token, user):
+    """Drop ``user``'s hold ``token`` in the current transaction (the caller
+    commits it together with the booking that replaces it)."""
+    if token:
+        hold = SlotHold.query.filter_by(token=token, user=user).first()
+        if hold is not None:
+            db.session.delete(hold)
+
+
+def release_hold(token, user):
+    begin_write()
+    consume_hold(token, user)
+    db.session.commit()
@@ -0,0 +1,226 @@
+"""HTTP caching for public pages and JSON APIs.
+
+A single ``data_version`` row is bumped in the same transaction as every
+booking write, so all workers agree on it.  Views wrapped in ``cached_view``
+get a weak ETag built from that version (plus a build id covering the
+templates and the visitor's variant), answer ``If-None-Match`` with 304
+without running the view, and -- for anonymous visitors -- keep the rendered
+response in an in-process LRU cache that is valid only while the version is
+unchanged.  A write in any worker therefore invalidates every worker's cache
+on its next lookup.
+
+HTML, JSON and other text responses are compressed with brotli (when the
+``brotli`` package is installed) or gzip.  Cached entries keep their
+compressed bodies, so a cache hit costs one version lookup and no work.
+
+Config:
+
+    HTTP_CACHE_MAX_ENTRIES   responses kept per worker (default 256; 0 disables)
+    COMPRESS_MIN_SIZE        smallest body worth compressing (default 500 bytes)
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from metrics import HTTP_CACHE, pid
+from models import db, Booking, BookingException, DataVersion, Venue
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE = {'text/html', 'text/plain', 'text/css', 'text/csv', 'application/json',
+                'application/javascript', 'text/javascript', 'image/svg+xml'}
+
+_build_id = ''
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+# ---------- Data version ----------
+def data_version():
+    table = DataVersion.__table__
+    return db.session.execute(select(table.c.version).where(table.c.id == 1)).scalar() or 0
+
+
+def ensure_data_version():
+    """Create the counter row (at boot, so writers only ever UPDATE it)."""
+    if db.session.get(DataVersion, 1) is None:
+        db.session.add(DataVersion(id=1, version=0))
+
+
+def bump_data_version(conn):
+    """Advance the version inside the caller's transaction on ``conn``."""
+    table = DataVersion.__table__
+    result = conn.execute(table.update().where(table.c.id == 1).values(version=table.c.version + 1))
+    if not result.rowcount:
+        conn.execute(table.insert().values(id=1, version=1))
+
+
+@event.listens_for(Session, 'before_flush')
+def _note_booking_writes(session, flush_context, instances):
+    kinds = (Booking, BookingException, Venue)
+    if any(isinstance(obj, kinds) for obj in session.new) \
+            or any(isinstance(obj, kinds) for obj in session.deleted) \
+            or any(isinstance(obj, kinds) and session.is_modified(obj) for obj in session.dirty):
+        session.info['bump_data_version'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_on_booking_writes(session, flush_context):
+    if session.info.pop('bump_data_version', False):
+        bump_data_version(session.connection())
+
+
+# ---------- Compression ----------
+def negotiate_encoding():
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_response(response):
+    """after_request hook: compress eligible bodies for the negotiated encoding."""
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed \
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = negotiate_encoding()
+    if encoding:
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+# ---------- Response cache ----------
+class _Entry:
+    def __init__(self, version, response):
+        self.version = version
+        self.status = response.status_code
+        self.mimetype = response.mimetype
+        self.content_type = response.content_type
+        self.body = response.get_data()
+        self.encoded = {}
+
+    def body_for(self, encoding):
+        if not encoding or len(self.body) < current_app.config['COMPRESS_MIN_SIZE'] \
+                or self.mimetype not in COMPRESSIBLE:
+            return self.body, None
+        if encoding not in self.encoded:
+            self.encoded[encoding] = compress(self.body, encoding)
+        return self.encoded[encoding], encoding
+
+    def response(self):
+        body, encoding = self.body_for(negotiate_encoding())
+        resp = make_response(body, self.status)
+        resp.content_type = self.content_type
+        resp.vary.add('Accept-Encoding')
+        if encoding:
+            resp.headers['Content-Encoding'] = encoding
+        return resp
+
+
+def _lookup(key, version):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry.version != version:
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return entry
+
+
+def _store(key, entry):
+    limit = current_app.config['HTTP_CACHE_MAX_ENTRIES']
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > limit:
+            _entries.popitem(last=False)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def cached_view(view):
+    """Version-keyed ETag, 304s and (for anonymous visitors) a rendered-response cache."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Flash messages are one-shot; never cache around them.
+        if request.method != 'GET' or '_flashes' in session:
+            HTTP_CACHE.inc(endpoint=request.endpoint, result='bypass', pid=pid())
+            return view(*args, **kwargs)
+
+        anonymous = 'user' not in session
+        variant = 'anon' if anonymous else f"user:{session['user']}"
+        version = data_version()
+        tag = hashlib.sha1(f"{_build_id}|{version}|{variant}|{request.full_path}".encode()).hexdigest()[:20]
+        if request.if_none_match.contains_weak(tag):
+            HTTP_CACHE.inc(endpoint=request.endpoint, result='not_modified', pid=pid())
+            resp = make_response('', 304)
+        else:
+            key = request.full_path
+            entry = _lookup(key, version) if anonymous and current_app.config['HTTP_CACHE_MAX_ENTRIES'] else None
+            if entry is not None:
+                HTTP_CACHE.inc(endpoint=request.endpoint, result='hit', pid=pid())
+                resp = entry.response()
+            else:
+                HTTP_CACHE.inc(endpoint=request.endpoint, result='miss', pid=pid())
+                resp = make_response(view(*args, **kwargs))
+                if anonymous and resp.status_code == 200 and not resp.is_streamed \
+                        and current_app.config['HTTP_CACHE_MAX_ENTRIES']:
+                    entry = _Entry(version, resp)
+                    _store(key, entry)
+                    resp = entry.response()
+        resp.set_etag(tag, weak=True)
+        resp.vary.add('Cookie')
+        resp.cache_control.no_cache = True
+        if anonymous:
+            resp.cache_control.public = True
+        else:
+            resp.cache_control.private = True
+        return resp
+    return wrapper
+
+
+def _template_build_id(app):
+    """Changes whenever a template or the built asset manifest changes, so
+    deploys invalidate client ETags."""
+    digest = hashlib.sha1()
+    paths = []
+    for root, _, files in sorted(os.walk(os.path.join(app.root_path, app.template_folder or 'templates'))):
+        paths.extend(os.path.join(root, name) for name in sorted(files))
+    paths.append(os.path.join(app.static_folder, 'dist', 'manifest.json'))
+    for path in paths:
+        if os.path.exists(path):
+            st = os.stat(path)
+            digest.update(f"{os.path.basename(path)}:{st.st_mtime_ns}:{st.st_size}".encode())
+    return digest.hexdigest()[:8]
+
+
+def init_app(app):
+    global _build_id
+    app.config.setdefault('HTTP_CACHE_MAX_ENTRIES', int(os.environ.get('HTTP_CACHE_MAX_ENTRIES', 256)))
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    _build_id = _template_build_id(app)
+    app.after_request(compress_response)
@@ -0,0 +1,260 @@
+"""Bulk booking import from CSV (or XLSX when openpyxl is installed).
+
+The file is read twice, a chunk at a time, so it never has to fit in memory:
+
+1. every row is parsed and field-checked, and only its interval and line
+   number are kept; all intervals are then validated against the existing
+   bookings (one indexed range query) and against each other with a single
+   sort-based sweep (``conflicts.sweep_conflicts``);
+2. the rows that passed are inserted in batches, one write transaction per
+   batch.  Each batch is re-swept against the database under the write lock,
+   so a booking made through the UI during the import still wins.
+
+An optional ``venue`` column (slug, name or id) says which hall a row books;
+rows without one go to the default venue.  Rows only clash with bookings and
+rows of their own venue, so both sweeps run once per venue.
+
+Bad rows are collected with their line number and reason instead of aborting
+the import.
+"""
+import csv
+import os
+from datetime import date, datetime, time
+from collections import defaultdict
+from itertools import islice
+from types import SimpleNamespace
+
+from changefeed import record_reset
+from conflicts import existing_intervals, sweep_conflicts
+from database import begin_write
+from httpcache import bump_data_version
+from models import db, Booking, TIME_FORMAT, Venue, booking_interval
+from occupancy import days_changed, span_days
+
+try:
+    from openpyxl import load_workbook
+except ImportError:  # XLSX import is optional
+    load_workbook = None
+
+DEFAULT_EMAIL = "not_provided@noemail.com"
+TIME_INPUT_FORMATS = (TIME_FORMAT, '%I:%M%p', '%H:%M', '%H:%M:%S')
+
+
+# ---------- Reading ----------
+def read_rows(path):
+    """Yield ``(line_no, {column: value})`` for every data row of ``path``."""
+    if path.lower().endswith('.xlsx'):
+        yield from _read_xlsx(path)
+        return
+    with open(path, newline='', encoding='utf-8-sig') as fh:
+        reader = csv.reader(fh)
+        header = _header(next(reader, []))
+        for values in reader:
+            if any(v.strip() for v in values):
+                yield reader.line_num, dict(zip(header, values))
+
+
+def _read_xlsx(path):
+    if load_workbook is None:
+        raise ValueError("Importing .xlsx files requires openpyxl (pip install openpyxl); use CSV instead.")
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = _header(next(rows, ()))
+        for line_no, values in enumerate(rows, 2):
+            if any(v not in (None, '') for v in values):
+                yield line_no, dict(zip(header, values))
+    finally:
+        wb.close()
+
+
+def _header(cells):
+    return [str(c or '').strip().lower().replace(' ', '_') for c in cells]
+
+
+def chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ---------- Field parsing ----------
+def _str(value):
+    return '' if value is None else str(value).strip()
+
+
+def _date(value, field):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(_str(value))
+    except ValueError:
+        raise ValueError(f"{field}: expected YYYY-MM-DD, got {_str(value)!r}")
+
+
+def _time(value, field):
+    if isinstance(value, (time, datetime)):
+        return value.strftime(TIME_FORMAT)
+    text = _str(value).upper()
+    for fmt in TIME_INPUT_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime(TIME_FORMAT)
+        except ValueError:
+            pass
+    raise ValueError(f"{field}: unrecognised time {_str(value)!r}")
+
+
+def _amount(value, field, default=0.0):
+    if value in (None, ''):
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field}: not a number ({_str(value)!r})")
+
+
+def venue_lookup():
+    """``{slug, lower-cased name or id: venue id}`` for reading venue columns."""
+    lookup = {}
+    for venue in Venue.query.order_by(Venue.id.desc()):
+        lookup.update({venue.slug: venue.id, venue.name.lower(): venue.id, str(venue.id): venue.id})
+    return lookup
+
+
+def _venue(value, venues):
+    text = _str(value)
+    if isinstance(value, float) and value.is_integer():
+        text = str(int(value))
+    if not text:
+        return venues[None]
+    try:
+        return venues[text.lower()]
+    except KeyError:
+        raise ValueError(f"venue: unknown venue {text!r}")
+
+
+def parse_row(raw, venues=None):
+    """Turn one file row into Booking column values; ValueError names the bad field.
+
+    ``venues`` (from ``venue_lookup``, with the default venue's id under None)
+    resolves the ``venue`` column; without it the column is ignored and the
+    database default applies.
+    """
+    name = _str(raw.get('name'))
+    if not name:
+        raise ValueError("name is required")
+    phone = raw.get('phone')
+    if isinstance(phone, float) and phone.is_integer():
+        phone = int(phone)
+    phone = ''.join(ch for ch in _str(phone) if ch.isdigit())
+    if not phone:
+        raise ValueError("phone is required")
+
+    row = {
+        'name': name,
+        'phone': int(phone),
+        'email': _str(raw.get('email')) or DEFAULT_EMAIL,
+        'details': _str(raw.get('details')),
+        'from_date': _date(raw.get('from_date'), 'from_date'),
+        'to_date': _date(raw.get('to_date'), 'to_date'),
+        'from_time': _time(raw.get('from_time'), 'from_time'),
+        'to_time': _time(raw.get('to_time'), 'to_time'),
+        'total_amount': _amount(raw.get('total_amount'), 'total_amount'),
+        'advance': _amount(raw.get('advance'), 'advance'),
+    }
+    if venues is not None:
+        row['venue_id'] = _venue(raw.get('venue'), venues)
+    row['balance'] = _amount(raw.get('balance'), 'balance', row['total_amount'] - row['advance'])
+    try:
+        row['start_at'], row['end_at'] = booking_interval(
+            row['from_date'], row['from_time'], row['to_date'], row['to_time'])
+    except ValueError:
+        raise ValueError("to_date / to_time is before from_date / from_time") from None
+    return row
+
+
+def sweep_by_venue(intervals):
+    """Sweep ``(start, end, ident, venue_id)`` intervals against each other and
+    the database, one venue at a time; returns ``{ident: hit}`` as
+    ``sweep_conflicts`` does."""
+    by_venue = defaultdict(list)
+    for start, end, ident, venue_id in intervals:
+        by_venue[venue_id].append((start, end, ident))
+    hits = {}
+    for venue_id, group in by_venue.items():
+        lo = min(g[0] for g in group)
+        hi = max(g[1] for g in group)
+        hits.update(sweep_conflicts(group, existing_intervals(lo, hi, venue_id=venue_id)))
+    return hits
+
+
+def _reason(hit):
+    kind, other = hit
+    return f"overlaps existing booking #{other}" if kind == 'booking' else f"overlaps row {other} of this file"
+
+
+# ---------- Import ----------
+def import_bookings(path, batch_size=500, dry_run=False):
+    """Import ``path``; returns a namespace with ``inserted``, ``accepted`` and
+    ``rejects`` (a list of ``(line_no, reason)``)."""
+    report = SimpleNamespace(inserted=0, accepted=0, rejects=[])
+    venues = venue_lookup()
+    venues[None] = min(venues.values(), default=None)
+
+    # Pass 1: parse and collect intervals only.
+    candidates = []
+    for chunk in chunked(read_rows(path), batch_size):
+        for line_no, raw in chunk:
+            try:
+                row = parse_row(raw, venues)
+            except ValueError as exc:
+                report.rejects.append((line_no, str(exc)))
+                continue
+            candidates.append((row['start_at'], row['end_at'], line_no, row['venue_id']))
+
+    rejected = {}
+    if candidates:
+        rejected = sweep_by_venue(candidates)
+        db.session.rollback()
+    report.rejects.extend((line_no, _reason(hit)) for line_no, hit in rejected.items())
+    report.accepted = len(candidates) - len(rejected)
+    if dry_run or not report.accepted:
+        report.rejects.sort()
+        return report
+
+    # Pass 2: insert the survivors in batches, re-checked under the write lock.
+    skip = set(rejected) | {line_no for line_no, _ in report.rejects}
+    table = Booking.__table__
+    now = datetime.utcnow()
+    for chunk in chunked(((n, r) for n, r in read_rows(path) if n not in skip), batch_size):
+        rows = {line_no: dict(parse_row(raw, venues), created_at=now) for line_no, raw in chunk}
+        begin_write()
+        late = sweep_by_venue([(r['start_at'], r['end_at'], n, r['venue_id']) for n, r in rows.items()])
+        for line_no, hit in late.items():
+            report.rejects.append((line_no, _reason(hit)))
+            del rows[line_no]
+        if rows:
+            conn = db.session.connection()
+            conn.execute(table.insert(), list(rows.values()))
+            days_changed(conn, {d for r in rows.values() for d in span_days(r['start_at'], r['end_at'])},
+                         {r['venue_id'] for r in rows.values()})
+            bump_data_version(conn)
+            record_reset(conn)
+        db.session.commit()
+        report.inserted += len(rows)
+
+    report.rejects.sort()
+    return report
+
+
+def write_rejects(path, rejects):
+    with open(path, 'w', newline='') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(['line', 'reason'])
+        writer.writerows(rejects)
+    return os.path.abspath(path)
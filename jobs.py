@@ -0,0 +1,384 @@
+"""Background jobs without an outside broker.
+
+Slow work -- rendering a receipt that is not cached yet, building an export
+file -- is queued as a row in the ``job`` table and the request answers at
+once with the job's status URL.  ``flask run-jobs`` starts a pool of worker
+processes that claim queued jobs one at a time (``BEGIN IMMEDIATE`` makes the
+claim atomic across processes), run them inside the app and store the
+result: the handler's JSON return value in the row and, when it produced a
+file, the file under ``JOB_RESULTS_DIR``.
+
+A failing job is retried with exponential backoff until it has had
+``max_attempts`` tries; a handler raising ``PermanentJobError`` fails it at
+once.  Workers heartbeat the job they are running, so the job of a worker
+that died is requeued once its lock is ``JOB_LOCK_TIMEOUT`` seconds stale.
+Finished jobs and their files are pruned after ``JOB_RESULT_TTL`` seconds.
+
+Workers also leave a presence file under ``JOB_RESULTS_DIR/.workers`` (the
+results directory is shared by every host already).  While no worker has
+refreshed one within ``JOB_LOCK_TIMEOUT`` -- ``flask run`` in development
+without ``flask run-jobs`` beside it, or the worker process being down --
+``enqueue`` runs the job inside the request instead of leaving it queued
+forever; production runs the ``worker`` process of the Procfile.
+
+Handlers register with ``@task('name')`` next to the code they run.  They
+are called with the running job (``job.id``, ``job.attempts``,
+``job.path_for(filename)``) and the keyword arguments given to ``enqueue``;
+returning ``{'file': filename, ...}`` records ``job.path_for(filename)`` as
+the job's result file.
+
+Config:
+
+    JOB_WORKERS        processes started by run-jobs (default: CPU count)
+    JOB_POLL_INTERVAL  seconds an idle worker waits before looking again (default 0.5)
+    JOB_LOCK_TIMEOUT   seconds without a heartbeat before a running job is requeued (default 60)
+    JOB_RETRY_DELAY    seconds before the first retry, doubled for each later one (default 5)
+    JOB_RESULT_TTL     seconds finished jobs and their files are kept (default 86400)
+    JOB_RESULTS_DIR    where result files are written (default <instance>/job_results)
+    JOBS_EAGER         always run jobs inside the request that queues them (default off;
+                       they run there anyway while no worker is running)
+"""
+import importlib
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+
+from metrics import JOB_RUNS, JOB_SECONDS, pid
+from models import db, Job, write_transaction
+
+MAINTENANCE_INTERVAL = 60
+PENDING = ('queued', 'running')
+
+TASKS = {}
+_in_worker = False  # set in run-jobs processes; eager runs in the web process do not announce
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help."""
+
+
+def task(name, max_attempts=3):
+    """Register the decorated function as the handler of jobs of kind ``name``."""
+    def register(fn):
+        TASKS[name] = (fn, max_attempts)
+        return fn
+    return register
+
+
+def init_app(app):
+    app.config.setdefault('JOB_WORKERS', int(os.environ.get('JOB_WORKERS', 0)) or os.cpu_count() or 2)
+    app.config.setdefault('JOB_POLL_INTERVAL', 0.5)
+    app.config.setdefault('JOB_LOCK_TIMEOUT', 60)
+    app.config.setdefault('JOB_RETRY_DELAY', 5)
+    app.config.setdefault('JOB_RESULT_TTL', 86400)
+    app.config.setdefault('JOB_RESULTS_DIR', os.path.join(app.instance_path, 'job_results'))
+    app.config.setdefault('JOBS_EAGER', os.environ.get('JOBS_EAGER') == '1')
+
+
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class RunningJob:
+    def __init__(self, row):
+        self.id = row.id
+        self.kind = row.kind
+        self.attempts = row.attempts + 1
+        self.max_attempts = row.max_attempts
+
+    def path_for(self, filename):
+        directory = os.path.join(current_app.config['JOB_RESULTS_DIR'], str(self.id))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename)
+
+
+# ---------- Queueing ----------
+def enqueue(kind, key=None, user=None, **args):
+    """Queue a ``kind`` job with ``args`` (JSON-serialisable); returns its id.
+
+    With ``key``, a queued or running job with the same key is returned
+    instead, so repeated clicks do not queue the same work twice.  With
+    JOBS_EAGER, or while no worker is running, the job (if still queued) is
+    run before this returns.
+    """
+    if kind not in TASKS:
+        raise KeyError(f"no job handler registered for {kind!r}")
+    table = Job.__table__
+    now = datetime.utcnow()
+    with write_transaction(db.engine) as conn:
+        job_id = None
+        if key:
+            job_id = conn.execute(select(table.c.id).where(table.c.key == key, table.c.status.in_(PENDING))
+                                  .limit(1)).scalar()
+        if not job_id:
+            job_id = conn.execute(table.insert().values(
+                kind=kind, key=key, args=json.dumps(args), user=user, status='queued', attempts=0,
+                max_attempts=TASKS[kind][1], run_after=now, created_at=now)).inserted_primary_key[0]
+    if current_app.config['JOBS_EAGER'] or not workers_running():
+        run_job(job_id)
+    return job_id
+
+
+def job_status(job):
+    """Public view of a ``Job`` row."""
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# ---------- Worker presence ----------
+def _presence_dir():
+    return os.path.join(current_app.config['JOB_RESULTS_DIR'], '.workers')
+
+
+def _announce():
+    """Mark this worker as running; returns its presence file."""
+    os.makedirs(_presence_dir(), exist_ok=True)
+    path = os.path.join(_presence_dir(), _worker_id().replace(':', '-'))
+    with open(path, 'a'):
+        os.utime(path)
+    return path
+
+
+def workers_running():
+    """Whether any run-jobs worker announced itself within JOB_LOCK_TIMEOUT."""
+    cutoff = time.time() - current_app.config['JOB_LOCK_TIMEOUT']
+    try:
+        entries = list(os.scandir(_presence_dir()))
+    except FileNotFoundError:
+        return False
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                return True
+        except FileNotFoundError:  # that worker just stopped
+            pass
+    return False
+
+
+# ---------- Running ----------
+def claim(job_id=None):
+    """Lock the oldest runnable job (or queued job ``job_id``) for this
+    process; returns it as a ``RunningJob`` with its args, or None."""
+    table = Job.__table__
+    now = datetime.utcnow()
+    with write_transaction(db.engine) as conn:
+        q = select(table).where(table.c.status == 'queued')
+        if job_id is not None:
+            q = q.where(table.c.id == job_id)
+        else:
+            q = q.where(table.c.run_after <= now).order_by(table.c.run_after, table.c.id).limit(1)
+        row = conn.execute(q).first()
+        if row is None:
+            return None
+        conn.execute(table.update().where(table.c.id == row.id).values(
+            status='running', attempts=row.attempts + 1, locked_by=_worker_id(), locked_at=now))
+    return RunningJob(row), json.loads(row.args)
+
+
+def run_job(job_id=None):
+    """Claim and run one job; False when there was nothing to run."""
+    claimed = claim(job_id)
+    if claimed is None:
+        return False
+    job, args = claimed
+    handler = TASKS.get(job.kind, (None,))[0]
+    started = time.perf_counter()
+    try:
+        if handler is None:
+            raise PermanentJobError(f"no job handler registered for {job.kind!r}")
+        with _heartbeat(job.id):
+            result = handler(job, **args)
+    except Exception as exc:
+        db.session.rollback()
+        outcome = _fail(job, exc)
+    else:
+        _finish(job, result or {})
+        outcome = 'done'
+    JOB_RUNS.inc(kind=job.kind, result=outcome, pid=pid())
+    JOB_SECONDS.observe(time.perf_counter() - started, kind=job.kind, pid=pid())
+    return True
+
+
+def _mine(table, job_id):
+    # A job requeued after its lock went stale belongs to whoever claimed it next.
+    return (table.c.id == job_id) & (table.c.locked_by == _worker_id())
+
+
+def _finish(job, result):
+    table = Job.__table__
+    path = job.path_for(result['file']) if result.get('file') else None
+    with write_transaction(db.engine) as conn:
+        conn.execute(table.update().where(_mine(table, job.id)).values(
+            status='done', result=json.dumps(result), result_path=path, error=None,
+            locked_by=None, finished_at=datetime.utcnow()))
+
+
+def _fail(job, exc):
+    """Record a failed attempt; returns 'retry' or 'failed'."""
+    table = Job.__table__
+    now = datetime.utcnow()
+    error = ''.join(traceback.format_exception_only(type(exc), exc)).strip()
+    permanent = isinstance(exc, PermanentJobError)
+    if not permanent:
+        current_app.logger.exception("Job %s (%s) failed on attempt %s", job.id, job.kind, job.attempts)
+    if permanent or job.attempts >= job.max_attempts:
+        values, outcome = {'status': 'failed', 'finished_at': now}, 'failed'
+    else:
+        delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+        values, outcome = {'status': 'queued', 'run_after': now + timedelta(seconds=delay)}, 'retry'
+    with write_transaction(db.engine) as conn:
+        conn.execute(table.update().where(_mine(table, job.id)).values(error=error, locked_by=None, **values))
+    return outcome
+
+
+@contextmanager
+def _heartbeat(job_id):
+    """Keep the job's lock fresh from a side thread while it runs."""
+    app = current_app._get_current_object()
+    table = Job.__table__
+    me = _worker_id()
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(app.config['JOB_LOCK_TIMEOUT'] / 3):
+            try:
+                with app.app_context(), write_transaction(db.engine) as conn:
+                    conn.execute(table.update().where(table.c.id == job_id, table.c.locked_by == me)
+                                 .values(locked_at=datetime.utcnow()))
+                    if _in_worker:
+                        _announce()  # busy on a long job, not gone
+            except Exception:
+                app.logger.exception("Job %s heartbeat failed", job_id)
+
+    thread = threading.Thread(target=beat, name=f'job-heartbeat-{job_id}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+# ---------- Maintenance ----------
+def requeue_stale():
+    """Hand back jobs whose worker stopped heartbeating; returns how many."""
+    table = Job.__table__
+    now = datetime.utcnow()
+    stale = (table.c.status == 'running') & (table.c.locked_at < now - timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT']))
+    with write_transaction(db.engine) as conn:
+        conn.execute(table.update().where(stale, table.c.attempts >= table.c.max_attempts).values(
+            status='failed', error='worker lost', locked_by=None, finished_at=now))
+        return conn.execute(table.update().where(stale).values(
+            status='queued', error='worker lost', locked_by=None, run_after=now)).rowcount
+
+
+def prune_finished():
+    """Delete finished jobs older than JOB_RESULT_TTL with their files; returns how many."""
+    table = Job.__table__
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_RESULT_TTL'])
+    with write_transaction(db.engine) as conn:
+        old = conn.execute(select(table.c.id, table.c.result_path)
+                           .where(table.c.finished_at < cutoff, table.c.status.notin_(PENDING))).all()
+        if old:
+            conn.execute(table.delete().where(table.c.id.in_([r.id for r in old])))
+    for row in old:
+        if row.result_path:
+            try:
+                os.remove(row.result_path)
+                os.rmdir(os.path.dirname(row.result_path))
+            except OSError:
+                pass
+    return len(old)
+
+
+# ---------- Workers ----------
+def work(app, stop):
+    """Run jobs until ``stop`` is set (the loop of one worker process)."""
+    global _in_worker
+    _in_worker = True
+    presence = None
+    next_maintenance = next_announce = 0
+    while not stop.is_set():
+        ran = False
+        with app.app_context():
+            try:
+                if time.monotonic() >= next_announce:
+                    presence = _announce()
+                    next_announce = time.monotonic() + app.config['JOB_LOCK_TIMEOUT'] / 3
+                if time.monotonic() >= next_maintenance:
+                    requeue_stale()
+                    prune_finished()
+                    next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+                ran = run_job()
+            except Exception:
+                app.logger.exception("Job worker loop failed")
+            finally:
+                db.session.remove()
+        if not ran:
+            stop.wait(app.config['JOB_POLL_INTERVAL'])
+    if presence:
+        try:
+            os.remove(presence)
+        except OSError:
+            pass
+
+
+def _worker_main(app_module):
+    os.environ['INIT_DB_ON_BOOT'] = '0'  # the supervisor already brought the schema up to date
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor turns Ctrl-C into SIGTERM
+    app = importlib.import_module(app_module).app
+    work(app, stop)
+
+
+def _stop_supervisor(*_):
+    raise SystemExit(0)
+
+
+def run_pool(app, workers):
+    """Start ``workers`` job processes and supervise them until told to stop,
+    restarting any that die.  A stopping worker finishes its current job."""
+    ctx = multiprocessing.get_context('spawn')
+
+    def start():
+        proc = ctx.Process(target=_worker_main, args=(app.import_name,), name='job-worker')
+        proc.start()
+        return proc
+
+    signal.signal(signal.SIGTERM, _stop_supervisor)
+    procs = [start() for _ in range(workers)]
+    app.logger.info("Started %d job workers", workers)
+    try:
+        while True:
+            time.sleep(1)
+            for i, proc in enumerate(procs):
+                if not proc.is_alive():
+                    app.logger.warning("Job worker %s exited with %s; restarting", proc.pid, proc.exitcode)
+                    procs[i] = start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.join(timeout=app.config['JOB_LOCK_TIMEOUT'])
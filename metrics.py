@@ -0,0 +1,250 @@
+"""In-process instrumentation exposed at ``/metrics`` (Prometheus text format).
+
+Every request is timed per endpoint, and every SQL statement it runs is
+counted and timed through SQLAlchemy cursor events, so a route whose cost
+grows with table size shows up as a rising statement count or SQL time.
+Receipt rendering and audit group commits record their own histograms.
+``app_boot_seconds`` and ``app_first_request_seconds`` show how long a
+process took to build the app and to answer its first request, so slow
+worker boots after a deploy or an autoscaling restart are visible.
+
+With ``SLOW_REQUEST_SECONDS`` set, requests slower than that are logged as a
+warning together with the statements they ran and how long each took.
+
+Metrics live in the serving process; under gunicorn each worker reports its
+own numbers (the ``pid`` label tells them apart), which Prometheus sums at
+query time.  Setting ``METRICS_TOKEN`` requires ``Authorization: Bearer
+<token>`` on ``/metrics``.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SLOW_QUERY_LOG_LIMIT = 50
+
+_registry = []
+
+
+def _label_str(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                    for k, v in pairs)
+    return '{' + body + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_label_str(self.labelnames, key)} {value}"
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    samples = Counter.samples
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            slot = self._values.get(key)
+            if slot is None:
+                slot = self._values[key] = [0] * (len(self.buckets) + 2)
+            slot[i] += 1
+            slot[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, slot in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), slot[:-1]):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket{_label_str(self.labelnames, key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_label_str(self.labelnames, key)} {slot[-1]}"
+            yield f"{self.name}_count{_label_str(self.labelnames, key)} {cumulative}"
+
+
+def render():
+    """Every registered metric in Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+# ---------- Metrics ----------
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency by endpoint.',
+                            ('endpoint', 'method', 'status', 'pid'))
+REQUEST_SQL_STATEMENTS = Histogram('http_request_sql_statements', 'SQL statements run per request.',
+                                   ('endpoint', 'pid'), buckets=COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram('http_request_sql_seconds', 'Time spent in SQL per request.', ('endpoint', 'pid'))
+SQL_STATEMENTS = Counter('sql_statements_total', 'SQL statements executed, by endpoint ("-" outside requests).',
+                         ('endpoint', 'pid'))
+SQL_SECONDS = Counter('sql_seconds_total', 'Seconds spent executing SQL, by endpoint.', ('endpoint', 'pid'))
+RECEIPT_RENDER_SECONDS = Histogram('receipt_render_seconds', 'Time to render one receipt PDF.', ('pid',))
+RECEIPT_CACHE = Counter('receipt_cache_requests_total', 'Receipt downloads by PDF cache result.', ('result', 'pid'))
+HTTP_CACHE = Counter('http_cache_requests_total', 'Cached views by result (hit, miss, not_modified, bypass).',
+                     ('endpoint', 'result', 'pid'))
+AUDIT_FLUSH_SECONDS = Histogram('audit_flush_seconds', 'Time to write one audit group commit.', ('pid',))
+AUDIT_ENTRIES = Counter('audit_entries_written_total', 'Audit entries written by group commits.', ('pid',))
+ENQUIRY_SPOOLED = Counter('enquiries_spooled_total', 'Public enquiries appended to the intake spool.', ('pid',))
+ENQUIRY_FSYNC_BATCH = Histogram('enquiry_spool_fsync_batch', 'Enquiries made durable by one fsync.', ('pid',),
+                                buckets=COUNT_BUCKETS)
+ENQUIRY_INGESTED = Counter('enquiries_ingested_total', 'Spooled enquiries inserted into the enquiry table.', ('pid',))
+JOB_RUNS = Counter('jobs_run_total', 'Background job attempts by outcome (done, retry, failed).', ('kind', 'result', 'pid'))
+JOB_SECONDS = Histogram('job_run_seconds', 'Time one background job attempt took.', ('kind', 'pid'))
+CHANGEFEED_STREAMS = Gauge('changefeed_open_streams', 'Open /api/stream connections.', ('pid',))
+BOOT_SECONDS = Gauge('app_boot_seconds', 'Time create_app() took, including database initialisation.', ('pid',))
+FIRST_REQUEST_SECONDS = Gauge('app_first_request_seconds', "Latency of this worker's first request.",
+                              ('endpoint', 'pid'))
+
+_first_request_pid = None
+
+
+def pid():
+    return str(os.getpid())
+
+
+def record_boot(app, seconds):
+    BOOT_SECONDS.set(seconds, pid=pid())
+    app.logger.info("App built in %.1f ms", seconds * 1000)
+
+
+# ---------- Hooks ----------
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def _note_first_request(app, endpoint, elapsed):
+    global _first_request_pid
+    # Keyed by pid so a forked worker never inherits its parent's flag.
+    if _first_request_pid == os.getpid():
+        return
+    _first_request_pid = os.getpid()
+    FIRST_REQUEST_SECONDS.set(elapsed, endpoint=endpoint, pid=pid())
+    app.logger.info("First request (%s) served in %.1f ms", endpoint, elapsed * 1000)
+
+
+def init_app(app):
+    app.config.setdefault('SLOW_REQUEST_SECONDS', None)
+    app.config.setdefault('METRICS_TOKEN', None)
+    if os.environ.get('SLOW_REQUEST_SECONDS'):
+        app.config['SLOW_REQUEST_SECONDS'] = float(os.environ['SLOW_REQUEST_SECONDS'])
+    if os.environ.get('METRICS_TOKEN'):
+        app.config['METRICS_TOKEN'] = os.environ['METRICS_TOKEN']
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        if has_request_context() and 'metrics_started' in g:
+            g.sql_count += 1
+            g.sql_seconds += elapsed
+            if g.sql_log is not None and len(g.sql_log) < SLOW_QUERY_LOG_LIMIT:
+                g.sql_log.append((elapsed, statement))
+            endpoint = _endpoint()
+        else:
+            endpoint = '-'
+        SQL_STATEMENTS.inc(endpoint=endpoint, pid=pid())
+        SQL_SECONDS.inc(elapsed, endpoint=endpoint, pid=pid())
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.sql_log = [] if app.config['SLOW_REQUEST_SECONDS'] else None
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = _endpoint()
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method,
+                                status=str(response.status_code), pid=pid())
+        REQUEST_SQL_STATEMENTS.observe(g.sql_count, endpoint=endpoint, pid=pid())
+        REQUEST_SQL_SECONDS.observe(g.sql_seconds, endpoint=endpoint, pid=pid())
+        _note_first_request(app, endpoint, elapsed)
+
+        threshold = app.config['SLOW_REQUEST_SECONDS']
+        if threshold and elapsed >= threshold:
+            queries = '\n'.join(f"  {secs * 1000:8.2f} ms  {' '.join(sql.split())}" for secs, sql in g.sql_log)
+            app.logger.warning("Slow request %s %s -> %s: %.1f ms, %d SQL statements (%.1f ms)\n%s",
+                               request.method, request.full_path.rstrip('?'), response.status_code,
+                               elapsed * 1000, g.sql_count, g.sql_seconds * 1000, queries)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Unauthorized\n', 401, mimetype='text/plain')
+        return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,233 @@
+"""Per-day occupancy.
+
+``venue_day_status`` holds booked minutes and a full/partial status for every
+(venue, day) touched by at least one booking.  Rows are kept current from the
+session's flush hooks: any booking added, moved or deleted marks the days of
+its old and new spans dirty (every occurrence, for a recurring booking) in
+its venues, and only those are re-swept from the interval index, in the same
+transaction as the booking write.  Calendars then read O(days shown) rows
+instead of re-deriving status from every booking, and the cross-venue
+overview reads O(days x venues) rows through the (day, venue_id) index.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from conflicts import span_ids
+from models import db, Booking, BookingException, DayStatus, uses_span_index, write_transaction
+from recurrence import RULE_FIELDS, expand_intervals, occurrences
+
+FULL_DAY_MINUTES = 8 * 60
+
+
+def day_status_for(minutes):
+    if minutes >= FULL_DAY_MINUTES:
+        return "full"
+    return "partial" if minutes > 0 else "free"
+
+
+def span_days(start, end):
+    """Every date that ``[start, end)`` occupies at least partly."""
+    d = start.date()
+    last = (end - timedelta(microseconds=1)).date()
+    while d <= last:
+        yield d
+        d += timedelta(days=1)
+
+
+def booking_days(b):
+    """Dates occupied by a booking, or by any occurrence of a series."""
+    if not b.recurrence:
+        return set(span_days(b.start_at, b.end_at))
+    return {d for s, e in occurrences(b) for d in span_days(s, e)}
+
+
+def daily_minutes(intervals):
+    """Sweep a set of (start, end) datetimes into {date: (minutes, count)}.
+
+    Overlapping intervals are merged by the sweep so a day never counts the
+    same minute twice; ``count`` is the number of intervals touching the day.
+    """
+    points = []
+    counts = defaultdict(int)
+    for s, e in intervals:
+        points.append((s, 1))
+        points.append((e, -1))
+        for d in span_days(s, e):
+            counts[d] += 1
+    points.sort()
+
+    minutes = defaultdict(int)
+    active = 0
+    prev = None
+    for t, delta in points:
+        if active > 0 and t > prev:
+            cur = prev
+            while cur < t:
+                midnight = datetime.combine(cur.date() + timedelta(days=1), datetime.min.time())
+                seg_end = min(t, midnight)
+                minutes[cur.date()] += int((seg_end - cur).total_seconds()) // 60
+                cur = seg_end
+        active += delta
+        prev = t
+    return {d: (minutes[d], counts[d]) for d in counts}
+
+
+def day_ranges(days):
+    """Collapse a set of dates into sorted contiguous (first, last) runs."""
+    run = None
+    for d in sorted(days):
+        if run and d == run[1] + timedelta(days=1):
+            run[1] = d
+        else:
+            if run:
+                yield tuple(run)
+            run = [d, d]
+    if run:
+        yield tuple(run)
+
+
+def _venue_rows(rows, intervals, first=None, last=None):
+    """``venue_day_status`` rows from expanded ``(start, end, id)`` intervals of ``rows``."""
+    venue_of = {r.id: r.venue_id for r in rows}
+    by_venue = defaultdict(list)
+    for s, e, ident in intervals:
+        by_venue[venue_of[ident]].append((s, e))
+    # Rows from before venues are counted once ensure_venues has given them one.
+    by_venue.pop(None, None)
+    return [{'venue_id': venue_id, 'day': d, 'booked_minutes': m, 'bookings': n, 'status': day_status_for(m)}
+            for venue_id, spans in by_venue.items()
+            for d, (m, n) in daily_minutes(spans).items() if first is None or first <= d <= last]
+
+
+def refresh_days(conn, days, venue_ids=None):
+    """Recompute ``venue_day_status`` for ``days`` in ``venue_ids`` (all
+    venues when None) on ``conn``, inside the caller's transaction."""
+    booking = Booking.__table__
+    table = DayStatus.__table__
+    venue_ids = sorted(venue_ids) if venue_ids is not None else None
+    for first, last in day_ranges(days):
+        lo = datetime.combine(first, datetime.min.time())
+        hi = datetime.combine(last + timedelta(days=1), datetime.min.time())
+        q = select(*(booking.c[f] for f in RULE_FIELDS), booking.c.venue_id).where(
+            or_(booking.c.end_at > lo, booking.c.series_end_at > lo), booking.c.start_at < hi)
+        stale = table.delete().where(table.c.day >= first, table.c.day <= last)
+        one_venue = venue_ids[0] if venue_ids and len(venue_ids) == 1 else None
+        if venue_ids is not None:
+            stale = stale.where(table.c.venue_id.in_(venue_ids))
+            if one_venue is None or not uses_span_index():
+                q = q.where(booking.c.venue_id.in_(venue_ids))
+        if uses_span_index():
+            q = q.where(booking.c.id.in_(span_ids(lo, hi, one_venue)))
+        rows = conn.execute(q).all()
+        conn.execute(stale)
+        day_rows = _venue_rows(rows, expand_intervals(rows, lo, hi, conn.execute), first, last)
+        if day_rows:
+            conn.execute(table.insert(), day_rows)
+
+
+# Other per-day tables kept current from the same dirty days (reports.py)
+# register here; they run after day_status, in the same transaction.
+_day_listeners = []
+
+
+def on_days_changed(fn):
+    _day_listeners.append(fn)
+    return fn
+
+
+def days_changed(conn, days, venue_ids=None):
+    """Bring ``venue_day_status`` (for ``venue_ids``, or all venues) and every
+    registered per-day table up to date for ``days``."""
+    refresh_days(conn, days, venue_ids)
+    for fn in _day_listeners:
+        fn(conn, days)
+
+
+def rebuild_occupancy():
+    """Recompute the whole table in one sweep (after bulk loads or imports)."""
+    booking = Booking.__table__
+    with write_transaction(db.engine) as conn:
+        rows = conn.execute(
+            select(*(booking.c[f] for f in RULE_FIELDS), booking.c.venue_id).where(booking.c.start_at.isnot(None))
+        ).all()
+        day_rows = _venue_rows(rows, expand_intervals(rows, execute=conn.execute))
+        conn.execute(DayStatus.__table__.delete())
+        if day_rows:
+            conn.execute(DayStatus.__table__.insert(), day_rows)
+    return len(day_rows)
+
+
+def day_statuses(first, last, venue_id):
+    """{iso date: status} for one venue's booked days in [first, last]."""
+    rows = DayStatus.query.filter(DayStatus.venue_id == venue_id, DayStatus.day >= first, DayStatus.day <= last) \
+        .order_by(DayStatus.day)
+    return {r.day.isoformat(): r.status for r in rows}
+
+
+def venue_overview(first, last):
+    """{venue id: {iso date: (status, booked minutes, bookings)}} for every
+    venue's booked days in [first, last], in one index range scan."""
+    overview = defaultdict(dict)
+    for r in DayStatus.query.filter(DayStatus.day >= first, DayStatus.day <= last) \
+            .order_by(DayStatus.day, DayStatus.venue_id):
+        overview[r.venue_id][r.day.isoformat()] = (r.status, r.booked_minutes, r.bookings)
+    return overview
+
+
+# ---------- Incremental maintenance ----------
+def _flushed(obj, attr):
+    """``obj.attr`` as the database has it, ignoring unflushed changes."""
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return history.unchanged[0] if history.unchanged else getattr(obj, attr)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_dirty_days(session, flush_context, instances):
+    days = session.info.setdefault('occupancy_days', set())
+    # Venues whose rows those days need; None (venue not known before the
+    # insert, which picks the default) means every venue.
+    venues = session.info.setdefault('occupancy_venues', set())
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            obj.sync_interval()
+            days.update(booking_days(obj))
+            venues.add(obj.venue_id)
+        elif isinstance(obj, BookingException):
+            days.update(span_days(obj.occurrence_start, obj.occurrence_end))
+            venues.add(getattr(obj.booking, 'venue_id', None))
+    for obj in session.dirty:
+        if isinstance(obj, Booking) and session.is_modified(obj):
+            # The old rule is gone by now; its whole series range, as last
+            # flushed, is not.  (The live attributes may already hold the new
+            # range: callers sync_interval() to check conflicts before flushing.)
+            old_start = _flushed(obj, 'start_at')
+            old_end = _flushed(obj, 'series_end_at') or _flushed(obj, 'end_at')
+            if old_start and old_end:
+                days.update(span_days(old_start, old_end))
+            obj.sync_interval()
+            days.update(booking_days(obj))
+            venues.add(obj.venue_id)
+            venues.update(inspect(obj).attrs.venue_id.history.deleted)
+    for obj in session.deleted:
+        if isinstance(obj, Booking) and obj.start_at and obj.end_at:
+            days.update(booking_days(obj))
+            venues.add(obj.venue_id)
+        elif isinstance(obj, BookingException):
+            days.update(span_days(obj.occurrence_start, obj.occurrence_end))
+            venues.add(getattr(obj.booking, 'venue_id', None))
+    if not days:
+        session.info.pop('occupancy_days')
+        session.info.pop('occupancy_venues')
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_dirty_days(session, flush_context):
+    days = session.info.pop('occupancy_days', None)
+    venues = session.info.pop('occupancy_venues', None)
+    if days:
+        days_changed(session.connection(), days, None if None in venues else venues)
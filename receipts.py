@@ -0,0 +1,340 @@
+"""Receipt / invoice PDFs.
+
+ReportLab is imported, and the Arimo fonts registered, only when the first
+PDF of a process is drawn, so booting a worker does not pay for them; after
+that they stay loaded for every later render.  Rendered PDFs are cached on disk under a name derived from the
+booking id and a hash of every field printed on the receipt.  That hash is
+also the ETag, so a browser re-downloading an unchanged receipt gets a 304,
+and any edit to a billing field produces a new key; stale files for changed
+or deleted bookings are removed when the write commits.
+
+A download that misses the cache does not render in the web worker: it
+queues a ``receipt`` job (see jobs.py) and is retried once the job is done.
+"""
+import glob
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime
+from io import BytesIO
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from jobs import PermanentJobError, task
+from metrics import RECEIPT_CACHE, RECEIPT_RENDER_SECONDS, pid
+from models import db, Booking
+
+ARIMO = ("Arimo", "Arimo-Bold")
+HELVETICA = ("Helvetica", "Helvetica-Bold")
+FONT_FILES = ('Arimo-Regular.ttf', 'Arimo-Bold.ttf')
+
+_fonts = HELVETICA
+_fonts_dir = None
+_fonts_ready = False
+_fonts_lock = threading.Lock()
+_cache_dir = None
+
+
+def register_fonts(fonts_dir):
+    """Register Arimo from ``fonts_dir``; returns False if it fell back to Helvetica."""
+    global _fonts, _fonts_ready
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFError, TTFont
+
+    _fonts_ready = True
+    try:
+        for name, filename in zip(ARIMO, FONT_FILES):
+            pdfmetrics.registerFont(TTFont(name, os.path.join(fonts_dir, filename)))
+        _fonts = ARIMO
+        return True
+    except (OSError, TTFError):
+        _fonts = HELVETICA
+        return False
+
+
+def _ensure_fonts():
+    """Register the fonts on the first render in this process."""
+    if _fonts_ready:
+        return
+    with _fonts_lock:
+        if not _fonts_ready and not register_fonts(_fonts_dir or ''):
+            logging.getLogger(__name__).warning("Arimo fonts unreadable; receipts fall back to Helvetica")
+
+
+def init_app(app):
+    """Locate the receipt fonts and set up the PDF cache directory.
+
+    Nothing is loaded here; ``_fonts`` is set from the font files' presence
+    so cache keys are right before the first render registers them.
+    """
+    global _cache_dir, _fonts, _fonts_dir
+    _fonts_dir = os.path.join(app.root_path, 'static', 'fonts')
+    if all(os.path.exists(os.path.join(_fonts_dir, name)) for name in FONT_FILES):
+        _fonts = ARIMO
+    else:
+        app.logger.warning("Arimo fonts unavailable; receipts fall back to Helvetica")
+    _cache_dir = app.config.get('RECEIPT_CACHE_DIR') or os.path.join(app.instance_path, 'receipt_cache')
+    os.makedirs(_cache_dir, exist_ok=True)
+
+
+def receipt_key(b, today_str):
+    """Hash of everything printed on the receipt (including the issue date)."""
+    fields = (b.id, b.name, b.phone, b.email, b.from_date, b.from_time, b.to_date, b.to_time,
+              b.total_amount, b.advance, b.balance, b.venue_name, b.venue_address, b.venue_contact, today_str, _fonts)
+    return hashlib.sha256(repr(fields).encode()).hexdigest()[:32]
+
+
+def invoice_number(b):
+    return f"INV-{b.id:05d}"
+
+
+def render_receipt(b, today_str):
+    """Draw the receipt for booking ``b`` and return the PDF bytes."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    with RECEIPT_RENDER_SECONDS.time(pid=pid()):
+        _ensure_fonts()
+        buffer = BytesIO()
+        p = canvas.Canvas(buffer, pagesize=A4)
+        draw_receipt(p, b, today_str)
+        p.save()
+    return buffer.getvalue()
+
+
+def draw_receipt(p, b, today_str):
+    """Draw one receipt page for booking ``b`` onto canvas ``p``."""
+    from reportlab.lib.pagesizes import A4
+
+    invoice_no = invoice_number(b)
+    width, height = A4
+
+    FONT, FONT_BOLD = _fonts
+
+    # ============================================================
+    # RIGHT SIDE HEADER (unchanged)
+    # ============================================================
+    p.setFont(FONT_BOLD, 14)
+    p.drawRightString(width - 40, height - 60, "Receipt / Invoice")
+
+    p.setFont(FONT, 11)
+    p.drawRightString(width - 40, height - 85, f"Invoice No: {invoice_no}")
+    p.drawRightString(width - 40, height - 105, f"Date: {today_str}")
+
+    # ============================================================
+    # LEFT SIDE HEADER (MOVED DOWN BELOW DATE)
+    # ============================================================
+    p.setFont(FONT_BOLD, 20)
+    p.drawString(40, height - 130, b.venue_name)
+
+    p.setFont(FONT, 11)
+    if b.venue_address:
+        p.drawString(40, height - 150, b.venue_address)
+    if b.venue_contact:
+        p.drawString(40, height - 168, b.venue_contact)
+
+    # Divider line below both headers
+    p.setLineWidth(1)
+    p.line(40, height - 190, width - 40, height - 190)
+
+    # ============================================================
+    # BILL TO SECTION (EXTRA SPACING ADDED)
+    # ============================================================
+    p.setFont(FONT_BOLD, 12)
+    p.drawString(40, height - 220, "Bill To :")
+
+    p.setFont(FONT, 12)
+    p.drawString(40, height - 240, b.name)
+    p.drawString(40, height - 260, f"Phone: {b.phone}")
+    p.drawString(40, height - 280, f"Email: {b.email}")
+
+    # ============================================================
+    # TABLE HEADER
+    # ============================================================
+    table_top = height - 320
+
+    p.line(40, table_top, width - 40, table_top)
+
+    p.setFont(FONT_BOLD, 12)
+    p.drawString(45, table_top - 20, "DESCRIPTION")
+    p.drawString(230, table_top - 20, "FROM")
+    p.drawString(360, table_top - 20, "TO")
+    p.drawString(480, table_top - 20, "AMOUNT")
+
+    p.line(40, table_top - 25, width - 40, table_top - 25)
+
+    # ============================================================
+    # TABLE ROW
+    # ============================================================
+    y = table_top - 50
+    p.setFont(FONT, 12)
+
+    p.drawString(45, y, "Auditorium Booking (Event)")
+
+    # NO OVERLAP – proper spacing
+    p.drawString(230, y, f"{b.from_date} {b.from_time}")
+    p.drawString(360, y, f"{b.to_date} {b.to_time}")
+
+    p.drawRightString(545, y, f"{b.total_amount:,.2f}")
+
+    # ============================================================
+    # TOTALS
+    # ============================================================
+    totals_y = y - 70
+
+    p.setFont(FONT_BOLD, 12)
+    p.drawRightString(545, totals_y, f"Total Amount: {b.total_amount:,.2f}")
+
+    p.setFont(FONT, 12)
+    p.drawRightString(545, totals_y - 25, f"Advance Paid: {b.advance:,.2f}")
+    p.drawRightString(545, totals_y - 50, f"Balance Due: {b.balance:,.2f}")
+
+    # ============================================================
+    # FOOTER / SIGNATURE
+    # ============================================================
+    footer_y = totals_y - 120
+
+    p.setFont(FONT, 12)
+    p.drawString(40, footer_y, "Authorized Signature: ___________________________")
+    p.drawString(40, footer_y - 25, "Date: ___________________________")
+
+    p.setFont(FONT, 11)
+    p.drawString(40, footer_y - 70, f"Thank you for choosing {b.venue_name}.")
+
+    p.showPage()
+
+
+def draw_statement_summary(p, bookings, today_str, title="Statement"):
+    """Draw the statement's listing pages (one line per booking, then totals)."""
+    from reportlab.lib.pagesizes import A4
+
+    width, height = A4
+    FONT, FONT_BOLD = _fonts
+    columns = [(40, "INVOICE"), (110, "NAME"), (260, "FROM"), (340, "TO")]
+    amounts = [(440, "TOTAL"), (495, "ADVANCE"), (555, "BALANCE")]
+
+    def header():
+        p.setFont(FONT_BOLD, 16)
+        p.drawString(40, height - 50, title)
+        p.setFont(FONT, 10)
+        p.drawRightString(width - 40, height - 50, f"Date: {today_str}")
+        p.setFont(FONT_BOLD, 9)
+        for x, label in columns:
+            p.drawString(x, height - 80, label)
+        for x, label in amounts:
+            p.drawRightString(x, height - 80, label)
+        p.line(40, height - 85, width - 40, height - 85)
+        p.setFont(FONT, 9)
+        return height - 100
+
+    y = header()
+    totals = [0.0, 0.0, 0.0]
+    for b in bookings:
+        if y < 60:
+            p.showPage()
+            y = header()
+        p.drawString(40, y, invoice_number(b))
+        p.drawString(110, y, (b.name or "")[:28])
+        p.drawString(260, y, f"{b.from_date}")
+        p.drawString(340, y, f"{b.to_date}")
+        for i, ((x, _), value) in enumerate(zip(amounts, (b.total_amount, b.advance, b.balance))):
+            p.drawRightString(x, y, f"{value:,.2f}")
+            totals[i] += value
+        y -= 14
+
+    p.line(40, y + 8, width - 40, y + 8)
+    p.setFont(FONT_BOLD, 9)
+    p.drawString(40, y - 6, "TOTAL")
+    for (x, _), value in zip(amounts, totals):
+        p.drawRightString(x, y - 6, f"{value:,.2f}")
+    p.showPage()
+
+
+def render_statement(fileobj, summary_bookings, receipt_bookings, today_str, title="Statement"):
+    """Write one PDF to ``fileobj``: the summary listing, then every receipt page."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    _ensure_fonts()
+    p = canvas.Canvas(fileobj, pagesize=A4)
+    draw_statement_summary(p, summary_bookings, today_str, title)
+    for b in receipt_bookings:
+        draw_receipt(p, b, today_str)
+    p.save()
+
+
+def cached_receipt(b, today_str):
+    """Path of an already rendered receipt for ``b`` or None."""
+    if _cache_dir is None:
+        return None
+    path = os.path.join(_cache_dir, f"{b.id}-{receipt_key(b, today_str)}.pdf")
+    return path if os.path.exists(path) else None
+
+
+def cached_receipt_pdf(b):
+    """``(path, etag)`` of today's receipt for ``b`` if it is already
+    rendered, else None (see ``render_receipt_job``)."""
+    today_str = datetime.today().strftime("%d-%m-%Y")
+    path = cached_receipt(b, today_str)
+    RECEIPT_CACHE.inc(result='hit' if path else 'miss', pid=pid())
+    return (path, receipt_key(b, today_str)) if path else None
+
+
+def receipt_pdf(b):
+    """Return ``(path, etag)`` of the cached receipt, rendering it if needed."""
+    today_str = datetime.today().strftime("%d-%m-%Y")
+    key = receipt_key(b, today_str)
+    path = os.path.join(_cache_dir, f"{b.id}-{key}.pdf")
+    if not os.path.exists(path):
+        pdf = render_receipt(b, today_str)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as fh:
+            fh.write(pdf)
+        os.replace(tmp, path)
+        # Older renders of this booking (other fields or issue date) are dead.
+        invalidate(b.id, keep=path)
+    return path, key
+
+
+@task('receipt')
+def render_receipt_job(job, booking_id):
+    """Render a receipt into the cache off the request path; the download
+    route then serves it as a cache hit."""
+    b = db.session.get(Booking, booking_id)
+    if b is None:
+        raise PermanentJobError(f"Booking {booking_id} no longer exists")
+    path, key = receipt_pdf(b)
+    return {'booking_id': booking_id, 'etag': key}
+
+
+def invalidate(booking_id, keep=None):
+    """Drop cached receipts of one booking."""
+    if _cache_dir is None:
+        return
+    for stale in glob.glob(os.path.join(_cache_dir, f"{booking_id}-*.pdf")):
+        if stale != keep:
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+
+# ---------- Automatic invalidation ----------
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_bookings(session, flush_context):
+    changed = session.info.setdefault('receipt_invalidate', set())
+    changed.update(o.id for o in session.dirty if isinstance(o, Booking))
+    changed.update(o.id for o in session.deleted if isinstance(o, Booking))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    for booking_id in session.info.pop('receipt_invalidate', ()):
+        invalidate(booking_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_rolled_back(session):
+    session.info.pop('receipt_invalidate', None)
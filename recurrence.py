@@ -0,0 +1,174 @@
+"""Recurring bookings.
+
+A series is a single ``booking`` row carrying its rule (``recurrence``,
+``recur_interval`` and ``recur_count`` or ``recur_until``; see models.py).
+Its occurrences are never stored: they are generated lazily, and only for
+the window being looked at, so a calendar month of a three-year weekly
+series costs four or five dates rather than 150 rows.  The interval index
+covers the whole series, so the usual window queries find the series row and
+``expand`` turns it into the occurrences that actually fall in the window.
+
+Deleting one occurrence, or detaching it into a booking of its own to edit
+it, records a ``booking_exception`` row that expansion skips.  The series'
+amounts are those of each occurrence, and a detached occurrence keeps them.
+"""
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+from models import (db, BookingException, MAX_OCCURRENCES, RECURRENCES, index_at_or_after,
+                    nth_start, occurrence_count)
+
+KEY_FORMAT = '%Y%m%dT%H%M'
+_TICK = datetime.resolution
+
+# Columns a row needs for its occurrences to be expanded.
+RULE_FIELDS = ('id', 'start_at', 'end_at', 'recurrence', 'recur_interval', 'recur_count', 'recur_until')
+
+
+class Occurrence:
+    """One dated instance of a recurring booking; reads like the booking."""
+    is_occurrence = True
+
+    def __init__(self, booking, start_at, end_at):
+        self.booking = booking
+        self.start_at = start_at
+        self.end_at = end_at
+
+    def __getattr__(self, name):
+        return getattr(self.booking, name)
+
+    @property
+    def from_date(self):
+        return self.start_at.date()
+
+    @property
+    def to_date(self):
+        return self.from_date + (self.booking.to_date - self.booking.from_date)
+
+    @property
+    def key(self):
+        return self.start_at.strftime(KEY_FORMAT)
+
+
+def parse_recurrence(form):
+    """Rule columns from the booking form's repeat fields.  Raises ValueError."""
+    freq = (form.get('repeat') or '').strip()
+    if not freq:
+        return {'recurrence': None, 'recur_interval': None, 'recur_count': None, 'recur_until': None}
+    if freq not in RECURRENCES:
+        raise ValueError("Unknown repeat frequency.")
+    every = (form.get('repeat_every') or '').strip() or '1'
+    until = (form.get('repeat_until') or '').strip()
+    count = (form.get('repeat_count') or '').strip()
+    if not every.isdigit() or int(every) < 1:
+        raise ValueError("Repeat interval must be a whole number of at least 1.")
+    if not until and not count:
+        raise ValueError("A repeating booking needs an end date or a number of occurrences.")
+    if count and not (count.isdigit() and 1 <= int(count) <= MAX_OCCURRENCES):
+        raise ValueError(f"A series can have between 1 and {MAX_OCCURRENCES} occurrences.")
+    if not count:
+        try:
+            until = date.fromisoformat(until)
+        except ValueError:
+            raise ValueError("The repeat end date is not a valid date (YYYY-MM-DD).") from None
+    return {'recurrence': freq, 'recur_interval': int(every), 'recur_count': int(count) if count else None,
+            'recur_until': None if count else until}
+
+
+def occurrences(rule, start=None, end=None, skip=()):
+    """Yield ``(start, end)`` of the rule's occurrences intersecting
+    ``[start, end)``, earliest first, leaving out the starts in ``skip``.
+
+    Jumps straight to the first occurrence of the window, so the cost is the
+    number of occurrences yielded, not the age of the series.
+    """
+    duration = rule.end_at - rule.start_at
+    count = occurrence_count(rule)
+    k = index_at_or_after(rule, start - duration + _TICK) if start is not None else 0
+    while k < count:
+        s = nth_start(rule, k)
+        if end is not None and s >= end:
+            return
+        if s not in skip:
+            yield s, s + duration
+        k += 1
+
+
+def occurrences_before(rule, before=None, skip=()):
+    """Yield the rule's occurrence starts below ``before``, latest first."""
+    count = occurrence_count(rule)
+    k = min(index_at_or_after(rule, before), count) if before is not None else count
+    while k > 0:
+        k -= 1
+        s = nth_start(rule, k)
+        if s not in skip:
+            yield s
+
+
+def skipped_starts(series_ids, start=None, end=None, execute=None):
+    """{series id: set of occurrence starts} excepted within ``[start, end)``."""
+    if not series_ids:
+        return {}
+    table = BookingException.__table__
+    q = select(table.c.booking_id, table.c.occurrence_start).where(table.c.booking_id.in_(series_ids))
+    if start is not None:
+        q = q.where(table.c.occurrence_end > start)
+    if end is not None:
+        q = q.where(table.c.occurrence_start < end)
+    skip = {}
+    for booking_id, occurrence_start in (execute or db.session.execute)(q):
+        skip.setdefault(booking_id, set()).add(occurrence_start)
+    return skip
+
+
+def expand(bookings, start, end):
+    """One-off bookings as they are and each series as its occurrences in
+    ``[start, end)``, ordered by start then id."""
+    skip = skipped_starts([b.id for b in bookings if b.recurrence], start, end)
+    out = []
+    for b in bookings:
+        if not b.recurrence:
+            out.append(b)
+            continue
+        out.extend(Occurrence(b, s, e) for s, e in occurrences(b, start, end, skip.get(b.id, ())))
+    out.sort(key=lambda b: (b.start_at, b.id))
+    return out
+
+
+def expand_intervals(rows, start=None, end=None, execute=None):
+    """``(start, end, id)`` for rows with the ``RULE_FIELDS`` columns -- the
+    Core counterpart of ``expand``, for sweeps that only need intervals."""
+    skip = skipped_starts([r.id for r in rows if r.recurrence], start, end, execute)
+    out = []
+    for r in rows:
+        if not r.recurrence:
+            out.append((r.start_at, r.end_at, r.id))
+        else:
+            out.extend((s, e, r.id) for s, e in occurrences(r, start, end, skip.get(r.id, ())))
+    return out
+
+
+def occurrence_at(booking, key):
+    """The live occurrence of ``booking`` starting at ``key`` (KEY_FORMAT), or None."""
+    try:
+        start = datetime.strptime(key, KEY_FORMAT)
+    except ValueError:
+        return None
+    if not booking.recurrence:
+        return None
+    for s, e in occurrences(booking, start, start + _TICK):
+        if s == start and not BookingException.query.filter_by(booking_id=booking.id, occurrence_start=s).count():
+            return Occurrence(booking, s, e)
+    return None
+
+
+def series_summary(booking):
+    """'Weekly until 2026-12-31', 'Every 2 months, 6 times', ..."""
+    unit = {'daily': 'day', 'weekly': 'week', 'monthly': 'month'}[booking.recurrence]
+    every = booking.recur_interval or 1
+    text = booking.recurrence.capitalize() if every == 1 else f"Every {every} {unit}s"
+    if booking.recur_count:
+        return f"{text}, {booking.recur_count} times"
+    return f"{text} until {booking.recur_until.isoformat()}"
+
@@ -0,0 +1,154 @@
+"""Revenue and balance reporting from precomputed rollups.
+
+``revenue_day`` and ``revenue_month`` hold the totals per period: bookings,
+booked hours, revenue (``total_amount``), advance collected and outstanding
+balance.  They are kept current from the same dirty days as ``day_status``
+(see ``occupancy.on_days_changed``), in the transaction of every booking
+write, and ``rebuild_rollups`` recomputes both from scratch (``flask
+rebuild-reports``).  A report then reads one row per period no matter how
+many bookings there are.
+
+Money is counted on the day a booking starts, hours on every day it runs.
+A recurring booking counts once per occurrence.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, select
+
+from conflicts import span_ids
+from models import db, Booking, RevenueDay, RevenueMonth, uses_span_index, write_transaction
+from occupancy import day_ranges, on_days_changed
+from recurrence import RULE_FIELDS, expand_intervals
+
+MEASURES = ('bookings', 'booked_minutes', 'revenue', 'advance', 'outstanding')
+MAX_DAYS = 366
+MAX_MONTHS = 120
+
+
+def month_start(d):
+    return d.replace(day=1)
+
+
+def next_month(m):
+    return (m + timedelta(days=32)).replace(day=1)
+
+
+def _minutes_by_day(start, end):
+    cur = start
+    while cur < end:
+        seg_end = min(end, datetime.combine(cur.date() + timedelta(days=1), datetime.min.time()))
+        yield cur.date(), int((seg_end - cur).total_seconds()) // 60
+        cur = seg_end
+
+
+def _bookings_select(lo=None, hi=None):
+    booking = Booking.__table__
+    q = select(*(booking.c[f] for f in RULE_FIELDS), booking.c.total_amount, booking.c.advance, booking.c.balance)
+    if lo is None:
+        return q.where(booking.c.start_at.isnot(None))
+    q = q.where(or_(booking.c.end_at > lo, booking.c.series_end_at > lo), booking.c.start_at < hi)
+    if uses_span_index():
+        q = q.where(booking.c.id.in_(span_ids(lo, hi)))
+    return q
+
+
+def daily_totals(conn, lo=None, hi=None):
+    """{date: [bookings, minutes, revenue, advance, outstanding]} over the
+    bookings and occurrences intersecting ``[lo, hi)`` (all, when unbounded)."""
+    rows = conn.execute(_bookings_select(lo, hi)).all()
+    by_id = {r.id: r for r in rows}
+    totals = defaultdict(lambda: [0, 0, 0.0, 0.0, 0.0])
+    for s, e, ident in expand_intervals(rows, lo, hi, conn.execute):
+        r = by_id[ident]
+        t = totals[s.date()]
+        t[0] += 1
+        t[2] += r.total_amount or 0
+        t[3] += r.advance or 0
+        t[4] += r.balance or 0
+        for d, minutes in _minutes_by_day(s, e):
+            totals[d][1] += minutes
+    return totals
+
+
+def _day_rows(totals, first=None, last=None):
+    return [dict(zip(('day',) + MEASURES, [d] + v)) for d, v in totals.items()
+            if any(v) and (first is None or first <= d <= last)]
+
+
+# ---------- Maintenance ----------
+@on_days_changed
+def refresh_rollups(conn, days):
+    """Recompute ``revenue_day`` for ``days`` and ``revenue_month`` for their months."""
+    table = RevenueDay.__table__
+    for first, last in day_ranges(days):
+        lo = datetime.combine(first, datetime.min.time())
+        hi = datetime.combine(last + timedelta(days=1), datetime.min.time())
+        rows = _day_rows(daily_totals(conn, lo, hi), first, last)
+        conn.execute(table.delete().where(table.c.day >= first, table.c.day <= last))
+        if rows:
+            conn.execute(table.insert(), rows)
+
+    day, month = RevenueDay.__table__, RevenueMonth.__table__
+    months = sorted({month_start(d) for d in days})
+    rows = []
+    for m in months:
+        count, *sums = conn.execute(select(func.count(), *(func.coalesce(func.sum(day.c[k]), 0) for k in MEASURES))
+                                    .where(day.c.day >= m, day.c.day < next_month(m))).one()
+        if count:
+            rows.append(dict(zip(('month',) + MEASURES, [m] + sums)))
+    conn.execute(month.delete().where(month.c.month.in_(months)))
+    if rows:
+        conn.execute(month.insert(), rows)
+
+
+def rebuild_rollups():
+    """Recompute both rollup tables from every booking in one sweep."""
+    with write_transaction(db.engine) as conn:
+        rows = _day_rows(daily_totals(conn))
+        months = defaultdict(lambda: [0, 0, 0.0, 0.0, 0.0])
+        for r in rows:
+            acc = months[month_start(r['day'])]
+            for i, k in enumerate(MEASURES):
+                acc[i] += r[k]
+        conn.execute(RevenueDay.__table__.delete())
+        conn.execute(RevenueMonth.__table__.delete())
+        if rows:
+            conn.execute(RevenueDay.__table__.insert(), rows)
+            conn.execute(RevenueMonth.__table__.insert(),
+                         [dict(zip(('month',) + MEASURES, [m] + v)) for m, v in months.items()])
+    return len(rows)
+
+
+# ---------- Reading ----------
+def _report(model, key, first, last, step, label):
+    """One entry per period in ``[first, last]`` (zeros where nothing was
+    booked) and their totals, from the rollup rows alone."""
+    col = getattr(model, key)
+    found = {getattr(r, key): r for r in model.query.filter(col >= first, col <= last)}
+    periods, totals = [], dict.fromkeys(MEASURES, 0)
+    cur = first
+    while cur <= last:
+        r = found.get(cur)
+        values = {k: getattr(r, k) if r else 0 for k in MEASURES}
+        for k in MEASURES:
+            totals[k] += values[k]
+        periods.append(dict(_present(values), period=label(cur)))
+        cur = step(cur)
+    return periods, _present(totals)
+
+
+def _present(values):
+    out = {'bookings': values['bookings'], 'booked_hours': round(values['booked_minutes'] / 60, 2)}
+    out.update((k, round(values[k], 2)) for k in ('revenue', 'advance', 'outstanding'))
+    return out
+
+
+def monthly_report(first, last):
+    """Months from ``first`` to ``last`` (any dates within them)."""
+    return _report(RevenueMonth, 'month', month_start(first), month_start(last), next_month,
+                   lambda m: m.strftime('%Y-%m'))
+
+
+def daily_report(first, last):
+    return _report(RevenueDay, 'day', first, last, lambda d: d + timedelta(days=1), lambda d: d.isoformat())
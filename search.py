@@ -0,0 +1,171 @@
+"""Bookings dashboard listing: server-side filters, full-text search and
+keyset pagination.
+
+Pages are walked newest first on ``(start_at, id)`` -- the normalized
+``(from_date, from_time)`` -- using a cursor from the previous page instead of
+OFFSET, so every page costs the same regardless of how much history exists.
+Text search goes through the ``booking_fts`` FTS5 index.
+
+Recurring series are matched by the same filters, then their occurrences are
+generated newest first from the cursor position and merged into the page, so
+a page never expands more of a series than it shows.  Only series whose span
+reaches into the page -- between the cursor and the oldest one-off booking
+the page holds -- are loaded, found through the ``booking_span`` index.
+"""
+import base64
+import heapq
+import re
+from datetime import datetime, date, timedelta
+from itertools import islice
+
+from sqlalchemy import and_, or_, select, text
+
+from conflicts import booking_span
+from models import db, Booking, epoch_minutes, uses_span_index
+from recurrence import Occurrence, occurrences_before, skipped_starts
+from venues import find_venue
+
+PAGE_SIZE = 50
+
+booking_fts = db.table('booking_fts', db.column('rowid'))
+
+
+def encode_cursor(key, ident):
+    """Opaque cursor for a (datetime, id) keyset position."""
+    raw = f"{key.isoformat()}|{ident}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        start, ident = raw.split('|')
+        return datetime.fromisoformat(start), int(ident)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def fts_query(q):
+    """Turn free text into a safe FTS5 prefix query: every term must match."""
+    terms = re.findall(r'\w+', q)
+    return ' '.join(f'"{t}"*' for t in terms)
+
+
+def _ends_on_or_after(d):
+    return or_(Booking.to_date >= d, Booking.series_end_at > datetime.combine(d, datetime.min.time()))
+
+
+def _date_window(args):
+    """(first, last) dates the dashboard filters allow; either may be None."""
+    def parse(key):
+        try:
+            return date.fromisoformat(args[key]) if args.get(key) else None
+        except ValueError:
+            return None
+    day = parse('date')
+    return (day or parse('from')), (day or parse('to'))
+
+
+def _series_occurrences(series, after, args):
+    """Occurrences of ``series`` within the filters, before ``after``, newest first."""
+    first, last = _date_window(args)
+    before = datetime.combine(last + timedelta(days=1), datetime.min.time()) if last else None
+    if after and (before is None or after[0] < before):
+        before = after[0] + timedelta(microseconds=1)
+    skip = skipped_starts([b.id for b in series])
+
+    def walk(b):
+        for s in occurrences_before(b, before, skip.get(b.id, ())):
+            o = Occurrence(b, s, s + (b.end_at - b.start_at))
+            if first and o.to_date < first:
+                return
+            if after and (s, b.id) >= after or last and o.from_date > last:
+                continue
+            yield o
+    return [walk(b) for b in series]
+
+
+def filter_bookings(args):
+    """Apply the dashboard's request filters to a Booking query."""
+    qs = Booking.query
+
+    # ?date=YYYY-MM-DD keeps bookings covering that day (series: any occurrence
+    # may; bookings_page narrows them to the occurrences that do)
+    if args.get('date'):
+        try:
+            dt = date.fromisoformat(args['date'])
+            qs = qs.filter(Booking.from_date <= dt, _ends_on_or_after(dt))
+        except ValueError:
+            pass
+    # ?from= / ?to= keep bookings intersecting the date range
+    for key, cond in (('from', _ends_on_or_after), ('to', lambda d: Booking.from_date <= d)):
+        if args.get(key):
+            try:
+                qs = qs.filter(cond(date.fromisoformat(args[key])))
+            except ValueError:
+                pass
+
+    # ?venue= (slug or id) keeps one hall's bookings
+    if args.get('venue'):
+        venue = find_venue(args['venue'])
+        qs = qs.filter(Booking.venue_id == (venue.id if venue else None))
+
+    if args.get('balance_due'):
+        qs = qs.filter(Booking.balance > 0)
+    for key, cond in (('min_amount', lambda v: Booking.total_amount >= v),
+                      ('max_amount', lambda v: Booking.total_amount <= v)):
+        try:
+            qs = qs.filter(cond(float(args[key])))
+        except (KeyError, ValueError):
+            pass
+
+    q = (args.get('q') or '').strip()
+    if q:
+        match = fts_query(q)
+        if not match:
+            return qs.filter(db.false())
+        if db.engine.dialect.name == 'sqlite':
+            qs = qs.filter(Booking.id.in_(
+                select(booking_fts.c.rowid).where(text("booking_fts MATCH :match"))
+            )).params(match=match)
+        else:
+            like = f"%{q}%"
+            qs = qs.filter(or_(Booking.name.ilike(like), Booking.email.ilike(like), Booking.details.ilike(like)))
+    return qs
+
+
+def _series_in_page(series, newest, oldest):
+    """Narrow a series query to those with an occurrence starting between
+    ``oldest`` and ``newest`` (either may be None): nothing outside that range
+    can make it onto the page."""
+    if newest is not None:
+        series = series.filter(Booking.start_at <= newest)
+    if oldest is not None:
+        series = series.filter(Booking.series_end_at > oldest)
+    if uses_span_index() and (newest or oldest):
+        spans = select(booking_span.c.id)
+        if newest is not None:
+            spans = spans.where(booking_span.c.start_min <= epoch_minutes(newest))
+        if oldest is not None:
+            spans = spans.where(booking_span.c.end_min >= epoch_minutes(oldest))
+        series = series.filter(Booking.id.in_(spans))
+    return series
+
+
+def bookings_page(args, page_size=PAGE_SIZE):
+    """One page of filtered bookings plus the cursor for the next page (or None)."""
+    qs = filter_bookings(args)
+    after = decode_cursor(args['cursor']) if args.get('cursor') else None
+    series = qs.filter(Booking.recurrence.isnot(None))
+    qs = qs.filter(Booking.recurrence.is_(None))
+    if after:
+        start, ident = after
+        qs = qs.filter(or_(Booking.start_at < start, and_(Booking.start_at == start, Booking.id < ident)))
+    rows = qs.order_by(Booking.start_at.desc(), Booking.id.desc()).limit(page_size + 1).all()
+    series = _series_in_page(series, after[0] if after else None,
+                             rows[-1].start_at if len(rows) > page_size else None).all()
+    if series:
+        rows = list(islice(heapq.merge(rows, *_series_occurrences(series, after, args),
+                                       key=lambda b: (b.start_at, b.id), reverse=True), page_size + 1))
+    next_cursor = encode_cursor(rows[page_size - 1].start_at, rows[page_size - 1].id) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    os.environ['DATABASE_URL'] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'test.db'}"
+    os.environ['INIT_DB_ON_BOOT'] = '1'
+    from app import app
+    import receipts
+    app.config['TESTING'] = True
+    app.config['JOB_RESULTS_DIR'] = str(tmp_path_factory.mktemp('job_results'))
+    app.config['RECEIPT_CACHE_DIR'] = str(tmp_path_factory.mktemp('receipt_cache'))
+    receipts.init_app(app)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    c = app.test_client()
+    c.post('/login7621', data={'username': 'Shahul', 'password': 'admin123'})
+    return c
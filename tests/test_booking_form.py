@@ -0,0 +1,49 @@
+"""The booking form turns bad ranges into form errors, not server errors."""
+BOOKING = dict(name='Range check', phone='9000000004', email='', details='', from_date='2198-03-05',
+               to_date='2198-03-05', from_time='10:00 PM', to_time='02:00 AM', total_amount='100',
+               advance='0', balance='100')
+REVERSED = dict(from_date='2198-03-05', to_date='2198-03-03', from_time='10:00 AM', to_time='11:00 AM')
+
+
+def find(app, name):
+    from models import db, Booking
+    with app.app_context():
+        db.session.expire_all()
+        return Booking.query.filter_by(name=name).one_or_none()
+
+
+def test_same_day_end_before_start_runs_overnight(app, client):
+    assert client.post('/booking/new', data=BOOKING).status_code == 302
+    b = find(app, 'Range check')
+    assert (b.end_at - b.start_at).total_seconds() == 4 * 3600
+    client.get(f'/booking/{b.id}/delete')
+
+
+def test_new_booking_with_reversed_dates_is_a_form_error(app, client):
+    r = client.post('/booking/new', data=dict(BOOKING, name='Reversed new', **REVERSED))
+    assert r.status_code == 200
+    assert b'ends before it starts' in r.data
+    assert find(app, 'Reversed new') is None
+
+
+def test_edit_to_reversed_dates_is_a_form_error(app, client):
+    client.post('/booking/new', data=dict(BOOKING, name='Reversed edit'))
+    b = find(app, 'Reversed edit')
+    r = client.post(f'/booking/{b.id}/edit', data=dict(BOOKING, name='Reversed edit', **REVERSED))
+    assert r.status_code == 200
+    assert b'ends before it starts' in r.data
+    assert find(app, 'Reversed edit').from_date.isoformat() == '2198-03-05'
+    client.get(f'/booking/{b.id}/delete')
+
+
+def test_malformed_repeat_fields_are_readable_form_errors(app, client):
+    for repeat, message in (({'repeat_every': 'two'}, b'Repeat interval must be a whole number'),
+                            ({'repeat_count': 'x'}, b'A series can have between'),
+                            ({'repeat_count': '', 'repeat_until': '2198-13-01'}, b'not a valid date')):
+        data = dict(BOOKING, name='Bad repeat', repeat='weekly', repeat_count='3')
+        data.update(repeat)
+        r = client.post('/booking/new', data=data)
+        assert r.status_code == 200
+        assert message in r.data
+        assert b'invalid literal' not in r.data and b'isoformat' not in r.data
+    assert find(app, 'Bad repeat') is None
@@ -0,0 +1,35 @@
+"""A hold token only lets its own holder book through the hold."""
+import pytest
+
+BOOKING = dict(phone='9000000009', email='', details='', from_date='2199-06-01', to_date='2199-06-01',
+               from_time='10:00 AM', to_time='11:00 AM', total_amount='100', advance='0', balance='100')
+SLOT = {k: BOOKING[k] for k in ('from_date', 'from_time', 'to_date', 'to_time')}
+
+
+@pytest.fixture
+def colleague(app):
+    from werkzeug.security import generate_password_hash
+    from models import db, User
+    with app.app_context():
+        if not User.query.filter_by(username='colleague').first():
+            db.session.add(User(username='colleague', pw_hash=generate_password_hash('secret')))
+            db.session.commit()
+    c = app.test_client()
+    c.post('/login7621', data={'username': 'colleague', 'password': 'secret'})
+    return c
+
+
+def test_someone_elses_token_does_not_skip_their_hold(app, client, colleague):
+    from models import Booking
+    token = client.post('/api/holds', data=SLOT).get_json()['token']
+    r = colleague.post('/booking/new', data=dict(BOOKING, name='Through a hold', hold_token=token))
+    assert r.status_code == 200
+    assert b'on hold' in r.data
+    assert colleague.post('/api/holds', data=dict(SLOT, token=token)).status_code == 409
+
+    r = client.post('/booking/new', data=dict(BOOKING, name='Own hold', hold_token=token))
+    assert r.status_code == 302
+    with app.app_context():
+        assert Booking.query.filter_by(name='Through a hold').first() is None
+        booking_id = Booking.query.filter_by(name='Own hold').one().id
+    client.get(f'/booking/{booking_id}/delete')
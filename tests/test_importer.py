@@ -0,0 +1,26 @@
+"""Bulk import rejects bad rows one by one and inserts the rest."""
+import csv
+
+HEADER = ['name', 'phone', 'from_date', 'from_time', 'to_date', 'to_time', 'total_amount', 'advance']
+
+
+def test_reversed_row_is_rejected_without_aborting(app, client, tmp_path):
+    from importer import import_bookings
+    from models import db, Booking
+    path = tmp_path / 'bookings.csv'
+    with open(path, 'w', newline='') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(HEADER)
+        writer.writerow(['Import A', '9000000005', '2199-02-01', '10:00 AM', '2199-02-01', '11:00 AM', '100', '0'])
+        writer.writerow(['Import B', '9000000006', '2199-02-05', '10:00 AM', '2199-02-03', '11:00 AM', '100', '0'])
+        writer.writerow(['Import C', '9000000007', '2199-02-02', '10:00 PM', '2199-02-02', '02:00 AM', '100', '0'])
+    with app.app_context():
+        report = import_bookings(str(path))
+        assert report.inserted == 2
+        assert report.rejects == [(3, "to_date / to_time is before from_date / from_time")]
+        names = sorted(b.name for b in Booking.query.filter(Booking.name.like('Import %')))
+        ids = [b.id for b in Booking.query.filter(Booking.name.like('Import %'))]
+        db.session.remove()
+    assert names == ['Import A', 'Import C']
+    for booking_id in ids:
+        client.get(f'/booking/{booking_id}/delete')
@@ -0,0 +1,49 @@
+"""The per-day tables kept up to date on every write (``venue_day_status``,
+``revenue_day`` / ``revenue_month``) must match a full rebuild."""
+import pytest
+
+
+def snapshot(app):
+    from models import db, DayStatus, RevenueDay, RevenueMonth
+    with app.app_context():
+        db.session.expire_all()
+        return (sorted((d.venue_id, d.day, d.booked_minutes, d.bookings, d.status) for d in DayStatus.query),
+                sorted((r.day, r.bookings, r.revenue) for r in RevenueDay.query),
+                sorted((r.month, r.bookings, r.revenue) for r in RevenueMonth.query))
+
+
+def rebuilt(app):
+    from occupancy import rebuild_occupancy
+    from reports import rebuild_rollups
+    with app.app_context():
+        rebuild_occupancy()
+        rebuild_rollups()
+    return snapshot(app)
+
+
+SERIES = dict(name='Weekly class', phone='9000000001', email='class@example.com', details='',
+              from_date='2196-11-03', to_date='2196-11-03', from_time='06:00 PM', to_time='08:00 PM',
+              total_amount='1000', advance='0', balance='1000', repeat='weekly', repeat_count='4')
+
+
+def series_id(app, name):
+    from models import Booking
+    with app.app_context():
+        return Booking.query.filter_by(name=name).one().id
+
+
+@pytest.mark.parametrize('edit', [
+    {'repeat_count': '2'},                                   # fewer occurrences
+    {'repeat_count': '6'},                                   # more occurrences
+    {'from_date': '2196-11-05', 'to_date': '2196-11-05'},    # series moved
+    {'repeat': '', 'repeat_count': ''},                      # series turned into a one-off
+])
+def test_editing_a_series_matches_a_rebuild(app, client, edit):
+    name = f"Series {sorted(edit.items())}"
+    assert client.post('/booking/new', data=dict(SERIES, name=name)).status_code == 302
+    r = client.post(f'/booking/{series_id(app, name)}/edit', data=dict(SERIES, name=name, **edit))
+    assert r.status_code == 302
+    incremental = snapshot(app)
+    assert incremental == rebuilt(app)
+    client.get(f'/booking/{series_id(app, name)}/delete')
+    assert snapshot(app) == rebuilt(app) == ([], [], [])
@@ -0,0 +1,43 @@
+"""Receipts go through the job queue, which must not strand them when no
+``run-jobs`` worker is running."""
+import os
+
+import pytest
+
+
+def new_booking(app, client, name, day):
+    from models import Booking
+    r = client.post('/booking/new', data=dict(
+        name=name, phone='9000000002', email='', details='', from_date=day, to_date=day,
+        from_time='10:00 AM', to_time='11:00 AM', total_amount='500', advance='500', balance='0'))
+    assert r.status_code == 302
+    with app.app_context():
+        return Booking.query.filter_by(name=name).one().id
+
+
+@pytest.fixture
+def worker_present(app):
+    path = os.path.join(app.config['JOB_RESULTS_DIR'], '.workers', 'elsewhere-1')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+    yield
+    os.remove(path)
+
+
+def test_receipt_renders_inline_without_workers(app, client):
+    booking_id = new_booking(app, client, 'Inline receipt', '2197-01-05')
+    r = client.get(f'/booking/{booking_id}/receipt')
+    assert r.status_code == 200
+    assert r.mimetype == 'application/pdf'
+
+
+def test_receipt_is_queued_while_a_worker_runs(app, client, worker_present):
+    import jobs
+    booking_id = new_booking(app, client, 'Queued receipt', '2197-01-06')
+    r = client.get(f'/booking/{booking_id}/receipt', headers={'Accept': 'application/json'})
+    assert r.status_code == 202
+    with app.app_context():
+        assert jobs.run_job(r.get_json()['id'])
+    r = client.get(f'/booking/{booking_id}/receipt')
+    assert r.status_code == 200
+    assert r.mimetype == 'application/pdf'
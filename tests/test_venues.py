@@ -0,0 +1,28 @@
+"""Each venue prints its own contact details on receipts."""
+
+
+def test_original_hall_keeps_its_contact_line(app):
+    from venues import ORIGINAL_CONTACT, default_venue
+    with app.app_context():
+        venue = default_venue()
+        assert (venue.phone, venue.email) == (ORIGINAL_CONTACT['phone'], ORIGINAL_CONTACT['email'])
+
+
+def test_second_hall_prints_only_its_own_contact(app, client):
+    from models import Booking, Venue
+    r = client.post('/venues', data={'name': 'Second Hall', 'address': 'Main Road', 'phone': '0491 123456'})
+    assert r.status_code == 302
+    with app.app_context():
+        venue_id = Venue.query.filter_by(name='Second Hall').one().id
+    r = client.post('/booking/new', data=dict(
+        name='Second hall booking', phone='9000000008', email='', details='', venue_id=venue_id,
+        from_date='2199-04-01', to_date='2199-04-01', from_time='10:00 AM', to_time='11:00 AM',
+        total_amount='100', advance='0', balance='100'))
+    assert r.status_code == 302
+    with app.app_context():
+        b = Booking.query.filter_by(name='Second hall booking').one()
+        assert b.venue_contact == 'Phone: 0491 123456'
+        booking_id = b.id
+    r = client.get(f'/booking/{booking_id}/receipt')
+    assert r.status_code == 200 and r.mimetype == 'application/pdf'
+    client.get(f'/booking/{booking_id}/delete')
@@ -0,0 +1,97 @@
+"""Venues.
+
+One deployment runs several halls.  Every booking and hold belongs to a
+venue, and everything that asks "is this slot free?" -- conflict checks,
+calendars, availability, holds -- is scoped to one: the composite
+``(venue_id, end_at, start_at)`` index and the venue dimension of the
+``booking_span`` R*Tree keep each hall's lookups to its own bookings, so
+adding halls does not slow the others down.  Occupancy is kept per venue
+and day, and ``occupancy.venue_overview`` reads all halls at once from it.
+
+Pages and feeds pick the venue with ``?venue=<slug or id>``; without one
+they show the first venue, which is where existing single-hall data lives.
+"""
+import re
+
+from flask import abort
+from sqlalchemy import select, update
+
+from database import begin_write
+from models import db, Booking, DEFAULT_VENUE_NAME, SlotHold, Venue
+
+
+def slugify(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-') or 'venue'
+
+
+def all_venues():
+    return Venue.query.order_by(Venue.id).all()
+
+
+def default_venue():
+    return Venue.query.order_by(Venue.id).first()
+
+
+def find_venue(value):
+    """The venue with slug or id ``value``, or None."""
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return db.session.get(Venue, int(value))
+    return Venue.query.filter_by(slug=value).first()
+
+
+def venue_from_args(args):
+    """The venue a request names with ?venue=, the default one when it names
+    none; 404 for an unknown venue."""
+    if not args.get('venue'):
+        return default_venue() or abort(404)
+    return find_venue(args['venue']) or abort(404)
+
+
+def add_venue(name, address=None, slug=None, phone=None, email=None):
+    """Create a venue (the caller commits).  Raises ValueError for a taken name or slug."""
+    name = name.strip()
+    if not name:
+        raise ValueError("A venue needs a name.")
+    slug = slugify(slug or name)
+    if Venue.query.filter((Venue.name == name) | (Venue.slug == slug)).first():
+        raise ValueError(f"A venue named {name!r} (or with slug {slug!r}) already exists.")
+    venue = Venue(name=name, slug=slug, address=(address or '').strip() or None,
+                  phone=(phone or '').strip() or None, email=(email or '').strip() or None)
+    db.session.add(venue)
+    return venue
+
+
+def _unassigned(model):
+    return db.session.execute(select(model.id).where(model.venue_id.is_(None)).limit(1)).first() is not None
+
+
+# The original hall's receipt contact line, from before venues had their own.
+ORIGINAL_CONTACT = {'phone': '(+91) 82811 42279, 95679 41222', 'email': 'Shahul.kav@gmail.com'}
+_ORIGINAL_WITHOUT_CONTACT = (Venue.name == DEFAULT_VENUE_NAME) & Venue.phone.is_(None) & Venue.email.is_(None)
+
+
+def ensure_venues():
+    """Create the original hall when there are no venues yet and give it the
+    bookings and holds made before venues existed (and the contact details
+    its receipts used to print).  Every boot calls this, so it only takes the
+    write lock when there is something to do."""
+    venue = default_venue()
+    if (venue is not None and not any(_unassigned(model) for model in (Booking, SlotHold))
+            and db.session.execute(select(Venue.id).where(_ORIGINAL_WITHOUT_CONTACT)).first() is None):
+        db.session.commit()
+        return venue
+    begin_write()
+    venue = default_venue()  # another worker may have got here first
+    if venue is None:
+        venue = Venue(name=DEFAULT_VENUE_NAME, slug=slugify(DEFAULT_VENUE_NAME),
+                      address='Near Telephone Exchange, Mundur -I, Kerala 678592', **ORIGINAL_CONTACT)
+        db.session.add(venue)
+        db.session.flush()
+    db.session.execute(update(Venue).where(_ORIGINAL_WITHOUT_CONTACT).values(**ORIGINAL_CONTACT))
+    for model in (Booking, SlotHold):
+        db.session.execute(update(model).where(model.venue_id.is_(None)).values(venue_id=venue.id))
+    db.session.commit()
+    return venue